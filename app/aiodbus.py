@@ -0,0 +1,187 @@
+from dbus_next import Message, MessageType, Variant
+from dbus_next.aio import MessageBus
+from typing import Callable, Optional
+import asyncio
+import logging
+import weakref
+from engine import BLOCKING_CALL_REFUSED, weak_handler
+
+BUS_NAME = "org.freedesktop.DBus"
+BUS_PATH = "/org/freedesktop/DBus"
+
+# tasks must be referenced until they are done
+_background_tasks = set()
+
+def _spawn(loop: asyncio.AbstractEventLoop, coroutine) -> None:
+    task = loop.create_task(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+def _signature(args) -> str:
+    """D-Bus signature of call arguments, dbus-next needs it where QtDBus derives it from the values.
+    """
+    signature = ""
+    for arg in args:
+        # bool first, it's a subclass of int
+        if isinstance(arg, bool):
+            signature += "b"
+        elif isinstance(arg, int):
+            signature += "i"
+        elif isinstance(arg, float):
+            signature += "d"
+        elif isinstance(arg, str):
+            signature += "s"
+        elif isinstance(arg, (bytes, bytearray)):
+            signature += "ay"
+        elif isinstance(arg, list) and all(isinstance(item, str) for item in arg):
+            signature += "as"
+        else:
+            raise TypeError(f"No D-Bus signature for argument {arg!r}")
+    return signature
+
+def _unwrap(value):
+    """Replaces variants by their values, like QtDBus returns them.
+    """
+    if isinstance(value, Variant):
+        return _unwrap(value.value)
+    if isinstance(value, dict):
+        return {key: _unwrap(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_unwrap(item) for item in value]
+    return value
+
+async def _bus_call(bus: MessageBus, member: str, rule: str) -> None:
+    reply = await bus.call(Message(destination=BUS_NAME, path=BUS_PATH, interface=BUS_NAME, member=member, signature="s", body=[rule]))
+    if reply.message_type == MessageType.ERROR:
+        logging.warning(f"{member} {rule} failed: {reply.body[0] if reply.body else reply.error_name}")
+
+def _remove_matches(bus: MessageBus, loop: asyncio.AbstractEventLoop, rules: list[str]) -> None:
+    if loop.is_closed() or not bus.connected:
+        return
+    for rule in rules:
+        loop.call_soon_threadsafe(_spawn, loop, _bus_call(bus, "RemoveMatch", rule))
+
+class _SignalRouter():
+    """Passes the signals received on a bus on to the transports of the objects that sent them.
+    """
+    def __init__(self, bus: MessageBus) -> None:
+        # object path -> transport of the object, there is one per path (see engine.create_transport)
+        self._transports = weakref.WeakValueDictionary()
+        # service -> transports that watch it being registered
+        self._watchers = {}
+        bus.add_message_handler(self._message_received)
+
+    def add(self, path: str, transport: "AioDBusTransport") -> None:
+        self._transports[path] = transport
+
+    def watch(self, service: str, transport: "AioDBusTransport") -> None:
+        self._watchers.setdefault(service, weakref.WeakSet()).add(transport)
+
+    def _message_received(self, msg: Message):
+        if msg.message_type != MessageType.SIGNAL:
+            return None
+        if msg.path == BUS_PATH and msg.member == "NameOwnerChanged":
+            service, old_owner, new_owner = msg.body
+            if new_owner:
+                for transport in list(self._watchers.get(service, ())):
+                    transport._service_registered()
+            return None
+        transport = self._transports.get(msg.path)
+        if transport is not None:
+            transport._signal_received(msg)
+        return None
+
+# bus -> router, one per connection
+_routers = weakref.WeakKeyDictionary()
+
+def _router(bus: MessageBus) -> _SignalRouter:
+    router = _routers.get(bus)
+    if router is None:
+        router = _routers[bus] = _SignalRouter(bus)
+    return router
+
+class AioDBusTransport():
+    """Calls and signals of one D-Bus object through dbus-next, used by `DBusWrapper` if the bridge
+    runs on the asyncio engine. Same interface as `QtDBusTransport`.
+
+    Blocking calls only work while the loop is not running, i.e. during setup. Once it runs, all
+    calls have to be made with `call_async`, which sends them concurrently.
+    """
+    __slots__ = ("_bus", "_loop", "_service", "_path", "_signal_handlers", "_registration_handlers", "_match_rules", "__weakref__")
+
+    def __init__(self, bus: MessageBus, loop: asyncio.AbstractEventLoop, service: str, path: str) -> None:
+        self._bus = bus
+        self._loop = loop
+        self._service = service
+        self._path = path
+        # (interface, signal) -> handlers
+        self._signal_handlers = {}
+        self._registration_handlers = []
+        # match rules of this object, removed from the bus once it's gone
+        self._match_rules = []
+        _router(bus).add(path, self)
+        weakref.finalize(self, _remove_matches, bus, loop, self._match_rules)
+
+    def _add_match(self, rule: str) -> None:
+        self._match_rules.append(rule)
+        _spawn(self._loop, _bus_call(self._bus, "AddMatch", rule))
+
+    async def _call(self, interface_name: str, method_name: str, args, timeout: int) -> tuple[object, Optional[str]]:
+        try:
+            msg = Message(destination=self._service, path=self._path, interface=interface_name, member=method_name,
+                          signature=_signature(args), body=list(args))
+            reply = await asyncio.wait_for(self._bus.call(msg), timeout / 1000)
+        except asyncio.TimeoutError:
+            return None, f"no reply within {timeout} ms"
+        except Exception as e:
+            return None, str(e)
+        if reply.message_type == MessageType.ERROR:
+            return None, reply.body[0] if reply.body else reply.error_name
+        return (_unwrap(reply.body[0]) if reply.body else None), None
+
+    def call(self, interface_name: str, method_name: str, args, timeout: int) -> tuple[object, Optional[str]]:
+        """Call a method and wait for the reply, see `QtDBusTransport.call`.
+        """
+        if self._loop.is_running():
+            return None, BLOCKING_CALL_REFUSED
+        return self._loop.run_until_complete(self._call(interface_name, method_name, args, timeout))
+
+    def call_async(self, interface_name: str, method_name: str, args, timeout: int, callback: Callable[[object, Optional[str]], None]) -> None:
+        """Call a method without waiting for the reply, see `QtDBusTransport.call_async`.
+        """
+        async def call():
+            callback(*await self._call(interface_name, method_name, args, timeout))
+        self._loop.call_soon_threadsafe(_spawn, self._loop, call())
+
+    def connect_signal(self, interface_name: str, signal_name: str, handler: Callable[..., None]) -> Callable[..., None]:
+        key = (interface_name, signal_name)
+        if key not in self._signal_handlers:
+            self._signal_handlers[key] = []
+            self._add_match(f"type='signal',path='{self._path}',interface='{interface_name}',member='{signal_name}'")
+        connection = weak_handler(handler)
+        self._signal_handlers[key].append(connection)
+        return connection
+
+    def disconnect_signal(self, interface_name: str, signal_name: str, connection: Callable[..., None]) -> None:
+        key = (interface_name, signal_name)
+        handlers = self._signal_handlers.get(key)
+        if handlers is not None:
+            self._signal_handlers[key] = [handler for handler in handlers if handler is not connection]
+
+    def _signal_received(self, msg: Message) -> None:
+        handlers = self._signal_handlers.get((msg.interface, msg.member))
+        if not handlers:
+            return
+        args = [_unwrap(arg) for arg in msg.body]
+        for handler in handlers:
+            handler(*args)
+
+    def watch_registration(self, handler: Callable[[], None]) -> None:
+        if not self._registration_handlers:
+            _router(self._bus).watch(self._service, self)
+            self._add_match(f"type='signal',sender='{BUS_NAME}',interface='{BUS_NAME}',member='NameOwnerChanged',arg0='{self._service}'")
+        self._registration_handlers.append(weak_handler(handler))
+
+    def _service_registered(self) -> None:
+        for handler in self._registration_handlers:
+            handler()
@@ -0,0 +1,110 @@
+from filecache import FileCache, digest, guess_extension
+from metrics import registry
+from typing import Optional
+from urllib.parse import unquote, urlparse
+import io
+import logging
+import os
+
+class AlbumArtCache(FileCache):
+    """Album art of the MPRIS remotes, ready to be published as image.
+
+    KDE Connect downloads the art of the playing track and reports it as file url. The art is
+    cached by the hash of that file, optionally downscaled to fit `max_size` pixels and stored as
+    JPEG. An album that comes back costs one read of its file, no scaling, and the caller can tell
+    from the hash that the art didn't change at all.
+
+    Downscaling needs Pillow, without it the art is cached as it is and keeps its format, see
+    `content_type`. Art in a format that can't be told from its leading bytes is not cached.
+    Loading reads and hashes files, it should not run on the event loop.
+    """
+    DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+    # content type of the image entity until art was loaded, downscaled art is always encoded as JPEG
+    CONTENT_TYPE = "image/jpeg"
+    # file extension of cached art -> content type it is published with
+    CONTENT_TYPES = {".jpg": "image/jpeg", ".png": "image/png", ".gif": "image/gif", ".webp": "image/webp"}
+    JPEG_QUALITY = 85
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES, max_size: Optional[int] = None) -> None:
+        """
+        Args:
+            path (str): directory of the cache, created if it doesn't exist
+            max_bytes (int, optional): maximum size of all cached art
+            max_size (int, optional): maximum width and height in pixels, None keeps the art as it is
+        """
+        super().__init__(path, max_bytes, "album art cache")
+        if max_size is not None:
+            try:
+                import PIL.Image
+            except ImportError:
+                logging.warning("Pillow is not installed, album art is not downscaled")
+                max_size = None
+        self._max_size = max_size
+
+    def load(self, url: str) -> Optional[tuple[str, str]]:
+        """Cache the art at a url unless it's cached already.
+
+        Args:
+            url (str): file url of the art, other urls are not fetched
+
+        Returns:
+            Optional[tuple[str, str]]: the key of the art, the hash of its original file, and the path of
+                the cached art or None if it could not be read
+        """
+        source_path = self._local_path(url)
+        if source_path is None:
+            logging.debug(f"Not loading album art from {url}, only local files are supported")
+            return None
+        try:
+            with open(source_path, "rb") as source_file:
+                source = source_file.read()
+        except OSError as e:
+            logging.warning(f"Failed to read album art {source_path}: {e}")
+            return None
+        if not source:
+            return None
+        key = digest(source)[:32]
+        path = self.get(key)
+        if path is not None:
+            registry.inc("kdeconnect_album_art_cache_hits_total")
+            return key, path
+        registry.inc("kdeconnect_album_art_cache_misses_total")
+        art = self._scale(source)
+        extension = guess_extension(art, None)
+        if extension not in self.CONTENT_TYPES:
+            logging.debug(f"Not caching album art {source_path}, its format is not known")
+            return None
+        path = self.put(key, art, extension)
+        return None if path is None else (key, path)
+
+    @classmethod
+    def content_type(cls, path: str) -> str:
+        """Returns the content type of cached art from the extension of its file.
+        """
+        return cls.CONTENT_TYPES.get(os.path.splitext(path)[1], cls.CONTENT_TYPE)
+
+    @staticmethod
+    def _local_path(url: str) -> Optional[str]:
+        if url.startswith("/"):
+            return url
+        parsed = urlparse(url)
+        if parsed.scheme != "file":
+            return None
+        return unquote(parsed.path)
+
+    def _scale(self, source: bytes) -> bytes:
+        if self._max_size is None:
+            return source
+        from PIL import Image
+        try:
+            with Image.open(io.BytesIO(source)) as image:
+                if max(image.size) <= self._max_size and image.format == "JPEG":
+                    return source
+                image.thumbnail((self._max_size, self._max_size))
+                scaled = io.BytesIO()
+                image.convert("RGB").save(scaled, "JPEG", quality=self.JPEG_QUALITY)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            # Pillow raises OSError for formats it can't read
+            logging.warning(f"Failed to downscale album art, keeping it as it is: {e}")
+            return source
+        return scaled.getvalue()
@@ -0,0 +1,145 @@
+from typing import Callable, Optional
+from metrics import registry
+import engine
+import logging
+
+class CircuitBreaker():
+    """Health of a device, shared by the D-Bus wrappers of its plugins.
+
+    The circuit opens after `failure_threshold` consecutive failed calls or when the device went
+    out of reach. While it's open, calls fail right away instead of waiting for their timeout.
+    After a backoff the circuit goes half-open: the probe runs and a single call is let through,
+    if either succeeds the circuit closes again, otherwise it opens with a doubled backoff.
+    The device becoming reachable closes it at once.
+
+    Must be used from the thread of the event loop.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    DEFAULT_FAILURE_THRESHOLD = 3
+    # seconds until the first probe, doubled with every failed probe up to the maximum
+    DEFAULT_INITIAL_BACKOFF = 5.0
+    DEFAULT_MAX_BACKOFF = 300.0
+
+    __slots__ = ("_name", "_probe", "_failure_threshold", "_initial_backoff", "_max_backoff", "_backoff", "_state", "_failures",
+                 "_trial_in_flight", "_generation", "_changed_handlers")
+
+    def __init__(self, name: str, probe: Optional[Callable[[Callable[[bool], None]], None]] = None, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 initial_backoff: float = DEFAULT_INITIAL_BACKOFF, max_backoff: float = DEFAULT_MAX_BACKOFF) -> None:
+        """
+        Args:
+            name (str): name of the device in logs and metrics
+            probe (Callable[[Callable[[bool], None]], None], optional): checks the device when the
+                circuit goes half-open and calls back with True if it's healthy
+            failure_threshold (int, optional): consecutive failures that open the circuit
+            initial_backoff (float, optional): seconds the circuit stays open the first time
+            max_backoff (float, optional): maximum seconds the circuit stays open
+        """
+        self._name = name
+        self._probe = probe
+        self._failure_threshold = failure_threshold
+        self._initial_backoff = initial_backoff
+        self._max_backoff = max_backoff
+        self._backoff = initial_backoff
+        self._state = self.CLOSED
+        self._failures = 0
+        self._trial_in_flight = False
+        # increased whenever the circuit opens, timers of earlier openings are ignored
+        self._generation = 0
+        self._changed_handlers = []
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    @property
+    def available(self) -> bool:
+        """True if calls to the device are expected to succeed.
+        """
+        return self._state == self.CLOSED
+
+    def allow(self) -> bool:
+        """Returns if a call may be sent, a call let through while the circuit is half-open is the trial.
+        """
+        if self._state == self.CLOSED:
+            return True
+        if self._state == self.HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self._failures = 0
+        if self._state == self.CLOSED:
+            self._backoff = self._initial_backoff
+        elif self._state == self.HALF_OPEN:
+            logging.info(f"{self._name} answers again")
+            self._backoff = self._initial_backoff
+            self._set_state(self.CLOSED)
+
+    def record_failure(self) -> None:
+        if self._state == self.HALF_OPEN:
+            self._open(self._backoff * 2)
+            return
+        self._failures += 1
+        if self._state == self.CLOSED and self._failures >= self._failure_threshold:
+            logging.warning(f"{self._name} failed {self._failures} calls in a row, failing calls for {self._backoff:.0f} s")
+            self._open(self._backoff)
+
+    def set_reachable(self, reachable: bool) -> None:
+        """Apply the reachability reported by the daemon.
+        """
+        if reachable:
+            self._failures = 0
+            self._backoff = self._initial_backoff
+            self._set_state(self.CLOSED)
+        elif self._state != self.OPEN:
+            self._open(self._backoff)
+
+    def _open(self, backoff: float) -> None:
+        self._backoff = min(backoff, self._max_backoff)
+        self._trial_in_flight = False
+        self._generation += 1
+        generation = self._generation
+        if self._state != self.OPEN:
+            registry.inc("kdeconnect_circuit_opened_total", {"device": self._name})
+        self._set_state(self.OPEN)
+        engine.call_later(self._backoff, lambda: self._half_open(generation))
+
+    def _half_open(self, generation: int) -> None:
+        if generation != self._generation or self._state != self.OPEN:
+            return
+        self._set_state(self.HALF_OPEN)
+        if self._probe is not None:
+            self._probe(lambda healthy: self._probed(generation, healthy))
+
+    def _probed(self, generation: int, healthy: bool) -> None:
+        if generation != self._generation or self._state != self.HALF_OPEN:
+            return
+        if healthy:
+            logging.info(f"{self._name} is reachable again")
+            self._failures = 0
+            self._set_state(self.CLOSED)
+        else:
+            self._open(self._backoff * 2)
+
+    def _set_state(self, state: str) -> None:
+        was_available = self.available
+        self._state = state
+        if self.available != was_available:
+            for handler in self._changed_handlers:
+                handler(self.available)
+
+    def close(self) -> None:
+        """Cancel the pending probe and stop notifying the handlers, e.g. once the device was removed.
+        """
+        self._generation += 1
+        self._probe = None
+        self._changed_handlers = []
+
+    def notify_available_changed(self, handler: Callable[[bool], None]) -> None:
+        """Register a handler that is called with False when the circuit opened and with True when it closed again.
+        """
+        self._changed_handlers.append(handler)
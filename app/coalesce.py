@@ -0,0 +1,91 @@
+from typing import Callable, Optional
+import logging
+import math
+import time
+import engine
+import signaltrace
+
+class Coalescer():
+    """Limits how often handlers run, per key.
+
+    The first update after a quiet period is passed on immediately. Updates that arrive within
+    the minimum interval of a key are merged: only the latest arguments are kept and passed on
+    once the interval elapsed (trailing edge), so the final state is never lost.
+
+    Must be used from the thread of the event loop.
+    """
+
+    def __init__(self, intervals: Optional[dict[str, float]] = None, default_interval: float = 0.0) -> None:
+        """
+        Args:
+            intervals (dict[str, float], optional): minimum interval in seconds per key
+            default_interval (float, optional): interval for keys without an entry, 0 disables coalescing
+        """
+        self._intervals = dict(intervals or {})
+        self._default_interval = default_interval
+        self._last_run = {}
+        # key -> (handler, args, trace) waiting for the end of the interval, the trace is the one
+        # of the first traced update of the interval (see signaltrace.py)
+        self._pending = {}
+
+    def set_interval(self, key: str, interval: float) -> None:
+        self._intervals[key] = interval
+
+    def interval(self, key: str) -> float:
+        return self._intervals.get(key, self._default_interval)
+
+    def wrap(self, key: str, handler: Callable, interval_key: Optional[str] = None) -> Callable:
+        """Returns a function that passes its arguments to the handler through the coalescer.
+
+        Args:
+            key (str): key the updates are merged by, e.g. the unique id of an entity
+            handler (Callable): handler to be called
+            interval_key (str, optional): key to look up the interval with, defaults to key
+
+        Returns:
+            Callable: the coalescing function
+        """
+        interval_key = key if interval_key is None else interval_key
+
+        def coalesced(*args):
+            self.submit(key, handler, *args, interval=self.interval(interval_key))
+        return coalesced
+
+    def submit(self, key: str, handler: Callable, *args, interval: Optional[float] = None) -> None:
+        """Run the handler now or at the end of the interval of the key with the latest arguments.
+        """
+        if interval is None:
+            interval = self.interval(key)
+        if interval <= 0:
+            handler(*args)
+            return
+        pending = self._pending.get(key)
+        if pending is not None:
+            # a flush is already scheduled, it will pick up the latest arguments
+            self._pending[key] = (handler, args, pending[2] or signaltrace.current())
+            return
+        elapsed = time.monotonic() - self._last_run.get(key, -math.inf)
+        if elapsed >= interval:
+            self._last_run[key] = time.monotonic()
+            handler(*args)
+            return
+        self._pending[key] = (handler, args, signaltrace.current())
+        engine.call_later(interval - elapsed, lambda: self._flush(key))
+
+    def cancel(self, key: str) -> None:
+        """Drop the update of a key that waits for the end of its interval, e.g. once its entity was removed.
+        """
+        self._pending.pop(key, None)
+
+    def _flush(self, key: str) -> None:
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            return
+        handler, args, trace = pending
+        self._last_run[key] = time.monotonic()
+        # runs from a timer, nothing catches what the handler raises
+        try:
+            with signaltrace.resumed(trace):
+                handler(*args)
+        except Exception:
+            logging.exception(f"Rate limited update of {key} failed")
@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from typing import Callable, Optional
+from metrics import registry
+import engine
+import logging
+import threading
+
+# a command is called with a function it has to call once it's done, e.g. from the callback of a D-Bus call
+Command = Callable[[Callable[[], None]], None]
+
+class CommandQueue():
+    """Runs commands received over MQTT on the event loop instead of the MQTT network thread.
+
+    Commands are queued per key, e.g. the unique id of an entity. A command that arrives while
+    another one of its key waits replaces it (last write wins), so a dragged volume slider results
+    in one call with the final value instead of a backlog. Only one command per key runs at a time,
+    the next one starts once the running one is done.
+
+    `submit` is thread safe, commands run in the thread of the event loop.
+    """
+    # keys waiting at most, the oldest command is dropped if another key arrives
+    DEFAULT_MAX_DEPTH = 64
+
+    def __init__(self, max_depth: int = DEFAULT_MAX_DEPTH) -> None:
+        """
+        Args:
+            max_depth (int, optional): maximum number of keys with a waiting command
+        """
+        self._max_depth = max_depth
+        # key -> (command, dropped callback) waiting to run, in order of arrival
+        self._pending = OrderedDict()
+        # keys with a command that was started and isn't done yet
+        self._running = set()
+        self._scheduled = False
+        self._lock = threading.Lock()
+
+    def submit(self, key: str, command: Command, dropped: Optional[Callable[[], None]] = None) -> None:
+        """Queue a command, it replaces a command of the same key that didn't start yet.
+
+        Args:
+            key (str): key of the command
+            command (Command): the command
+            dropped (Callable[[], None], optional): called instead of the command if it is replaced
+                or dropped before it started, e.g. to free what it holds. Runs in the thread of the
+                caller of `submit`.
+        """
+        labels = {"entity": key}
+        with self._lock:
+            if key in self._pending:
+                _, replaced = self._pending[key]
+                self._pending[key] = (command, dropped)
+                registry.inc("kdeconnect_commands_coalesced_total", labels)
+            else:
+                replaced = None
+                if len(self._pending) >= self._max_depth:
+                    dropped_key, (_, replaced) = self._pending.popitem(last=False)
+                    registry.inc("kdeconnect_commands_dropped_total", {"entity": dropped_key})
+                    logging.warning(f"Command queue is full, dropping command for {dropped_key}")
+                self._pending[key] = (command, dropped)
+                registry.inc("kdeconnect_commands_total", labels)
+                self._schedule()
+        if replaced is not None:
+            replaced()
+
+    def _schedule(self) -> None:
+        # must hold the lock
+        if not self._scheduled:
+            self._scheduled = True
+            engine.call_soon_threadsafe(self._run)
+
+    def _run(self) -> None:
+        with self._lock:
+            self._scheduled = False
+            ready = [key for key in self._pending if key not in self._running]
+            commands = [(key, self._pending.pop(key)[0]) for key in ready]
+            self._running.update(ready)
+        for key, command in commands:
+            try:
+                command(lambda key=key: self._done(key))
+            except Exception:
+                logging.exception(f"Command for {key} failed")
+                self._done(key)
+
+    def _done(self, key: str) -> None:
+        with self._lock:
+            if key not in self._running:
+                # done was called twice
+                return
+            self._running.discard(key)
+            if key in self._pending:
+                self._schedule()
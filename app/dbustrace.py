@@ -0,0 +1,436 @@
+"""Record the D-Bus traffic of the bridge and replay it without a bus.
+
+A trace holds every signal the bridge received and every call it made with its reply, with
+the time it happened. Replaying it against `ReplayBus` turns an incident, e.g. a volume slider
+dragged for a minute or a phone flapping between reachable and unreachable, into a repeatable
+load test, see bench/replay.py.
+
+The trace is a gzip compressed file with one json array per line. Strings like paths and
+interface names are written once as `["n", id, string]` and referenced by their id afterwards:
+
+* `[time, "s", service, path, interface, signal, args]`: signal received
+* `[time, "c", service, path, interface, method, args, result, error, duration]`: call made,
+  time is when it was sent, duration until the reply arrived
+* `[time, "r", service]`: service registered on the bus, e.g. the daemon restarted
+
+Times are seconds since the recording started, bytes are written as `{"$b": <base64>}`.
+"""
+from engine import weak_handler
+from typing import Callable, Optional
+import atexit
+import base64
+import bisect
+import engine
+import gzip
+import json
+import logging
+import threading
+import time
+import weakref
+
+TRACE_VERSION = 1
+
+def _encode(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        return {"$b": base64.b64encode(value).decode()}
+    if isinstance(value, dict):
+        return {str(key): _encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+    if hasattr(value, "data"):
+        # QByteArray
+        return _encode(bytes(value.data()))
+    return str(value)
+
+def _decode(value):
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    if isinstance(value, dict):
+        if len(value) == 1 and "$b" in value:
+            return base64.b64decode(value["$b"])
+        return {key: _decode(item) for key, item in value.items()}
+    return value
+
+class TraceRecorder():
+    """Writes the events of a trace to a file.
+
+    Events are buffered and written every `FLUSH_INTERVAL` seconds, recording stops once
+    `max_bytes` of uncompressed events were written. Thread safe.
+    """
+    DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+    FLUSH_INTERVAL = 5.0
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        """
+        Args:
+            path (str): file to write the trace to, it is replaced
+            max_bytes (int, optional): uncompressed size of the events after which recording stops
+        """
+        self._path = path
+        self._max_bytes = max_bytes
+        self._started = time.monotonic()
+        # string -> id
+        self._strings = {}
+        self._lines = []
+        self._written = 0
+        self._flush_timer = None
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._file.write(json.dumps({"version": TRACE_VERSION, "started": time.time()}) + "\n")
+        atexit.register(self.close)
+
+    def _id(self, string: str) -> int:
+        # must hold the lock
+        string_id = self._strings.get(string)
+        if string_id is None:
+            string_id = self._strings[string] = len(self._strings)
+            self._lines.append(json.dumps(["n", string_id, string]))
+        return string_id
+
+    def _add(self, timestamp: float, kind: str, strings: tuple[str, ...], values: list) -> None:
+        with self._lock:
+            if self._file is None:
+                return
+            event = [round(timestamp - self._started, 4), kind, *[self._id(string) for string in strings], *[_encode(value) for value in values]]
+            line = json.dumps(event, separators=(",", ":"))
+            self._written += len(line) + 1
+            if self._written > self._max_bytes:
+                logging.warning(f"D-Bus trace {self._path} reached {self._max_bytes} bytes, recording stopped")
+                self._close()
+                return
+            self._lines.append(line)
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.FLUSH_INTERVAL, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def signal(self, service: str, path: str, interface_name: str, signal_name: str, args) -> None:
+        self._add(time.monotonic(), "s", (service, path, interface_name, signal_name), [list(args)])
+
+    def call(self, service: str, path: str, interface_name: str, method_name: str, args, result, error: Optional[str], sent: float) -> None:
+        """Record a call that was sent at the monotonic time `sent` and just returned.
+        """
+        self._add(sent, "c", (service, path, interface_name, method_name), [list(args), result, error, round(time.monotonic() - sent, 4)])
+
+    def registration(self, service: str) -> None:
+        self._add(time.monotonic(), "r", (service,), [])
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_timer = None
+            self._write()
+
+    def _write(self) -> None:
+        # must hold the lock
+        if self._file is None or not self._lines:
+            return
+        self._file.write("\n".join(self._lines) + "\n")
+        self._lines = []
+        self._file.flush()
+
+    def close(self) -> None:
+        """Write all buffered events and close the file, nothing is recorded afterwards.
+        """
+        with self._lock:
+            self._close()
+
+    def _close(self) -> None:
+        # must hold the lock
+        if self._file is None:
+            return
+        self._write()
+        self._file.close()
+        self._file = None
+
+class _Tap():
+    """Passes signals and registrations of a wrapped transport to the recording transport that owns it,
+    without keeping the recording transport alive.
+    """
+    __slots__ = ("_transport", "_interface_name", "_signal_name", "__weakref__")
+
+    def __init__(self, transport: "RecordingTransport", interface_name: str = "", signal_name: str = "") -> None:
+        self._transport = weakref.ref(transport)
+        self._interface_name = interface_name
+        self._signal_name = signal_name
+
+    def signal(self, *args) -> None:
+        transport = self._transport()
+        if transport is not None:
+            transport._signal_received(self._interface_name, self._signal_name, args)
+
+    def registered(self) -> None:
+        transport = self._transport()
+        if transport is not None:
+            transport._service_registered()
+
+class RecordingTransport():
+    """Wraps the transport of an object on the bus and records its calls and signals.
+    """
+    __slots__ = ("_recorder", "_transport", "_service", "_path", "_signal_handlers", "_registration_handlers", "_taps", "__weakref__")
+
+    def __init__(self, recorder: TraceRecorder, transport, service: str, path: str) -> None:
+        self._recorder = recorder
+        self._transport = transport
+        self._service = service
+        self._path = path
+        # (interface, signal) -> handlers
+        self._signal_handlers = {}
+        self._registration_handlers = []
+        # the wrapped transport holds them weakly
+        self._taps = []
+
+    def call(self, interface_name: str, method_name: str, args, timeout: int) -> tuple[object, Optional[str]]:
+        sent = time.monotonic()
+        result, error = self._transport.call(interface_name, method_name, args, timeout)
+        self._recorder.call(self._service, self._path, interface_name, method_name, args, result, error, sent)
+        return result, error
+
+    def call_async(self, interface_name: str, method_name: str, args, timeout: int, callback: Callable[[object, Optional[str]], None]) -> None:
+        sent = time.monotonic()
+
+        def finished(result, error: Optional[str]):
+            self._recorder.call(self._service, self._path, interface_name, method_name, args, result, error, sent)
+            callback(result, error)
+        self._transport.call_async(interface_name, method_name, args, timeout, finished)
+
+    def connect_signal(self, interface_name: str, signal_name: str, handler: Callable[..., None]) -> Callable[..., None]:
+        key = (interface_name, signal_name)
+        if key not in self._signal_handlers:
+            self._signal_handlers[key] = []
+            tap = _Tap(self, interface_name, signal_name)
+            self._taps.append(tap)
+            self._transport.connect_signal(interface_name, signal_name, tap.signal)
+        connection = weak_handler(handler)
+        self._signal_handlers[key].append(connection)
+        return connection
+
+    def disconnect_signal(self, interface_name: str, signal_name: str, connection: Callable[..., None]) -> None:
+        key = (interface_name, signal_name)
+        handlers = self._signal_handlers.get(key)
+        if handlers is not None:
+            self._signal_handlers[key] = [handler for handler in handlers if handler is not connection]
+
+    def _signal_received(self, interface_name: str, signal_name: str, args) -> None:
+        self._recorder.signal(self._service, self._path, interface_name, signal_name, args)
+        for handler in self._signal_handlers.get((interface_name, signal_name), ()):
+            handler(*args)
+
+    def watch_registration(self, handler: Callable[[], None]) -> None:
+        if not self._registration_handlers:
+            tap = _Tap(self)
+            self._taps.append(tap)
+            self._transport.watch_registration(tap.registered)
+        self._registration_handlers.append(weak_handler(handler))
+
+    def _service_registered(self) -> None:
+        self._recorder.registration(self._service)
+        for handler in self._registration_handlers:
+            handler()
+
+def record(path: str, max_bytes: int = TraceRecorder.DEFAULT_MAX_BYTES) -> TraceRecorder:
+    """Record the D-Bus traffic of the bridge to a trace file.
+
+    Must be called after the engine was selected (see engine.py) and before the first
+    `KDEConnect*` object is created.
+
+    Args:
+        path (str): file to write the trace to
+        max_bytes (int, optional): uncompressed size after which recording stops
+
+    Returns:
+        TraceRecorder: the recorder, close it to stop recording
+    """
+    recorder = TraceRecorder(path, max_bytes)
+    engine.use_transport_factory(lambda service, object_path: RecordingTransport(recorder, engine.create_bus_transport(service, object_path), service, object_path))
+    return recorder
+
+class ReplayTransport():
+    """Transport of an object on a `ReplayBus`, same interface as `QtDBusTransport`.
+    """
+    __slots__ = ("_bus", "_service", "_path", "_signal_handlers", "_registration_handlers", "__weakref__")
+
+    def __init__(self, bus: "ReplayBus", service: str, path: str) -> None:
+        self._bus = bus
+        self._service = service
+        self._path = path
+        # (interface, signal) -> handlers
+        self._signal_handlers = {}
+        self._registration_handlers = []
+
+    def call(self, interface_name: str, method_name: str, args, timeout: int) -> tuple[object, Optional[str]]:
+        result, error, _ = self._bus.answer(self._service, self._path, interface_name, method_name, args)
+        return result, error
+
+    def call_async(self, interface_name: str, method_name: str, args, timeout: int, callback: Callable[[object, Optional[str]], None]) -> None:
+        result, error, delay = self._bus.answer(self._service, self._path, interface_name, method_name, args)
+        # replies arrive as late as they did when the trace was recorded, scaled by the speed of the replay
+        engine.call_soon_threadsafe(lambda: engine.call_later(delay, lambda: callback(result, error)))
+
+    def connect_signal(self, interface_name: str, signal_name: str, handler: Callable[..., None]) -> Callable[..., None]:
+        connection = weak_handler(handler)
+        self._signal_handlers.setdefault((interface_name, signal_name), []).append(connection)
+        return connection
+
+    def disconnect_signal(self, interface_name: str, signal_name: str, connection: Callable[..., None]) -> None:
+        key = (interface_name, signal_name)
+        handlers = self._signal_handlers.get(key)
+        if handlers is not None:
+            self._signal_handlers[key] = [handler for handler in handlers if handler is not connection]
+
+    def _signal_received(self, interface_name: str, signal_name: str, args: list) -> bool:
+        handlers = self._signal_handlers.get((interface_name, signal_name))
+        if not handlers:
+            return False
+        for handler in handlers:
+            handler(*args)
+        return True
+
+    def watch_registration(self, handler: Callable[[], None]) -> None:
+        self._registration_handlers.append(weak_handler(handler))
+
+    def _service_registered(self) -> None:
+        for handler in self._registration_handlers:
+            handler()
+
+class ReplayBus():
+    """Stand-in for the session bus that answers calls and emits signals from a trace.
+
+    Until `start` the bus is in the state at the beginning of the trace, so the bridge starts
+    up like it did when the trace was recorded. `start` then emits the signals in their recorded
+    rhythm, `speed` times faster, or one after the other as fast as the event loop takes them if
+    `speed` is 0.
+
+    A call is answered with the reply recorded for the same call at the current time of the
+    trace, or the next one recorded after it: the reply the bridge got back then. Calls that
+    are not in the trace fail.
+
+    Set it up with `engine.use_transport_factory(bus.create_transport)` before the bridge is
+    created. Must be used from the thread of the event loop.
+    """
+
+    def __init__(self, path: str, speed: float = 1.0) -> None:
+        """
+        Args:
+            path (str): trace file written by `TraceRecorder`
+            speed (float, optional): factor the trace is sped up by, 0 for as fast as possible
+        """
+        self._speed = speed
+        # (service, path, interface, method, args as json) -> times the call was sent and (result, error, duration)
+        self._calls = {}
+        # (time, service, path, interface, signal, args), args None for registrations
+        self._events = []
+        self._load(path)
+        self._transports = weakref.WeakValueDictionary()
+        self._started = None
+        self._now = 0.0
+        self._next = 0
+        self.calls_answered = 0
+        self.calls_missing = 0
+        self.signals_delivered = 0
+        self.last_call = time.monotonic()
+
+    def _load(self, path: str) -> None:
+        strings = {}
+        with gzip.open(path, "rt", encoding="utf-8") as trace_file:
+            header = json.loads(trace_file.readline())
+            if header.get("version") != TRACE_VERSION:
+                raise ValueError(f"{path} is not a trace of version {TRACE_VERSION}")
+            for line in trace_file:
+                event = json.loads(line)
+                if event[0] == "n":
+                    strings[event[1]] = event[2]
+                    continue
+                timestamp, kind = event[0], event[1]
+                if kind == "s":
+                    service, object_path, interface_name, signal_name = [strings[string_id] for string_id in event[2:6]]
+                    self._events.append((timestamp, service, object_path, interface_name, signal_name, _decode(event[6])))
+                elif kind == "c":
+                    key = tuple(strings[string_id] for string_id in event[2:6]) + (json.dumps(event[6]),)
+                    times, replies = self._calls.setdefault(key, ([], []))
+                    times.append(timestamp)
+                    replies.append((_decode(event[7]), event[8], event[9]))
+                elif kind == "r":
+                    self._events.append((timestamp, strings[event[2]], None, None, None, None))
+        self._events.sort(key=lambda event: event[0])
+        # calls were recorded when their reply arrived, not in the order they were sent
+        for times, replies in self._calls.values():
+            order = sorted(range(len(times)), key=times.__getitem__)
+            times[:] = [times[i] for i in order]
+            replies[:] = [replies[i] for i in order]
+
+    @property
+    def num_signals(self) -> int:
+        return len(self._events)
+
+    @property
+    def duration(self) -> float:
+        """Seconds between the first and the last signal of the trace.
+        """
+        return self._events[-1][0] - self._events[0][0] if self._events else 0.0
+
+    def create_transport(self, service: str, path: str) -> ReplayTransport:
+        transport = ReplayTransport(self, service, path)
+        self._transports[(service, path)] = transport
+        return transport
+
+    def _trace_time(self) -> float:
+        if self._started is None or self._speed == 0:
+            return self._now
+        return self._now + (time.monotonic() - self._started) * self._speed
+
+    def answer(self, service: str, path: str, interface_name: str, method_name: str, args) -> tuple[object, Optional[str], float]:
+        """Returns the recorded reply of a call, its error and the seconds until it is due.
+        """
+        self.last_call = time.monotonic()
+        recorded = self._calls.get((service, path, interface_name, method_name, json.dumps(_encode(list(args)))))
+        if recorded is None:
+            self.calls_missing += 1
+            return None, f"{interface_name}.{method_name} of {path} is not in the trace", 0.0
+        self.calls_answered += 1
+        times, replies = recorded
+        index = min(bisect.bisect_left(times, self._trace_time()), len(times) - 1)
+        result, error, duration = replies[index]
+        return result, error, 0.0 if self._speed == 0 else duration / self._speed
+
+    def start(self, emitted: Optional[Callable[[float], None]] = None, done: Optional[Callable[[], None]] = None) -> None:
+        """Emit the signals of the trace.
+
+        Args:
+            emitted (Callable[[float], None], optional): called with the monotonic time after each signal
+            done (Callable[[], None], optional): called once all signals were emitted
+        """
+        if not self._events:
+            if done is not None:
+                done()
+            return
+        self._now = self._events[0][0]
+        self._started = time.monotonic()
+        self._emit_next(emitted, done)
+
+    def _emit_next(self, emitted: Optional[Callable[[float], None]], done: Optional[Callable[[], None]]) -> None:
+        timestamp, service, path, interface_name, signal_name, args = self._events[self._next]
+        self._next += 1
+        if self._speed == 0:
+            self._now = timestamp
+        if path is None:
+            for (transport_service, _), transport in list(self._transports.items()):
+                if transport_service == service:
+                    transport._service_registered()
+        else:
+            transport = self._transports.get((service, path))
+            if transport is not None and transport._signal_received(interface_name, signal_name, args):
+                self.signals_delivered += 1
+        if emitted is not None:
+            emitted(time.monotonic())
+        if self._next == len(self._events):
+            if done is not None:
+                done()
+            return
+        if self._speed == 0:
+            delay = 0.0
+        else:
+            due = self._started + (self._events[self._next][0] - self._now) / self._speed
+            delay = max(0.0, due - time.monotonic())
+        engine.call_later(delay, lambda: self._emit_next(emitted, done))
@@ -0,0 +1,124 @@
+from typing import Optional
+import hashlib
+import json
+import logging
+import os
+import threading
+
+class DiscoveryCache():
+    """Digests of the discovery configs published per device, persisted between runs.
+
+    A config that was published with the same payload before is not published again on restart,
+    HA still has it as retained message. Configs that were known from an earlier run but were not
+    published in this one belong to removed entities and can be tombstoned with `stale_topics`.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        """
+        Args:
+            path (str, optional): json file the digests are stored in, None keeps them in memory only
+        """
+        self._path = path
+        # device key -> config topic -> digest of the payload
+        self._digests = {}
+        # config topic -> device key, for configs of entities created in this run
+        self._devices = {}
+        # config topics published or confirmed in this run
+        self._seen = set()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if self._path is None or not os.path.exists(self._path):
+            return
+        try:
+            with open(self._path, "r", encoding="utf-8") as cache_file:
+                self._digests = json.load(cache_file)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring discovery cache {self._path}: {e}")
+            self._digests = {}
+
+    def save(self) -> None:
+        if self._path is None:
+            return
+        with self._lock:
+            content = json.dumps(self._digests, indent=1, sort_keys=True)
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # replace the file at once, a crash while writing must not corrupt the cache
+        tmp_path = f"{self._path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as cache_file:
+                cache_file.write(content)
+            os.replace(tmp_path, self._path)
+        except OSError as e:
+            logging.error(f"Failed to write discovery cache {self._path}: {e}")
+
+    def register(self, config_topic: str, device_key: str) -> None:
+        """Assign the config topic of an entity to the device it belongs to.
+        """
+        with self._lock:
+            self._devices[config_topic] = device_key
+
+    def is_current(self, topic: str, payload) -> bool:
+        """Record a payload that is about to be published.
+
+        Args:
+            topic (str): topic of the message
+            payload: payload of the message
+
+        Returns:
+            bool: True if the topic is a registered config topic that was published with the same
+                payload before, so publishing it can be skipped
+        """
+        device_key = self._devices.get(topic)
+        if device_key is None:
+            return False
+        if isinstance(payload, str):
+            payload = payload.encode()
+        with self._lock:
+            device_digests = self._digests.setdefault(device_key, {})
+            if not payload:
+                # entity is deleted
+                device_digests.pop(topic, None)
+                self._seen.discard(topic)
+                return False
+            self._seen.add(topic)
+            digest = hashlib.sha256(payload).hexdigest()
+            if device_digests.get(topic) == digest:
+                return True
+            device_digests[topic] = digest
+            return False
+
+    def invalidate(self) -> None:
+        """Forget the digests of configs that were not published or confirmed in this run, because
+        the broker lost its retained messages. Their entities publish them again once created.
+        """
+        with self._lock:
+            for device_digests in self._digests.values():
+                for topic in [topic for topic in device_digests if topic not in self._seen]:
+                    del device_digests[topic]
+
+    def devices(self) -> list[str]:
+        with self._lock:
+            return list(self._digests.keys())
+
+    def stale_topics(self, device_key: str) -> list[str]:
+        """Returns the config topics of a device that were not published in this run.
+        """
+        with self._lock:
+            return [topic for topic in self._digests.get(device_key, {}) if topic not in self._seen]
+
+    def forget(self, device_key: str, topics: Optional[list[str]] = None) -> None:
+        """Drop config topics of a device, all of them if no topics are given.
+        """
+        with self._lock:
+            if topics is None:
+                self._digests.pop(device_key, None)
+                return
+            device_digests = self._digests.get(device_key, {})
+            for topic in topics:
+                device_digests.pop(topic, None)
+            if not device_digests:
+                self._digests.pop(device_key, None)
@@ -0,0 +1,163 @@
+"""Event loop the bridge runs on.
+
+By default the D-Bus side runs on the Qt event loop with QtDBus (qtdbus.py) and the MQTT client
+in its own thread. With `use_asyncio` everything runs in one asyncio event loop instead: D-Bus
+with the pure-Python dbus-next (aiodbus.py) and the MQTT client driven by the loop, Qt is not needed.
+
+The engine has to be selected before the first `KDEConnect*` object is created.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+import asyncio
+import logging
+import threading
+import weakref
+
+_loop = None
+_bus = None
+_qt_invoker = None
+# (service, path) -> transport, shared by all wrappers of an object while any of them is alive
+_transports = weakref.WeakValueDictionary()
+# creates transports instead of the engine if set, see use_transport_factory
+_transport_factory = None
+# error of a blocking call the transport refused because the loop runs, not an error of the device
+BLOCKING_CALL_REFUSED = "blocking calls are not possible while the event loop runs, use call_async"
+# thread for blocking work, see run_in_worker
+_worker = None
+_worker_lock = threading.Lock()
+
+def use_asyncio(loop: asyncio.AbstractEventLoop, bus) -> None:
+    """Run on an asyncio event loop.
+
+    Args:
+        loop (asyncio.AbstractEventLoop): the loop, it must not be running yet while the bridge is set up
+        bus (dbus_next.aio.MessageBus): connected session bus
+    """
+    global _loop, _bus
+    _loop = loop
+    _bus = bus
+    _transports.clear()
+
+def asyncio_loop() -> Optional[asyncio.AbstractEventLoop]:
+    """Returns the loop of the asyncio engine or None if the bridge runs on Qt.
+    """
+    return _loop
+
+def can_block() -> bool:
+    """Returns False while the asyncio loop runs, it can't wait for the reply of a blocking call then.
+    """
+    return _loop is None or not _loop.is_running()
+
+def use_transport_factory(factory: Optional[Callable[[str, str], object]]) -> None:
+    """Create transports with a factory instead of the engine, e.g. to record the D-Bus traffic 
+    or to replay it without a bus (see dbustrace.py). None goes back to the engine.
+
+    Args:
+        factory (Callable[[str, str], object], optional): called with service and path, returns an 
+            object with the interface of `QtDBusTransport`
+    """
+    global _transport_factory
+    _transport_factory = factory
+    _transports.clear()
+
+def create_transport(service: str, path: str):
+    """Returns the transport for calls to and signals of one D-Bus object, see `QtDBusTransport`.
+
+    There is one transport per object, wrappers of the same path share it and with it the
+    connections of its signals.
+    """
+    transport = _transports.get((service, path))
+    if transport is not None:
+        return transport
+    if _transport_factory is not None:
+        transport = _transport_factory(service, path)
+    else:
+        transport = create_bus_transport(service, path)
+    _transports[(service, path)] = transport
+    return transport
+
+def create_bus_transport(service: str, path: str):
+    """Returns a new transport of the engine on the session bus, not shared and not created by the factory.
+    """
+    if _loop is None:
+        from qtdbus import QtDBusTransport
+        return QtDBusTransport(service, path)
+    from aiodbus import AioDBusTransport
+    return AioDBusTransport(_bus, _loop, service, path)
+
+def call_later(seconds: float, callback: Callable[[], None]) -> None:
+    """Run a callback once on the event loop. Must be called from the thread of the loop.
+    """
+    if _loop is None:
+        from PyQt5.QtCore import QTimer
+        QTimer.singleShot(max(0, round(seconds * 1000)), callback)
+    else:
+        _loop.call_later(seconds, callback)
+
+def call_soon_threadsafe(callback: Callable[[], None]) -> None:
+    """Run a callback on the event loop as soon as possible, can be called from any thread.
+    """
+    global _qt_invoker
+    if _loop is not None:
+        _loop.call_soon_threadsafe(callback)
+        return
+    if _qt_invoker is None:
+        from qtdbus import QtInvoker
+        _qt_invoker = QtInvoker()
+    _qt_invoker.call_soon_threadsafe(callback)
+
+def run_in_worker(work: Callable[[], object], callback: Callable[[object], None]) -> None:
+    """Run blocking work, e.g. hashing or writing a file, in the worker thread and pass its result
+    to a callback on the event loop. Can be called from any thread.
+
+    There is one worker thread, work runs one at a time in the order it was passed. If the work
+    raises, the error is logged and the callback is called with None. Errors of the callback are
+    logged as well.
+    """
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kdeconnect-worker")
+
+    def run():
+        try:
+            result = work()
+        except Exception:
+            logging.exception("Work in the worker thread failed")
+            result = None
+        call_soon_threadsafe(lambda: _run_callback(callback, result))
+    _worker.submit(run)
+
+def _run_callback(callback: Callable[[object], None], result: object) -> None:
+    # runs on the event loop, a raise would abort the Qt engine
+    try:
+        callback(result)
+    except Exception:
+        logging.exception("Callback of work in the worker thread failed")
+
+class _WeakHandler():
+    """Bound method that doesn't keep its object alive. 
+
+    Lighter than a `weakref.WeakMethod` in a closure, weak references without callback to the 
+    same object are shared and the function is the one of the class. 
+    """
+    __slots__ = ("_object", "_function")
+
+    def __init__(self, handler) -> None:
+        self._object = weakref.ref(handler.__self__)
+        self._function = handler.__func__
+
+    def __call__(self, *args) -> None:
+        obj = self._object()
+        if obj is not None:
+            self._function(obj, *args)
+
+def weak_handler(handler: Callable[..., None]) -> Callable[..., None]:
+    """Returns a function that calls the handler as long as the object of a bound method is alive.
+
+    Transports hold the signal handlers of the objects that own them, weak references keep
+    removed devices and plugins from receiving signals until the garbage collector ran.
+    """
+    if not hasattr(handler, "__self__"):
+        return handler
+    return _WeakHandler(handler)
@@ -0,0 +1,176 @@
+from collections import OrderedDict
+from metrics import registry
+from typing import Optional
+import hashlib
+import logging
+import os
+import threading
+
+# leading bytes of common formats -> file extension
+EXTENSIONS = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF8", ".gif"),
+    (b"%PDF", ".pdf"),
+    (b"PK\x03\x04", ".zip"),
+)
+
+def digest(payload) -> str:
+    """Returns the hash of a content, files in a `FileCache` are named by it.
+    """
+    return hashlib.sha256(payload).hexdigest()
+
+def guess_extension(payload, default: Optional[str] = ".bin") -> Optional[str]:
+    """Returns the file extension of a content from its leading bytes, `default` if it's not known.
+    """
+    for magic, extension in EXTENSIONS:
+        if payload[:len(magic)] == magic:
+            return extension
+    if payload[:4] == b"RIFF" and payload[8:12] == b"WEBP":
+        return ".webp"
+    return default
+
+class FileCache():
+    """Directory of files that are named by a key, usually the hash of their content, and bounded in size.
+
+    The least recently used files are deleted once the cache would grow beyond `max_bytes`. The
+    order of use is kept in the modification times, so it survives a restart. Files that are still
+    in use can be pinned by `put`, they are not deleted until `unpin` was called as often. Files
+    appear at once, readers never see a partly written file.
+
+    Thread safe.
+    """
+    # names of the files of the cache start with it, other files in the directory are not touched
+    PREFIX = "kdeconnect-"
+
+    def __init__(self, path: str, max_bytes: int, name: str = "cache") -> None:
+        """
+        Args:
+            path (str): directory of the cache, created if it doesn't exist
+            max_bytes (int): maximum size of all files in the cache
+            name (str, optional): name of the cache in logs and metrics
+        """
+        self._path = path
+        self._max_bytes = max_bytes
+        self._name = name
+        # key -> (file name, size), least recently used first
+        self._files = OrderedDict()
+        self._size = 0
+        # key -> number of times it is pinned, pinned files are not evicted
+        self._pinned = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        os.makedirs(self._path, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self._path):
+            if not entry.is_file() or not entry.name.startswith(self.PREFIX) or entry.name.endswith(".tmp"):
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, entry.name, stat.st_size))
+        # files of an earlier run count towards the limit, the oldest go first
+        for _, file_name, size in sorted(entries):
+            key = file_name[len(self.PREFIX):].split(".")[0]
+            self._files[key] = (file_name, size)
+            self._size += size
+
+    @property
+    def size(self) -> int:
+        """Bytes of all files in the cache.
+        """
+        return self._size
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the path of the file of a key or None if there is none.
+        """
+        with self._lock:
+            return self._touch(key)
+
+    def _touch(self, key: str) -> Optional[str]:
+        # must hold the lock
+        entry = self._files.get(key)
+        if entry is None:
+            return None
+        path = os.path.join(self._path, entry[0])
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # deleted behind the back of the cache
+            self._files.pop(key)
+            self._size -= entry[1]
+            return None
+        self._files.move_to_end(key)
+        return path
+
+    def put(self, key: str, payload, extension: str = "", pin: bool = False) -> Optional[str]:
+        """Write the file of a key unless it exists already.
+
+        Args:
+            key (str): key of the file, e.g. a `digest` of the payload
+            payload (bytes): content of the file, not empty
+            extension (str, optional): extension of the file name, e.g. ".jpg"
+            pin (bool, optional): keep the file until `unpin` was called, also if it existed already
+
+        Returns:
+            Optional[str]: path of the file or None if it could not be written
+        """
+        with self._lock:
+            path = self._touch(key)
+            if path is None:
+                if not self._evict(len(payload)):
+                    logging.warning(f"Not writing {key} to the {self._name}, it's full of files in use")
+                    return None
+                file_name = f"{self.PREFIX}{key}{extension}"
+                path = os.path.join(self._path, file_name)
+                try:
+                    self._write(path, payload)
+                except OSError as e:
+                    logging.error(f"Failed to write {path} to the {self._name}: {e}")
+                    return None
+                self._files[key] = (file_name, len(payload))
+                self._size += len(payload)
+            if pin:
+                self._pinned[key] = self._pinned.get(key, 0) + 1
+        return path
+
+    def unpin(self, key: str) -> None:
+        """Release a pin of `put`, the file may be evicted once it's not pinned anymore.
+        """
+        with self._lock:
+            count = self._pinned.get(key, 0)
+            if count > 1:
+                self._pinned[key] = count - 1
+            else:
+                self._pinned.pop(key, None)
+
+    @staticmethod
+    def _write(path: str, payload) -> None:
+        tmp_path = f"{path}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as file:
+            file.write(payload)
+        os.replace(tmp_path, path)
+
+    def _evict(self, needed: int) -> bool:
+        # must hold the lock, returns False if pinned files leave no room
+        if self._size + needed <= self._max_bytes:
+            return True
+        pinned_size = sum(self._files[key][1] for key in self._pinned if key in self._files)
+        if pinned_size + needed > self._max_bytes:
+            return False
+        for key in list(self._files):
+            if key in self._pinned:
+                continue
+            file_name, size = self._files.pop(key)
+            self._size -= size
+            try:
+                os.remove(os.path.join(self._path, file_name))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.warning(f"Failed to delete {file_name} from the {self._name}: {e}")
+            registry.inc("kdeconnect_file_cache_evicted_total", {"cache": self._name})
+            if self._size + needed <= self._max_bytes:
+                return True
+        return False
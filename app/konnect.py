@@ -1,66 +1,355 @@
 import logging
-from PyQt5.QtDBus import QDBusInterface, QDBusConnection, QDBusReply
-from PyQt5.QtCore import QObject, pyqtSlot
-from typing import Callable
+from typing import Callable, Iterable, Optional, NamedTuple
+from metrics import registry
+from circuitbreaker import CircuitBreaker
+import engine
+import signaltrace
 import json
+import time
 
-class DBusWrapper(QObject):
+class DBusWrapper():
+    """Thin wrapper around a single D-Bus object and interface. 
 
-    def __init__(self, service: str, path: str, interface_name: str = "") -> None:
+    Property reads are served from a per-object cache that is filled in one shot with 
+    `GetAll` and kept current from `PropertiesChanged` and the plugin specific signals 
+    (see `update_cache` and `invalidate`). 
+
+    Methods can be called without blocking the event loop with `call_async`, which 
+    hands the result to a callback once the reply arrived or the timeout expired. 
+
+    Messages go through the transport of the engine the bridge runs on, see engine.py. 
+
+    Calls to a device can be guarded by the circuit breaker of the device, while it's open 
+    calls fail right away as if they had failed on the bus. 
+
+    Blocking calls are not made while the asyncio loop runs (see `engine.can_block`), they return 
+    None without counting as failure of the device. A property read that misses the cache then 
+    starts a `GetAll` in the background, later reads are served from the cache. 
+
+    Calls, property reads and signal dispatches are recorded in the metrics registry. 
+
+    `close` disconnects all signal handlers of the wrapper, signals that arrive afterwards and 
+    replies to calls that were still in flight are not dispatched anymore. 
+    """
+    PROPERTIES_INTERFACE = "org.freedesktop.DBus.Properties"
+    # default timeout for calls in ms, D-Bus itself would wait ~25 s
+    DEFAULT_TIMEOUT = 5000
+
+    __slots__ = ("_service", "_path", "_interface_name", "_timeout", "_breaker", "_transport", "_cache", "_cache_complete", "_refreshing", "_connections", "__weakref__")
+
+    def __init__(self, service: str, path: str, interface_name: str = "", timeout: int = DEFAULT_TIMEOUT, breaker: Optional[CircuitBreaker] = None,
+                 watch_properties: bool = True) -> None:
+        """
+        Args:
+            service (str): service name on the bus
+            path (str): path of the object
+            interface_name (str, optional): interface calls and properties go to
+            timeout (int, optional): timeout for calls in ms
+            breaker (CircuitBreaker, optional): circuit breaker of the device the object belongs to
+            watch_properties (bool, optional): keep the cache current from `PropertiesChanged`, 
+                objects that are only read once don't need it
+        """
         self._service = service
         self._path = path
         self._interface_name = interface_name
+        self._timeout = timeout
+        self._breaker = breaker
         
-        self._session = QDBusConnection.sessionBus()
-        self._interface = QDBusInterface(self._service, self._path, self._interface_name, self._session)
-        self._properties = QDBusInterface(self._service, self._path, "org.freedesktop.DBus.Properties", self._session)
+        self._transport = engine.create_transport(service, path)
+
+        self._cache = {}
+        # True if the cache holds the result of a GetAll that has not been invalidated since
+        self._cache_complete = False
+        # a background GetAll is in flight, see refresh
+        self._refreshing = False
+        # (interface, signal, connection) of the connected handlers, None once closed
+        self._connections = []
+        if watch_properties:
+            self._connect(self.PROPERTIES_INTERFACE, "PropertiesChanged", self._properties_changed)
+
+    def _connect(self, interface_name: str, signal_name: str, handler) -> None:
+        connection = self._transport.connect_signal(interface_name, signal_name, handler)
+        self._connections.append((interface_name, signal_name, connection))
+
+    @property
+    def closed(self) -> bool:
+        return self._connections is None
+
+    def close(self) -> None:
+        """Disconnect all signal handlers, nothing is dispatched from now on. 
+        """
+        if self._connections is None:
+            return
+        for interface_name, signal_name, connection in self._connections:
+            self._transport.disconnect_signal(interface_name, signal_name, connection)
+        self._connections = None
+
+    def _call_labels(self, method_name: str) -> dict[str, str]:
+        return {"interface": self._interface_name, "method": method_name}
+
+    def _allow(self, labels: dict[str, str]) -> bool:
+        if self._breaker is None or self._breaker.allow():
+            return True
+        registry.inc("kdeconnect_dbus_calls_rejected_total", labels)
+        logging.debug(f"Not calling {labels['method']}, the device is unavailable")
+        return False
+
+    def _record(self, labels: dict[str, str], error: Optional[str]) -> None:
+        if error is engine.BLOCKING_CALL_REFUSED:
+            self._refused(labels)
+            return
+        registry.inc("kdeconnect_dbus_calls_total", labels)
+        if error is not None:
+            registry.inc("kdeconnect_dbus_call_errors_total", labels)
+            print(f"Method call {labels['method']} failed:", error)
+        if self._breaker is not None:
+            if error is None:
+                self._breaker.record_success()
+            else:
+                self._breaker.record_failure()
+
+    def _refused(self, labels: dict[str, str]) -> None:
+        registry.inc("kdeconnect_dbus_calls_refused_total", labels)
+        logging.debug(f"Not calling {labels['method']} blocking, the event loop runs")
+
+    def _call_blocking(self, interface_name: str, method_name: str, args):
+        labels = self._call_labels(method_name)
+        if not engine.can_block():
+            self._refused(labels)
+            return None
+        if not self._allow(labels):
+            return None
+        with registry.timer("kdeconnect_dbus_call_seconds", labels):
+            value, error = self._transport.call(interface_name, method_name, args, self._timeout)
+        self._record(labels, error)
+        return value if error is None else None
 
     def call(self, method_name, *args):
-        # Check if the interface is valid
-        if self._interface.isValid():
-            # Call the method to get the list of connected devices
-            # onlyReachable, onlyPaired
-            msg = self._interface.call(method_name, *args)
-            reply = QDBusReply(msg)
-            # Check if the call was successful
-            if reply.isValid():
-                # Process the reply
-                return reply.value()
+        return self._call_blocking(self._interface_name, method_name, args)
+
+    def call_async(self, method_name: str, *args, callback: Optional[Callable[[object], None]] = None, timeout: Optional[int] = None) -> None:
+        """Call a method without waiting for the reply. Can be called from any thread, 
+        the callback is always run in the thread of the event loop. 
+
+        Args:
+            method_name (str): name of the D-Bus method
+            callback (Callable[[object], None], optional): called with the return value 
+                of the method or None if the call failed or timed out. 
+            timeout (int, optional): timeout in ms, defaults to the timeout of the wrapper
+        """
+        self._send_async(self._interface_name, method_name, args, callback, timeout)
+
+    def call_void_async(self, method_name: str, *args, callback: Optional[Callable[[bool], None]] = None, timeout: Optional[int] = None) -> None:
+        """Call a method that returns nothing without waiting for the reply, see `call_async`. 
+
+        Args:
+            method_name (str): name of the D-Bus method
+            callback (Callable[[bool], None], optional): called with True once the method returned 
+                or with False if the call failed or timed out
+            timeout (int, optional): timeout in ms, defaults to the timeout of the wrapper
+        """
+        self._send_async(self._interface_name, method_name, args, callback, timeout, void=True)
+
+    def refresh_async(self, callback: Optional[Callable[[bool], None]] = None, timeout: Optional[int] = None) -> None:
+        """Refill the property cache with a `GetAll` call without waiting for the reply. 
+
+        Args:
+            callback (Callable[[bool], None], optional): called with True once the cache was 
+                refilled or with False if the call failed
+            timeout (int, optional): timeout in ms, defaults to the timeout of the wrapper
+        """
+        def refreshed(values):
+            if values is not None:
+                self._cache = dict(values)
+                self._cache_complete = True
+            if callback is not None:
+                callback(values is not None)
+
+        self._send_async(self.PROPERTIES_INTERFACE, "GetAll", [self._interface_name], refreshed, timeout)
+
+    def _send_async(self, interface_name: str, method_name: str, args, callback: Optional[Callable[[object], None]], timeout: Optional[int],
+                    void: bool = False):
+        labels = self._call_labels(method_name)
+        if not self._allow(labels):
+            if callback is not None:
+                # like a failed call, the callback never runs before call_async returned
+                engine.call_soon_threadsafe(lambda: callback(False if void else None))
+            return
+        started = time.perf_counter()
+        if callback is not None:
+            # publishes of the callback count towards the signal that led to the call
+            callback = signaltrace.carried(callback)
+
+        def finished(value, error: Optional[str]):
+            registry.observe("kdeconnect_dbus_call_seconds", time.perf_counter() - started, labels)
+            self._record(labels, error)
+            if callback is None:
+                return
+            if void:
+                callback(error is None)
             else:
-                # Handle errors
-                print("Method call failed:", reply.error().message())
-        else:
-            # Handle errors
-            print("Invalid D-Bus interface")
+                callback(value if error is None else None)
+
+        self._transport.call_async(interface_name, method_name, args, self._timeout if timeout is None else timeout, finished)
+
+    def _call_properties(self, method_name, *args):
+        return self._call_blocking(self.PROPERTIES_INTERFACE, method_name, [self._interface_name, *args])
 
     def property(self, property_name):
-        # Check if the interface is valid
-        if self._properties.isValid():
-            # Call the method to get the list of connected devices
-            # onlyReachable, onlyPaired
-            msg = self._properties.call("Get", self._interface_name, property_name)
-            reply = QDBusReply(msg)
-            # Check if the call was successful
-            if reply.isValid():
-                # Process the reply
-                return reply.value()
-            else:
-                # Handle errors
-                print("Method call failed:", reply.error().message())
+        """Returns the value of a property, fetching all properties of the interface 
+        with a single `GetAll` if the cache does not hold it yet. 
+
+        Args:
+            property_name (str): name of the D-Bus property
+
+        Returns:
+            the value of the property or None if it could not be read
+        """
+        if property_name in self._cache:
+            registry.inc("kdeconnect_dbus_property_reads_total", {"interface": self._interface_name, "property": property_name, "source": "cache"})
+            return self._cache[property_name]
+        registry.inc("kdeconnect_dbus_property_reads_total", {"interface": self._interface_name, "property": property_name, "source": "bus"})
+        if not self._cache_complete:
+            self.refresh()
+            if property_name in self._cache:
+                return self._cache[property_name]
+        # not part of GetAll, fall back to a single Get
+        value = self._call_properties("Get", property_name)
+        if value is not None:
+            self._cache[property_name] = value
+        return value
+
+    def properties(self) -> dict:
+        """Returns all properties of the interface, fetched with a single `GetAll` if the 
+        cache is not complete. 
+
+        Returns:
+            dict: property names mapped to their values
+        """
+        if not self._cache_complete:
+            self.refresh()
+        return dict(self._cache)
+
+    def refresh(self) -> None:
+        """Refill the property cache with a single `GetAll` call. While the asyncio loop runs 
+        the call is made in the background instead. 
+        """
+        if not engine.can_block():
+            if not self._refreshing:
+                self._refreshing = True
+                self.refresh_async(self._refreshed)
+            return
+        values = self._call_properties("GetAll")
+        if values is None:
+            return
+        self._cache = dict(values)
+        self._cache_complete = True
+
+    def _refreshed(self, success: bool) -> None:
+        self._refreshing = False
+
+    def update_cache(self, values: dict) -> None:
+        """Update cached properties with values received from a signal. 
+
+        Args:
+            values (dict): property names mapped to their new values
+        """
+        self._cache.update(values)
+
+    def invalidate(self, *property_names: str) -> None:
+        """Drop properties from the cache so the next read goes to the bus again. 
+        Without arguments the whole cache is dropped. 
+        """
+        if property_names:
+            for property_name in property_names:
+                self._cache.pop(property_name, None)
         else:
-            # Handle errors
-            print("Invalid D-Bus interface")
+            self._cache.clear()
+        self._cache_complete = False
+
+    def _properties_changed(self, interface_name: str, changed: dict, invalidated: list[str]):
+        if interface_name != self._interface_name:
+            return
+        self._cache.update(changed)
+        if invalidated:
+            self.invalidate(*invalidated)
    
     def handle_signal(self, signal_name: str, handler):
         # Connect the signal to the handler
-        self._session.connect(self._service, self._path, self._interface_name, signal_name, handler)
+        self._connect(self._interface_name, signal_name, handler)
+
+    def watch_registration(self, handler: Callable[[], None]) -> None:
+        """Register a handler that is called when the service registers its name on the bus, 
+        e.g. after it was restarted. 
+        """
+        self._transport.watch_registration(handler)
+
+    def dispatch(self, signal_name: str, handlers: list[Callable[..., None]], *args) -> None:
+        """Pass a received signal on to handlers, recording how long they took. 
+        A failing handler doesn't keep the others from running. 
+
+        Args:
+            signal_name (str): name of the D-Bus signal
+            handlers (list[Callable[..., None]]): handlers to be called with the arguments
+        """
+        if self._connections is None:
+            # e.g. the reply of a call that was sent before the wrapper was closed
+            return
+        labels = {"interface": self._interface_name, "signal": signal_name}
+        registry.inc("kdeconnect_signal_dispatches_total", labels)
+        with registry.timer("kdeconnect_signal_dispatch_seconds", labels), signaltrace.traced(self._interface_name, signal_name):
+            for handler in handlers:
+                try:
+                    handler(*args)
+                except Exception:
+                    registry.inc("kdeconnect_signal_dispatch_errors_total", labels)
+                    logging.exception(f"Handler of signal {signal_name} failed")
+
+class _Join():
+    """Runs a callback once all results that were added have arrived. 
+    """
+    def __init__(self, callback: Callable[[], None]) -> None:
+        self._callback = callback
+        self._pending = 0
+        self._started = False
+
+    def add(self) -> Callable[..., None]:
+        """Returns a callback for one more result to wait for. 
+        """
+        self._pending += 1
+        return self._done
+
+    def start(self) -> None:
+        """Call after all initial results were added, the callback may run immediately. 
+        """
+        self._started = True
+        self._check()
+
+    def _done(self, *args) -> None:
+        self._pending -= 1
+        self._check()
+
+    def _check(self) -> None:
+        if self._started and self._pending == 0 and self._callback is not None:
+            callback = self._callback
+            self._callback = None
+            callback()
+
+class KDEConnectDaemon():
+    SERVICE = "org.kde.kdeconnect.daemon"
 
-class KDEConnectDaemon(QObject):
     def __init__(self) -> None:
-        super().__init__()
-        self._dbus = DBusWrapper("org.kde.kdeconnect.daemon", "/modules/kdeconnect", "org.kde.kdeconnect.daemon")
+        self._dbus = DBusWrapper(self.SERVICE, "/modules/kdeconnect", "org.kde.kdeconnect.daemon")
         self._device_list_changed_handlers = []
         self._dbus.handle_signal("deviceListChanged", self._device_list_changed)
+        self._device_added_handlers = []
+        self._dbus.handle_signal("deviceAdded", self._device_added)
+        self._device_removed_handlers = []
+        self._dbus.handle_signal("deviceRemoved", self._device_removed)
+
+        # the daemon registering its name again means it was restarted
+        self._restarted_handlers = []
+        self._dbus.watch_registration(self._service_registered)
 
     def announced_name(self) -> str:
         return self._dbus.call("announcedName")
@@ -70,46 +359,105 @@ class KDEConnectDaemon(QObject):
 
     def devices(self, only_reachable: bool = False, only_paired: bool = False) -> list[str]:
         return self._dbus.call("devices", only_reachable, only_paired)
+
+    def devices_async(self, callback: Callable[[Optional[list[str]]], None], only_reachable: bool = False, only_paired: bool = False) -> None:
+        self._dbus.call_async("devices", only_reachable, only_paired, callback=callback)
     
-    @pyqtSlot()
     def _device_list_changed(self):
-        for handler in self._device_list_changed_handlers:
-            handler()
+        self._dbus.dispatch("deviceListChanged", self._device_list_changed_handlers)
 
     def notify_device_list_changed(self, handler: Callable[[], None]):
         self._device_list_changed_handlers.append(handler)
 
-class KDEConnectPlugin(QObject):
-    def __init__(self, device_id: str, plugin_name: str, plugin_interface: str) -> None:
-        super().__init__()
+    def _device_added(self, device_id: str):
+        self._dbus.dispatch("deviceAdded", self._device_added_handlers, device_id)
+
+    def notify_device_added(self, handler: Callable[[str], None]):
+        """Register a handler that is called with the id of a device the daemon got to know, 
+        paired or not. 
+        """
+        self._device_added_handlers.append(handler)
+
+    def _device_removed(self, device_id: str):
+        self._dbus.dispatch("deviceRemoved", self._device_removed_handlers, device_id)
+
+    def notify_device_removed(self, handler: Callable[[str], None]):
+        """Register a handler that is called with the id of a device the daemon forgot. 
+        """
+        self._device_removed_handlers.append(handler)
+
+    def _service_registered(self):
+        logging.info(f"{self.SERVICE} was (re)started")
+        self._dbus.dispatch("restarted", self._restarted_handlers)
+
+    def notify_restarted(self, handler: Callable[[], None]):
+        """Register a handler that is called when the daemon was started after the bridge. 
+        """
+        self._restarted_handlers.append(handler)
+
+class KDEConnectPlugin():
+    # plugins without D-Bus properties don't need to fetch anything when loading
+    HAS_PROPERTIES = True
+
+    __slots__ = ("_device_id", "_plugin_name", "_dbus", "__weakref__")
+
+    def __init__(self, device_id: str, plugin_name: str, plugin_interface: str, breaker: Optional[CircuitBreaker] = None) -> None:
         self._device_id = device_id
         self._plugin_name = plugin_name
-        self._dbus = DBusWrapper("org.kde.kdeconnect.daemon", f"/modules/kdeconnect/devices/{self._device_id}/{self._plugin_name}", plugin_interface)
+        self._dbus = DBusWrapper("org.kde.kdeconnect.daemon", f"/modules/kdeconnect/devices/{self._device_id}/{self._plugin_name}", plugin_interface,
+                                 breaker=breaker)
         #self._dbus._session.registerObject('/', self)
 
+    def load_async(self, callback: Callable[[], None]) -> None:
+        """Fill the property cache of the plugin without blocking. 
+
+        Args:
+            callback (Callable[[], None]): called once the properties arrived or fetching them failed
+        """
+        if not self.HAS_PROPERTIES:
+            callback()
+            return
+        self._dbus.refresh_async(lambda success: callback())
+
+    def close(self) -> None:
+        """Stop handling the signals of the plugin, its handlers are not called anymore. 
+        """
+        self._dbus.close()
+
 class KDEConnectPluginPing(KDEConnectPlugin):
-    def __init__(self, device_id: str) -> None:
-        super().__init__(device_id, "ping", "org.kde.kdeconnect.device.ping")
+    HAS_PROPERTIES = False
+
+    __slots__ = ()
 
-    def send_ping(self, custom_message = None):
+    def __init__(self, device_id: str, breaker: Optional[CircuitBreaker] = None) -> None:
+        super().__init__(device_id, "ping", "org.kde.kdeconnect.device.ping", breaker)
+
+    def send_ping(self, custom_message = None, callback: Optional[Callable[[object], None]] = None):
         if custom_message is None:
-            return self._dbus.call("sendPing")
-        return self._dbus.call("sendPing", custom_message)
+            self._dbus.call_async("sendPing", callback=callback)
+        else:
+            self._dbus.call_async("sendPing", custom_message, callback=callback)
 
 
 class KDEConnectPluginFindMyPhone(KDEConnectPlugin):
-    def __init__(self, device_id: str) -> None:
-        super().__init__(device_id, "findmyphone", "org.kde.kdeconnect.device.findmyphone")
+    HAS_PROPERTIES = False
+
+    __slots__ = ()
+
+    def __init__(self, device_id: str, breaker: Optional[CircuitBreaker] = None) -> None:
+        super().__init__(device_id, "findmyphone", "org.kde.kdeconnect.device.findmyphone", breaker)
 
-    def ring(self):
-        return self._dbus.call("ring")
+    def ring(self, callback: Optional[Callable[[object], None]] = None):
+        self._dbus.call_async("ring", callback=callback)
 
 class KDEConnectPluginBattery(KDEConnectPlugin):
     """Plugin that handles state of charge and charging flag. 
     """
 
-    def __init__(self, device_id: str) -> None:
-        super().__init__(device_id, "battery", "org.kde.kdeconnect.device.battery")
+    __slots__ = ("_refresh_handlers",)
+
+    def __init__(self, device_id: str, breaker: Optional[CircuitBreaker] = None) -> None:
+        super().__init__(device_id, "battery", "org.kde.kdeconnect.device.battery", breaker)
         self._refresh_handlers = []
 
         # signal that is called when soc or charging changes
@@ -133,10 +481,9 @@ class KDEConnectPluginBattery(KDEConnectPlugin):
         """
         return self._dbus.property("isCharging")
 
-    @pyqtSlot(bool, int)
     def _refreshed(self, is_charging: bool, charge: int):
-        for handler in self._refresh_handlers:
-            handler(is_charging, charge)
+        self._dbus.update_cache({"isCharging": is_charging, "charge": charge})
+        self._dbus.dispatch("refreshed", self._refresh_handlers, is_charging, charge)
 
     def notify_refreshed(self, handler: Callable[[bool, int], None]):
         """Add a handler that is called when state of charge or if the device is 
@@ -151,14 +498,16 @@ class KDEConnectPluginLockDevice(KDEConnectPlugin):
     """Plugin that can lock or unlock a device. 
     """
 
-    def __init__(self, device_id: str) -> None:
-        super().__init__(device_id, "lockdevice", "org.kde.kdeconnect.device.lockdevice")
+    __slots__ = ("_refresh_handlers",)
+
+    def __init__(self, device_id: str, breaker: Optional[CircuitBreaker] = None) -> None:
+        super().__init__(device_id, "lockdevice", "org.kde.kdeconnect.device.lockdevice", breaker)
         self._refresh_handlers = []
         # signal that is called when soc or charging changes
         self._dbus.handle_signal("lockedChanged", self._locked_changed)
 
-    def set_locked(self, locked: bool):
-        self._dbus.call("setLocked", locked)
+    def set_locked(self, locked: bool, callback: Optional[Callable[[object], None]] = None):
+        self._dbus.call_async("setLocked", locked, callback=callback)
 
     @property
     def is_locked(self) -> bool:
@@ -169,10 +518,9 @@ class KDEConnectPluginLockDevice(KDEConnectPlugin):
         """
         return self._dbus.property("isLocked")
 
-    @pyqtSlot(bool, int)
     def _locked_changed(self, is_locked: bool):
-        for handler in self._refresh_handlers:
-            handler(is_locked)
+        self._dbus.update_cache({"isLocked": is_locked})
+        self._dbus.dispatch("lockedChanged", self._refresh_handlers, is_locked)
 
     def notify_locked_changed(self, handler: Callable[[bool], None]):
         """Register a handler that will be called if the lock state of the device changes
@@ -186,8 +534,10 @@ class KDEConnectPluginLockDevice(KDEConnectPlugin):
 class KDEConnectPluginConnectivityReport(KDEConnectPlugin):
     """Plugin that reports connectivity and type of the network the device is connected to. 
     """
-    def __init__(self, device_id: str) -> None:
-        super().__init__(device_id, "connectivity_report", "org.kde.kdeconnect.device.connectivity_report")
+    __slots__ = ("_refresh_handlers",)
+
+    def __init__(self, device_id: str, breaker: Optional[CircuitBreaker] = None) -> None:
+        super().__init__(device_id, "connectivity_report", "org.kde.kdeconnect.device.connectivity_report", breaker)
         self._refresh_handlers = []
         self._dbus.handle_signal("refreshed", self._refreshed)
 
@@ -209,10 +559,9 @@ class KDEConnectPluginConnectivityReport(KDEConnectPlugin):
         """
         return self._dbus.property("cellularNetworkStrength")
 
-    @pyqtSlot(str, int)
     def _refreshed(self, network_type: str, network_strength: int):
-        for handler in self._refresh_handlers:
-            handler(network_type, network_strength)
+        self._dbus.update_cache({"cellularNetworkType": network_type, "cellularNetworkStrength": network_strength})
+        self._dbus.dispatch("refreshed", self._refresh_handlers, network_type, network_strength)
 
     def notify_refreshed(self, handler: Callable[[str, int], None]):
         """The handler that is called with network type and strength when the values change. 
@@ -222,9 +571,56 @@ class KDEConnectPluginConnectivityReport(KDEConnectPlugin):
         """
         self._refresh_handlers.append(handler)
 
-class KDEConnectPluginRemoteSystemVolume(KDEConnectPlugin, QObject):
-    def __init__(self, device_id: str) -> None:
-        super().__init__(device_id, "remotesystemvolume", "org.kde.kdeconnect.device.remotesystemvolume")
+class SinkRegistry():
+    """Audio sinks of a remote system parsed from the sinks blob once and indexed by name. 
+
+    Volume and mute of the sinks are kept current from signals, so reading them doesn't 
+    need the bus. 
+    """
+    __slots__ = ("_sinks", "_active_name")
+
+    def __init__(self) -> None:
+        # name -> sink as sent by the device, e.g. {"name": ..., "enabled": ..., "volume": ..., "muted": ...}
+        self._sinks = {}
+        self._active_name = None
+
+    def load(self, sinks_bytes) -> None:
+        """Replace all sinks with the ones of a sinks blob. 
+        """
+        sinks = json.loads(str(sinks_bytes, "utf-8"))
+        self._sinks = {sink.get("name"): sink for sink in sinks}
+        self._active_name = next((sink.get("name") for sink in sinks if sink.get("enabled")), None)
+
+    def get(self, name: str) -> Optional[dict]:
+        return self._sinks.get(name)
+
+    @property
+    def active(self) -> Optional[dict]:
+        """The sink that is enabled or None
+        """
+        return self._sinks.get(self._active_name)
+
+    def all(self) -> list[dict]:
+        return list(self._sinks.values())
+
+    def update_volume(self, name: str, volume: int) -> None:
+        sink = self._sinks.get(name)
+        if sink is not None:
+            sink["volume"] = volume
+
+    def update_muted(self, name: str, muted: bool) -> None:
+        sink = self._sinks.get(name)
+        if sink is not None:
+            sink["muted"] = muted
+
+class KDEConnectPluginRemoteSystemVolume(KDEConnectPlugin):
+    __slots__ = ("_sink_registry", "_sinks_loaded", "_sinks_changed_handlers", "_volume_changed_handlers", "_muted_changed_handlers")
+
+    def __init__(self, device_id: str, breaker: Optional[CircuitBreaker] = None) -> None:
+        super().__init__(device_id, "remotesystemvolume", "org.kde.kdeconnect.device.remotesystemvolume", breaker)
+        # parsed from the sinks property once per sinksChanged
+        self._sink_registry = SinkRegistry()
+        self._sinks_loaded = False
         
         self._sinks_changed_handlers = []
         self._dbus.handle_signal("sinksChanged", self._sinks_changed)
@@ -235,50 +631,82 @@ class KDEConnectPluginRemoteSystemVolume(KDEConnectPlugin, QObject):
         self._muted_changed_handlers = []
         self._dbus.handle_signal("mutedChanged", self._muted_changed)
 
+    @property
+    def sink_registry(self) -> SinkRegistry:
+        """All sinks of the device, read from the bus only after they changed. 
+        """
+        if not self._sinks_loaded:
+            sinks_bytes = self._dbus.property("sinks")
+            if sinks_bytes is not None:
+                self._sink_registry.load(sinks_bytes)
+                self._sinks_loaded = True
+        return self._sink_registry
+
     @property
     def sinks(self) -> list[dict]:
-        sinks_bytes = self._dbus.property("sinks")
-        return json.loads(str(sinks_bytes, "utf-8"))
+        return self.sink_registry.all()
+
+    @property
+    def active_sink(self) -> Optional[dict]:
+        """The enabled sink or None
+        """
+        return self.sink_registry.active
 
     @property
     def is_charging(self) -> bool:
         return self._dbus.property("isCharging")
     
-    def send_muted(self, sink: str, muted: bool) -> None:
-        self._dbus.call("sendMuted", sink, muted)
+    def send_muted(self, sink: str, muted: bool, callback: Optional[Callable[[object], None]] = None) -> None:
+        self._dbus.call_async("sendMuted", sink, muted, callback=callback)
     
-    def send_volume(self, sink: str, volume: int) -> None:
-        self._dbus.call("sendVolume", sink, volume)
+    def send_volume(self, sink: str, volume: int, callback: Optional[Callable[[object], None]] = None) -> None:
+        self._dbus.call_async("sendVolume", sink, volume, callback=callback)
 
-    @pyqtSlot()
     def _sinks_changed(self):
-        for handler in self._sinks_changed_handlers:
-            handler()
+        self._dbus.invalidate("sinks")
+        self._sinks_loaded = False
+        # handlers read the sinks, they get them from the cache instead of a blocking call
+        self._dbus.refresh_async(lambda success: self._dbus.dispatch("sinksChanged", self._sinks_changed_handlers))
     
     def notify_sinks_changed(self, handler: Callable[[], None]):
         self._sinks_changed_handlers.append(handler)
     
-    @pyqtSlot(str, int)
     def _volume_changed(self, sink: str, volume: int):
-        for handler in self._volume_changed_handlers:
-            handler(sink, volume)
+        self._sink_registry.update_volume(sink, volume)
+        self._dbus.dispatch("volumeChanged", self._volume_changed_handlers, sink, volume)
 
     def notify_volume_changed(self, handler: Callable[[str, int], None]):
         self._volume_changed_handlers.append(handler)
     
-    @pyqtSlot(str, bool)
     def _muted_changed(self, sink: str, muted: bool):
-        for handler in self._muted_changed_handlers:
-            handler(sink, muted)
+        self._sink_registry.update_muted(sink, muted)
+        self._dbus.dispatch("mutedChanged", self._muted_changed_handlers, sink, muted)
 
     def notify_muted_changed(self, handler: Callable[[str, bool], None]):
         self._muted_changed_handlers.append(handler)
 
-class KDEConnectPluginMPRISRemote(KDEConnectPlugin, QObject):
-    def __init__(self, device_id: str) -> None:
-        super().__init__(device_id, "mprisremote", "org.kde.kdeconnect.device.mprisremote")
+class MprisSnapshot(NamedTuple):
+    """State of the MPRIS remote read from a single `GetAll`. 
+    """
+    is_playing: bool
+    player: str
+    album: str
+    artist: str
+    can_seek: bool
+    player_list: tuple[str, ...]
+    # file url of the art of the playing track, empty if there is none
+    album_art_url: str
+
+class KDEConnectPluginMPRISRemote(KDEConnectPlugin):
+    __slots__ = ("_changed_handlers", "_refresh_pending", "_refresh_outdated")
+
+    def __init__(self, device_id: str, breaker: Optional[CircuitBreaker] = None) -> None:
+        super().__init__(device_id, "mprisremote", "org.kde.kdeconnect.device.mprisremote", breaker)
         
         self._changed_handlers = []
+        # a GetAll is in flight / another one is needed once it returned
+        self._refresh_pending = False
+        self._refresh_outdated = False
         self._dbus.handle_signal("propertiesChanged", self._properties_changed)
 
     @property
@@ -289,6 +717,10 @@ class KDEConnectPluginMPRISRemote(KDEConnectPlugin, QObject):
     def artist(self) -> str:
         return self._dbus.property("artist")
     
+    @property
+    def album_art_url(self) -> str:
+        return self._dbus.property("albumArtUrl")
+    
     @property
     def can_seek(self) -> str:
         return self._dbus.property("canSeek")
@@ -305,42 +737,373 @@ class KDEConnectPluginMPRISRemote(KDEConnectPlugin, QObject):
     def player_list(self) -> list[str]:
         return self._dbus.property("playerList")
     
-    def request_player_list(self):
+    def request_player_list(self, callback: Optional[Callable[[object], None]] = None):
         """Request the player list from the remote device. 
         """
-        self._dbus.call("requestPlayerList")
+        self._dbus.call_async("requestPlayerList", callback=callback)
+
+    def snapshot(self) -> MprisSnapshot:
+        """All properties of the remote, taken from one consistent state. 
+
+        Returns:
+            MprisSnapshot: the current state
+        """
+        properties = self._dbus.properties()
+        return MprisSnapshot(
+            is_playing=properties.get("isPlaying"),
+            player=properties.get("player"),
+            album=properties.get("album"),
+            artist=properties.get("artist"),
+            can_seek=properties.get("canSeek"),
+            player_list=tuple(properties.get("playerList") or ()),
+            album_art_url=properties.get("albumArtUrl") or "")
 
-    @pyqtSlot()
     def _properties_changed(self):
-        logging.debug("Properties changed in MPRISRemote plugin")
-        logging.debug(f"Playing: {self.is_playing}")
-        logging.debug(f"Player: {self.player}")
-        logging.debug(f"Album: {self.album}")
-        logging.debug(f"Artist: {self.artist}") 
-        logging.debug(f"Can seek: {self.can_seek}") 
-        # player list
-        logging.debug(f"Player list: {self.player_list}")
-        
-        for handler in self._changed_handlers:
-            handler()
+        # the signal carries no values, everything has to be fetched again
+        self._dbus.invalidate()
+        if self._refresh_pending:
+            # a burst of signals results in one more GetAll, not one per signal
+            self._refresh_outdated = True
+            return
+        self._refresh_pending = True
+        self._dbus.refresh_async(self._refreshed)
+
+    def _refreshed(self, success: bool):
+        if self._refresh_outdated:
+            self._refresh_outdated = False
+            self._dbus.refresh_async(self._refreshed)
+            return
+        self._refresh_pending = False
+        if not success:
+            return
+        snapshot = self.snapshot()
+        logging.debug("Properties changed in MPRISRemote plugin: %s", snapshot)
+        self._dbus.dispatch("propertiesChanged", self._changed_handlers, snapshot)
+
+    def notify_properties_changed(self, handler: Callable[[MprisSnapshot], None]):
+        """Register a handler that is called with a snapshot of all properties after they changed. 
+
+        Args:
+            handler (Callable[[MprisSnapshot], None]): Handler to be called
+        """
+        self._changed_handlers.append(handler)
+
+class Notification(NamedTuple):
+    """A notification shown on the device. 
+    """
+    public_id: str
+    app_name: str
+    title: str
+    text: str
+    ticker: str
+    dismissable: bool
+    silent: bool
+
+class KDEConnectPluginNotifications(KDEConnectPlugin):
+    """Plugin that mirrors the notifications of the device. 
+
+    Signals are not handled one by one: the ids they carry go to a queue that keeps one entry 
+    per notification, the latest change wins. The queue is flushed every `batch_interval` 
+    seconds, or early once it holds `MAX_PENDING` notifications. A flush reads each posted or 
+    updated notification with one `GetAll` and hands all changes to the handlers at once, so 
+    a burst of chat messages results in one read per notification and one dispatch. 
+
+    If the queue fills up while a flush still waits for a slow device, it is collapsed into a 
+    resync: once the flush is done, the active notifications are listed again and compared with 
+    the known ones. The queue never holds more than `MAX_PENDING` notifications. 
+    """
+    HAS_PROPERTIES = False
+    NOTIFICATION_INTERFACE = "org.kde.kdeconnect.device.notifications.notification"
+    DEFAULT_BATCH_INTERVAL = 1.0
+    # notifications waiting for a flush at most
+    MAX_PENDING = 50
+
+    __slots__ = ("_breaker", "_notifications", "_pending", "_batch_interval", "_flush_scheduled", "_flushing", "_resync_needed", "_generation",
+                 "_changed_handlers")
+
+    def __init__(self, device_id: str, breaker: Optional[CircuitBreaker] = None) -> None:
+        super().__init__(device_id, "notifications", "org.kde.kdeconnect.device.notifications", breaker)
+        self._breaker = breaker
+        # public id -> notification, in the order they were posted
+        self._notifications = {}
+        # public id -> True if it was posted or updated, False if it was removed since the last flush
+        self._pending = {}
+        self._batch_interval = self.DEFAULT_BATCH_INTERVAL
+        self._flush_scheduled = False
+        self._flushing = False
+        # the queue overflowed during a flush, all notifications are listed again after it
+        self._resync_needed = False
+        # bumped when all notifications were removed, replies of reads started before are dropped
+        self._generation = 0
+        self._changed_handlers = []
+        self._dbus.handle_signal("notificationPosted", self._notification_posted)
+        self._dbus.handle_signal("notificationUpdated", self._notification_posted)
+        self._dbus.handle_signal("notificationRemoved", self._notification_removed)
+        self._dbus.handle_signal("allNotificationsRemoved", self._all_notifications_removed)
+
+    def set_batch_interval(self, seconds: float) -> None:
+        """Seconds changes are collected before they are read and dispatched. 
+        """
+        self._batch_interval = seconds
+
+    @property
+    def notifications(self) -> list[Notification]:
+        """The active notifications, oldest first. 
+        """
+        return list(self._notifications.values())
+
+    @property
+    def active_count(self) -> int:
+        return len(self._notifications)
+
+    def load_async(self, callback: Callable[[], None]) -> None:
+        """Read all active notifications without blocking. 
+        """
+        def loaded(public_ids: Optional[list[str]]):
+            for public_id in public_ids or []:
+                self._pending[public_id] = True
+            self._flush(callback)
+        self._dbus.call_async("activeNotifications", callback=loaded)
+
+    def _notification_posted(self, public_id: str):
+        self._enqueue(public_id, True)
+
+    def _notification_removed(self, public_id: str):
+        self._enqueue(public_id, False)
+
+    def _all_notifications_removed(self):
+        self._generation += 1
+        self._pending = {public_id: False for public_id in self._notifications}
+        self._schedule_flush()
+
+    def _enqueue(self, public_id: str, present: bool):
+        # re-inserted, so the queue stays in the order of the latest changes
+        self._pending.pop(public_id, None)
+        self._pending[public_id] = present
+        if len(self._pending) >= self.MAX_PENDING:
+            if not self._flushing:
+                self._flush()
+                return
+            logging.debug(f"Notification queue of {self._device_id} is full during a flush, resyncing after it")
+            registry.inc("kdeconnect_notification_resyncs_total")
+            self._pending = {}
+            self._resync_needed = True
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            engine.call_later(self._batch_interval, self._flush_due)
+
+    def close(self) -> None:
+        super().close()
+        self._pending = {}
+
+    def _flush_due(self):
+        self._flush_scheduled = False
+        if self._flushing or self._dbus.closed:
+            # picked up once the running flush is done
+            return
+        self._flush()
+
+    def _flush(self, callback: Optional[Callable[[], None]] = None):
+        pending = self._pending
+        self._pending = {}
+        self._flushing = True
+        fetched = {}
+        generation = self._generation
+        join = _Join(lambda: self._flushed(pending, fetched, callback, generation))
+        for public_id, present in pending.items():
+            if present:
+                self._fetch(public_id, fetched, join.add())
+        join.start()
+
+    def _notification_dbus(self, public_id: str) -> Optional[DBusWrapper]:
+        # a notification that is gone before it was read is normal, its errors must not count as 
+        # failures of the device, so the wrapper has no breaker and only checks if the device is available
+        if self._breaker is not None and not self._breaker.available:
+            return None
+        return DBusWrapper("org.kde.kdeconnect.daemon", f"/modules/kdeconnect/devices/{self._device_id}/notifications/{public_id}",
+                           self.NOTIFICATION_INTERFACE, watch_properties=False)
+
+    def _fetch(self, public_id: str, fetched: dict, done: Callable[[], None]):
+        dbus = self._notification_dbus(public_id)
+        if dbus is None:
+            done()
+            return
+
+        def refreshed(success: bool):
+            if success:
+                properties = dbus.properties()
+                fetched[public_id] = Notification(
+                    public_id=public_id,
+                    app_name=properties.get("appName", ""),
+                    title=properties.get("title", ""),
+                    text=properties.get("text", ""),
+                    ticker=properties.get("ticker", ""),
+                    dismissable=bool(properties.get("dismissable")),
+                    silent=bool(properties.get("silent")))
+            done()
+        dbus.refresh_async(refreshed)
+
+    def _flushed(self, pending: dict, fetched: dict, callback: Optional[Callable[[], None]], generation: int):
+        self._flushing = False
+        if generation != self._generation:
+            # read before all notifications were removed, the removal is queued already
+            pending = {}
+        posted = []
+        removed = []
+        for public_id, present in pending.items():
+            notification = fetched.get(public_id)
+            if present and notification is not None:
+                # an update keeps the position of the notification
+                self._notifications[public_id] = notification
+                posted.append(notification)
+            elif self._notifications.pop(public_id, None) is not None:
+                # removed, or gone before it could be read
+                removed.append(public_id)
+        if self._resync_needed:
+            self._resync()
+        elif self._pending:
+            self._schedule_flush()
+        if callback is not None:
+            callback()
+        elif posted or removed:
+            self._dbus.dispatch("notificationsChanged", self._changed_handlers, posted, removed)
+
+    def _resync(self):
+        self._resync_needed = False
+        if self._dbus.closed:
+            return
+        # no flush may start until the list arrived
+        self._flushing = True
+        generation = self._generation
+
+        def listed(public_ids: Optional[list[str]]):
+            self._flushing = False
+            if generation != self._generation:
+                # all notifications were removed while it was listed, the list is outdated
+                pass
+            elif public_ids is not None:
+                active = set(public_ids)
+                resync = {public_id: True for public_id in public_ids}
+                resync.update((public_id, False) for public_id in self._notifications if public_id not in active)
+                # changes queued since the overflow are newer than the list
+                resync.update(self._pending)
+                self._pending = resync
+            else:
+                # the changes of the overflow are lost, they are picked up by the next resync
+                logging.warning(f"Failed to list the notifications of {self._device_id}")
+            if self._pending:
+                self._flush()
+        self._dbus.call_async("activeNotifications", callback=listed)
+
+    def dismiss(self, public_id: str, callback: Optional[Callable[[object], None]] = None):
+        """Dismiss a notification on the device. 
+        """
+        dbus = self._notification_dbus(public_id)
+        if dbus is None:
+            if callback is not None:
+                # like a failed call, the callback never runs before dismiss returned
+                engine.call_soon_threadsafe(lambda: callback(None))
+            return
+        dbus.call_async("dismiss", callback=callback)
+
+    def notify_notifications_changed(self, handler: Callable[[list[Notification], list[str]], None]):
+        """Register a handler that is called once per batch with the notifications that were 
+        posted or updated and the public ids of the ones that were removed. 
 
-    def notify_properties_changed(self, handler: Callable[[], None]):
+        Args:
+            handler (Callable[[list[Notification], list[str]], None]): Handler to be called
+        """
         self._changed_handlers.append(handler)
 
+class KDEConnectPluginShare(KDEConnectPlugin):
+    """Plugin that sends files and links to the device. 
+    """
+    HAS_PROPERTIES = False
+
+    __slots__ = ()
+
+    def __init__(self, device_id: str, breaker: Optional[CircuitBreaker] = None) -> None:
+        super().__init__(device_id, "share", "org.kde.kdeconnect.device.share", breaker)
+
+    def share_url(self, url: str, callback: Optional[Callable[[bool], None]] = None):
+        """Send a link, or a local file given as file:// url, to the device. 
+
+        The daemon reads files in the background, they must exist until the transfer finished. 
+
+        Args:
+            url (str): the link or file url
+            callback (Callable[[bool], None], optional): called with True once the daemon accepted 
+                the url or with False if the call failed
+        """
+        self._dbus.call_void_async("shareUrl", url, callback=callback)
+
 class KDEConnectDevice():
+    """A device known to the daemon and its plugins. 
+
+    Plugin proxies are created on first access with `get_plugin`, plugins that are never used 
+    don't cost any D-Bus traffic. Plugins that are not in the allowlist are skipped altogether. 
+    """
+    # pairStateChanged value of paired devices
+    PAIR_STATE_PAIRED = 3
+
+    PLUGIN_MAP = {
+        "kdeconnect_ping": KDEConnectPluginPing,
+        "kdeconnect_battery": KDEConnectPluginBattery,
+        "kdeconnect_connectivity_report": KDEConnectPluginConnectivityReport,
+        "kdeconnect_findmyphone": KDEConnectPluginFindMyPhone,
+        "kdeconnect_mprisremote": KDEConnectPluginMPRISRemote,
+        "kdeconnect_lockdevice": KDEConnectPluginLockDevice,
+        "kdeconnect_remotesystemvolume": KDEConnectPluginRemoteSystemVolume,
+        "kdeconnect_notifications": KDEConnectPluginNotifications,
+        "kdeconnect_share": KDEConnectPluginShare,
+    }
+
+    __slots__ = ("_device_id", "_host_device_id", "_dbus", "_breaker", "_available_changed_handlers", "_allowed_plugins", "_plugin_names", "_plugins",
+                 "_paired_changed_handlers", "_plugins_changed_handlers", "_plugins_reload_pending", "_plugins_reload_outdated", "__weakref__")
 
-    def __init__(self, host_device_id: str, device_id: str) -> None:
+    def __init__(self, host_device_id: str, device_id: str, load_plugins: bool = True, plugins: Optional[Iterable[str]] = None) -> None:
+        """
+        Args:
+            host_device_id (str): id of the host running the KDE Connect daemon
+            device_id (str): id of the device
+            load_plugins (bool, optional): fetch the plugins of the device with a blocking call, 
+                pass False and use `load_async` instead to not block the event loop
+            plugins (Iterable[str], optional): allowlist of plugin names, by default all plugins 
+                of `PLUGIN_MAP` are used
+        """
         self._device_id = device_id
         self._host_device_id = host_device_id
         self._dbus = DBusWrapper("org.kde.kdeconnect.daemon", f"/modules/kdeconnect/devices/{self._device_id}", "org.kde.kdeconnect.device")
+        # guards the calls of all plugins, the calls of the device itself are answered by the daemon
+        self._breaker = CircuitBreaker(f"Device {device_id}", probe=self._probe)
+        self._available_changed_handlers = []
+        self._breaker.notify_available_changed(self._available_changed)
+        self._allowed_plugins = None if plugins is None else frozenset(plugins)
+        # names of the plugins that are loaded on the device and allowed, in the order of the daemon
+        self._plugin_names = []
+        # name -> proxy of the plugins that were accessed
         self._plugins = {}
-        self._load_plugins()
-        
-        # TODO: handle changed plugins
+        self._dbus.handle_signal("nameChanged", self._name_changed)
+        self._dbus.handle_signal("reachableChanged", self._reachable_changed)
+        self._paired_changed_handlers = []
+        self._dbus.handle_signal("pairStateChanged", self._pair_state_changed)
+        self._plugins_changed_handlers = []
+        # loadedPlugins is in flight / has to be called again once it returned
+        self._plugins_reload_pending = False
+        self._plugins_reload_outdated = False
+        self._dbus.handle_signal("pluginsChanged", self._plugins_changed)
+        if load_plugins:
+            self._load_plugins()
 
     def is_paired(self) -> bool:
         return self._dbus.call("isPaired")
 
+    def is_paired_async(self, callback: Callable[[Optional[bool]], None]) -> None:
+        self._dbus.call_async("isPaired", callback=callback)
+
     @property
     def host_device_id(self) -> str:
         return self._host_device_id
@@ -353,6 +1116,45 @@ class KDEConnectDevice():
     def name(self) -> str:
         return self._dbus.property("name")
 
+    def _name_changed(self, name: str):
+        self._dbus.update_cache({"name": name})
+
+    @property
+    def is_reachable(self) -> bool:
+        return bool(self._dbus.property("isReachable"))
+
+    def _reachable_changed(self, is_reachable: bool):
+        self._dbus.update_cache({"isReachable": is_reachable})
+        self._breaker.set_reachable(is_reachable)
+
+    @property
+    def is_available(self) -> bool:
+        """If calls to the plugins of the device are expected to succeed, False while the device 
+        is out of reach or after calls failed repeatedly. 
+        """
+        return self._breaker.available
+
+    def _probe(self, callback: Callable[[bool], None]) -> None:
+        self._dbus.refresh_async(lambda success: callback(success and self.is_reachable))
+
+    def _available_changed(self, available: bool):
+        self._dbus.dispatch("availableChanged", self._available_changed_handlers, available)
+
+    def notify_available_changed(self, handler: Callable[[bool], None]):
+        """Register a handler that is called with False when the device became unavailable and 
+        with True when it's available again, see `is_available`. 
+        """
+        self._available_changed_handlers.append(handler)
+
+    def _pair_state_changed(self, pair_state: int):
+        self._dbus.dispatch("pairStateChanged", self._paired_changed_handlers, pair_state == self.PAIR_STATE_PAIRED)
+
+    def notify_paired_changed(self, handler: Callable[[bool], None]):
+        """Register a handler that is called with True when the device got paired or False 
+        when it was unpaired. 
+        """
+        self._paired_changed_handlers.append(handler)
+
     def loaded_plugins(self) -> list[str]:
         return self._dbus.call("loadedPlugins")
 
@@ -363,38 +1165,137 @@ class KDEConnectDevice():
         return self._dbus.call("isPluginEnabled", name)
 
     def _load_plugins(self):
-        plugin_map = {
-            "kdeconnect_ping": KDEConnectPluginPing,
-            "kdeconnect_battery": KDEConnectPluginBattery,
-            "kdeconnect_connectivity_report": KDEConnectPluginConnectivityReport,
-            "kdeconnect_findmyphone": KDEConnectPluginFindMyPhone,
-            "kdeconnect_mprisremote": KDEConnectPluginMPRISRemote,
-            "kdeconnect_lockdevice": KDEConnectPluginLockDevice,
-            "kdeconnect_remotesystemvolume": KDEConnectPluginRemoteSystemVolume
-        }
-
-        for plugin, cls in plugin_map.items():
-            if self.has_plugin(plugin) and self.is_plugin_enabled(plugin) and plugin not in self._plugins:
-                print(f"adding Plugin {plugin}")
-                self._plugins[plugin] = cls(self._device_id)
+        # loadedPlugins holds exactly the plugins that are available and enabled
+        self._add_plugins(self.loaded_plugins() or [])
+
+    def _add_plugins(self, plugin_names: list[str]) -> list[str]:
+        added = []
+        for plugin in plugin_names:
+            if plugin not in self.PLUGIN_MAP or plugin in self._plugin_names:
+                continue
+            if self._allowed_plugins is not None and plugin not in self._allowed_plugins:
+                logging.debug(f"Skipping plugin {plugin} of {self._device_id}, it's not in the allowlist")
+                continue
+            self._plugin_names.append(plugin)
+            added.append(plugin)
+        return added
+
+    @property
+    def plugin_names(self) -> list[str]:
+        """Names of the plugins that are loaded on the device and allowed. 
+        """
+        return list(self._plugin_names)
+
+    def load_async(self, callback: Callable[["KDEConnectDevice"], None]) -> None:
+        """Load the properties and plugins of the device without blocking. The properties of 
+        the device and of all its plugins are fetched concurrently. 
+
+        Args:
+            callback (Callable[[KDEConnectDevice], None]): called with the device once everything arrived
+        """
+        join = _Join(lambda: self._loaded(callback))
+        self._dbus.refresh_async(join.add())
+        plugins_done = join.add()
+
+        def plugins_loaded(plugin_names: Optional[list[str]]):
+            # the caller narrows the plugins with the allowlist, the allowed ones are loaded now 
+            # because the event loop must not block on their properties later
+            for name in self._add_plugins(plugin_names or []):
+                self.get_plugin(name).load_async(join.add())
+            plugins_done()
+
+        self._dbus.call_async("loadedPlugins", callback=plugins_loaded)
+        join.start()
+
+    def _loaded(self, callback: Callable[["KDEConnectDevice"], None]):
+        # only now, the plugins must be able to load while a device is out of reach
+        self._breaker.set_reachable(self.is_reachable)
+        callback(self)
+
+    def _plugins_changed(self):
+        if self._plugins_reload_pending:
+            self._plugins_reload_outdated = True
+            return
+        self._plugins_reload_pending = True
+        self._dbus.call_async("loadedPlugins", callback=self._plugins_reloaded)
+
+    def _plugins_reloaded(self, plugin_names: Optional[list[str]]):
+        if self._plugins_reload_outdated:
+            self._plugins_reload_outdated = False
+            self._dbus.call_async("loadedPlugins", callback=self._plugins_reloaded)
+            return
+        self._plugins_reload_pending = False
+        if plugin_names is None:
+            return
+        removed = [name for name in self._plugin_names if name not in plugin_names]
+        for name in removed:
+            logging.info(f"Removing plugin {name} of {self._device_id}")
+            self._plugin_names.remove(name)
+            plugin = self._plugins.pop(name, None)
+            if plugin is not None:
+                plugin.close()
+        added = self._add_plugins(plugin_names)
+        if not added and not removed:
+            return
+        # the handlers get the new plugins once their properties arrived
+        join = _Join(lambda: self._dbus.dispatch("pluginsChanged", self._plugins_changed_handlers, added, removed))
+        for name in added:
+            self.get_plugin(name).load_async(join.add())
+        join.start()
+
+    def close(self) -> None:
+        """Stop handling the signals of the device and of all its plugins, e.g. once it was removed. 
+        None of the handlers is called anymore. 
+        """
+        self._dbus.close()
+        for plugin in self._plugins.values():
+            plugin.close()
+        self._breaker.close()
+
+    def notify_plugins_changed(self, handler: Callable[[list[str], list[str]], None]):
+        """Register a handler that is called with the names of the plugins that were enabled 
+        and of the ones that were disabled on the device. 
+
+        Args:
+            handler (Callable[[list[str], list[str]], None]): Handler to be called
+        """
+        self._plugins_changed_handlers.append(handler)
+
+    def get_plugin(self, name: str) -> Optional[KDEConnectPlugin]:
+        """Returns the proxy of a plugin, it's created on first access. 
+
+        Returns:
+            Optional[KDEConnectPlugin]: None if the plugin isn't loaded on the device or not allowed
+        """
+        plugin = self._plugins.get(name)
+        if plugin is None and name in self._plugin_names:
+            print(f"adding Plugin {name}")
+            plugin = self._plugins[name] = self.PLUGIN_MAP[name](self._device_id, self._breaker)
+        return plugin
 
     def get_plugin_ping(self) -> KDEConnectPluginPing:
-        return self._plugins.get("kdeconnect_ping", None)
+        return self.get_plugin("kdeconnect_ping")
 
     def get_plugin_battery(self) -> KDEConnectPluginBattery:
-        return self._plugins.get("kdeconnect_battery", None)
+        return self.get_plugin("kdeconnect_battery")
 
     def get_plugin_connectivity_report(self) -> KDEConnectPluginConnectivityReport:
-        return self._plugins.get("kdeconnect_connectivity_report", None)
+        return self.get_plugin("kdeconnect_connectivity_report")
     
     def get_plugin_find_my_phone(self) -> KDEConnectPluginFindMyPhone:
-        return self._plugins.get("kdeconnect_findmyphone", None)
+        return self.get_plugin("kdeconnect_findmyphone")
 
     def get_plugin_mpris_remote(self) -> KDEConnectPluginMPRISRemote:
-        return self._plugins.get("kdeconnect_mprisremote", None)
+        return self.get_plugin("kdeconnect_mprisremote")
     
     def get_plugin_lock_device(self) -> KDEConnectPluginLockDevice:
-        return self._plugins.get("kdeconnect_lockdevice", None)
+        return self.get_plugin("kdeconnect_lockdevice")
     
     def get_plugin_remote_system_volume(self) -> KDEConnectPluginRemoteSystemVolume:
-        return self._plugins.get("kdeconnect_remotesystemvolume", None)
\ No newline at end of file
+        return self.get_plugin("kdeconnect_remotesystemvolume")
+
+    def get_plugin_notifications(self) -> KDEConnectPluginNotifications:
+        return self.get_plugin("kdeconnect_notifications")
+
+    def get_plugin_share(self) -> KDEConnectPluginShare:
+        return self.get_plugin("kdeconnect_share")
\ No newline at end of file
@@ -0,0 +1,81 @@
+from metrics import registry
+from typing import Optional
+import engine
+import logging
+import sys
+import threading
+import time
+import traceback
+
+class LoopLagMonitor():
+    """Measures how late the timers of the event loop fire.
+
+    Everything of the bridge runs on one event loop, a handler that blocks delays all devices at
+    once. A timer is scheduled every `interval` seconds and the time it fired late is observed in
+    `kdeconnect_event_loop_lag_seconds`. A watchdog thread looks at the loop while the timer is
+    overdue: once the loop is stuck for `stall_threshold` seconds it logs the stack of the loop
+    thread, the handler that blocks it, and counts a stall.
+
+    Code that holds the GIL without running Python, e.g. a blocking call in C, can't be caught in
+    the act, the stack is taken once it gave the GIL up again.
+    """
+    DEFAULT_INTERVAL = 0.1
+    DEFAULT_STALL_THRESHOLD = 0.25
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL, stall_threshold: float = DEFAULT_STALL_THRESHOLD) -> None:
+        """
+        Args:
+            interval (float, optional): seconds between two timers
+            stall_threshold (float, optional): seconds the loop must be stuck to log the running handler
+        """
+        self._interval = interval
+        self._stall_threshold = stall_threshold
+        self._loop_thread = None
+        # monotonic time the next timer is due, None until the loop runs
+        self._due = None
+        self._stall_logged = False
+        self._stopped = threading.Event()
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self.max_lag = 0.0
+
+    def start(self) -> None:
+        """Start measuring. Must be called from the thread of the loop, measuring starts once it runs.
+        """
+        self._loop_thread = threading.get_ident()
+        engine.call_later(0, self._tick)
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _tick(self) -> None:
+        if self._stopped.is_set():
+            return
+        now = time.monotonic()
+        if self._due is not None:
+            lag = max(0.0, now - self._due)
+            registry.observe("kdeconnect_event_loop_lag_seconds", lag)
+            self.max_lag = max(self.max_lag, lag)
+            if self._stall_logged:
+                logging.warning(f"Event loop was stalled for {lag * 1000:.0f} ms")
+        self._stall_logged = False
+        self._due = now + self._interval
+        engine.call_later(self._interval, self._tick)
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self._stall_threshold / 2):
+            due = self._due
+            if due is None or self._stall_logged:
+                continue
+            stalled = time.monotonic() - due
+            if stalled < self._stall_threshold:
+                continue
+            self._stall_logged = True
+            registry.inc("kdeconnect_event_loop_stalls_total")
+            logging.warning(f"Event loop stalled for {stalled * 1000:.0f} ms so far, running:\n{self._loop_stack()}")
+
+    def _loop_stack(self) -> Optional[str]:
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return None
+        return "".join(traceback.format_stack(frame)).rstrip()
@@ -0,0 +1,207 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+import bisect
+import logging
+import threading
+import time
+
+class Histogram():
+    """Cumulative histogram with fixed buckets in the style of Prometheus.
+    """
+    # upper bounds in seconds, from fast local calls up to the default D-Bus timeout
+    DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        # the last count is the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics():
+    """Counters and histograms with labels, rendered in the Prometheus text format.
+
+    Thread safe, metrics are recorded from the Qt thread as well as from MQTT callbacks.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # name -> labels -> value, labels are a tuple of (name, value) pairs
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+
+    def describe(self, name: str, help_text: str) -> None:
+        self._help[name] = help_text
+
+    @staticmethod
+    def _labels(labels: Optional[dict[str, str]]) -> tuple:
+        return tuple(sorted(labels.items())) if labels else ()
+
+    def inc(self, name: str, labels: Optional[dict[str, str]] = None, value: float = 1) -> None:
+        """Increase a counter.
+        """
+        key = self._labels(labels)
+        with self._lock:
+            counter = self._counters.setdefault(name, {})
+            counter[key] = counter.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: Optional[dict[str, str]] = None) -> None:
+        """Add a value, e.g. a duration in seconds, to a histogram.
+        """
+        key = self._labels(labels)
+        with self._lock:
+            histograms = self._histograms.setdefault(name, {})
+            histogram = histograms.get(key)
+            if histogram is None:
+                histogram = histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def timer(self, name: str, labels: Optional[dict[str, str]] = None) -> "_Timer":
+        """Returns a context manager that observes its duration in a histogram.
+        """
+        return _Timer(self, name, labels)
+
+    def total(self, name: str) -> float:
+        """Sum of a counter over all labels.
+        """
+        with self._lock:
+            return sum(self._counters.get(name, {}).values())
+
+    def histogram_total(self, name: str) -> tuple[int, float]:
+        """Count and sum of a histogram over all labels.
+        """
+        with self._lock:
+            histograms = self._histograms.get(name, {}).values()
+            return sum(h.count for h in histograms), sum(h.sum for h in histograms)
+
+    @staticmethod
+    def _format_labels(labels: tuple, extra: Optional[tuple] = None) -> str:
+        labels = labels + extra if extra else labels
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{name}="{Metrics._escape(value)}"' for name, value in labels) + "}"
+
+    @staticmethod
+    def _escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    def render(self) -> str:
+        """Returns all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            for name, counter in sorted(self._counters.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in counter.items():
+                    lines.append(f"{name}{self._format_labels(labels)} {value}")
+            for name, histograms in sorted(self._histograms.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in histograms.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{self._format_labels(labels, (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{self._format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{self._format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+class _Timer():
+    def __init__(self, metrics: Metrics, name: str, labels: Optional[dict[str, str]]) -> None:
+        self._metrics = metrics
+        self._name = name
+        self._labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self._metrics.observe(self._name, time.perf_counter() - self._started, self._labels)
+
+# metrics of the whole process
+registry = Metrics()
+registry.describe("kdeconnect_dbus_calls_total", "D-Bus method calls to the KDE Connect daemon")
+registry.describe("kdeconnect_dbus_call_errors_total", "D-Bus method calls that failed or timed out")
+registry.describe("kdeconnect_dbus_call_seconds", "Time until the reply of a D-Bus method call arrived")
+registry.describe("kdeconnect_dbus_calls_rejected_total", "D-Bus method calls failed right away because the device was unavailable")
+registry.describe("kdeconnect_dbus_calls_refused_total", "Blocking D-Bus calls not made because the asyncio event loop runs")
+registry.describe("kdeconnect_circuit_opened_total", "Times a device became unavailable after failed calls or going out of reach")
+registry.describe("kdeconnect_dbus_property_reads_total", "Property reads, served from the cache or the bus")
+registry.describe("kdeconnect_signal_dispatches_total", "D-Bus signals dispatched to handlers")
+registry.describe("kdeconnect_signal_dispatch_errors_total", "Handlers of D-Bus signals that raised an exception")
+registry.describe("kdeconnect_signal_dispatch_seconds", "Time the handlers of a D-Bus signal took")
+registry.describe("kdeconnect_mqtt_publishes_total", "MQTT messages published per entity")
+registry.describe("kdeconnect_mqtt_publish_bytes_total", "Payload bytes published per entity")
+registry.describe("kdeconnect_mqtt_publishes_skipped_total", "MQTT publishes dropped because nothing changed")
+registry.describe("kdeconnect_mqtt_publishes_buffered_total", "MQTT publishes held back while the broker was not connected")
+registry.describe("kdeconnect_mqtt_retained_lost_total", "Reconnects after which the broker had lost the retained messages")
+registry.describe("kdeconnect_commands_total", "Commands received over MQTT per entity")
+registry.describe("kdeconnect_commands_coalesced_total", "Commands replaced by a newer one of the same entity before they ran")
+registry.describe("kdeconnect_commands_dropped_total", "Commands dropped because the command queue was full")
+registry.describe("kdeconnect_share_files_total", "Files received over MQTT and passed to KDE Connect per device")
+registry.describe("kdeconnect_share_deduplicated_total", "Files not shared because the same content was shared shortly before")
+registry.describe("kdeconnect_share_rejected_total", "Files not shared because they were empty, too large or could not be spooled")
+registry.describe("kdeconnect_notification_resyncs_total", "Notification queues that overflowed during a flush and were resynced")
+registry.describe("kdeconnect_file_cache_evicted_total", "Files deleted from a file cache to stay within its size")
+registry.describe("kdeconnect_album_art_cache_hits_total", "Album art found in the cache, no scaling needed")
+registry.describe("kdeconnect_album_art_cache_misses_total", "Album art that had to be scaled and cached")
+registry.describe("kdeconnect_album_art_unchanged_total", "Track changes that kept the album art, nothing was published")
+registry.describe("kdeconnect_event_loop_lag_seconds", "Time the timers of the event loop fired late")
+registry.describe("kdeconnect_event_loop_stalls_total", "Times the event loop was stuck in a handler beyond the stall threshold")
+registry.describe("kdeconnect_signals_traced_total", "D-Bus signals sampled for signal-to-publish tracing")
+registry.describe("kdeconnect_signal_to_publish_seconds", "Time from a traced D-Bus signal to an MQTT publish it caused")
+
+class MetricsServer():
+    """Serves the metrics at /metrics over http from a background thread.
+    """
+
+    def __init__(self, metrics: Metrics, port: int, host: str = "127.0.0.1") -> None:
+        """
+        Args:
+            metrics (Metrics): metrics to serve
+            port (int): port to listen on
+            host (str, optional): address to listen on, local only by default
+        """
+        metrics_to_serve = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics_to_serve.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug(f"Metrics request: {format % args}")
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self) -> None:
+        logging.info(f"Serving metrics on http://{self._server.server_address[0]}:{self.port}/metrics")
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
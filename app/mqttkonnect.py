@@ -1,66 +1,466 @@
-from ha_mqtt_discoverable import Settings
-from ha_mqtt_discoverable.sensors import Button, ButtonInfo, DeviceInfo, BinarySensorInfo, BinarySensor, SensorInfo, Sensor, SwitchInfo, Switch, NumberInfo, Number, Text, TextInfo
+from ha_mqtt_discoverable import Settings, DeviceInfo
+from ha_mqtt_discoverable.sensors import Button, ButtonInfo, BinarySensorInfo, BinarySensor, SensorInfo, Sensor, SwitchInfo, Switch, NumberInfo, Number, Text, TextInfo, Image, ImageInfo
 from paho.mqtt.client import Client, MQTTMessage
 
-from konnect import KDEConnectDevice, KDEConnectDaemon
+from konnect import KDEConnectDevice, KDEConnectDaemon, MprisSnapshot, Notification
+from albumart import AlbumArtCache
+from looplag import LoopLagMonitor
+from mqttsession import MqttSession
+from profiler import Profiler
+from sharespool import ShareSpool
+import engine
+import signaltrace
+from metrics import registry, MetricsServer
+from collections import OrderedDict
+from typing import Callable, Optional
+import json
 import logging
+import math
+import pathlib
 import time
 
+# minimum seconds between two publishes of fast changing values per entity id, the latest 
+# value of a window is published at its end
+# entities whose last state is kept in the state snapshot, never the content of notifications or shared urls
+SNAPSHOT_ENTITIES = frozenset((
+    "swt-lockdevice", "snsr-charging", "snsr-battery", "snsr-playing", "snsr-player", "snsr-player-artist", "snsr-player-album",
+    "snsr-networktype", "snsr-networkstrength", "swt-mutedevice", "num-volume",
+))
+
+DEFAULT_PUBLISH_INTERVALS = {
+    "num-volume": 0.5,
+    "snsr-mprisremote": 0.5,
+    "snsr-connectivity": 2.0,
+    # notifications are collected this long and then published at once
+    "snsr-notifications": 1.0,
+}
+
+# entity id -> entity class, info class, name and further fields of the info. Definitions are shared 
+# by the entities of all devices, only the unique id and the device are set per entity
+ENTITIES = {
+    "btn-finddevice": (Button, ButtonInfo, "Find Device", {}),
+    "swt-lockdevice": (Switch, SwitchInfo, "Lock Device", {}),
+    "snsr-charging": (BinarySensor, BinarySensorInfo, "Charging", {"device_class": "battery_charging"}),
+    "snsr-battery": (Sensor, SensorInfo, "Battery", {"device_class": "battery", "unit_of_measurement": "%"}),
+    "snsr-playing": (BinarySensor, BinarySensorInfo, "Playing", {}),
+    "snsr-player": (Text, TextInfo, "Player", {}),
+    "snsr-player-artist": (Text, TextInfo, "Player Artist", {}),
+    "snsr-player-album": (Text, TextInfo, "Player Album", {}),
+    # the image topic is set per device
+    "img-albumart": (Image, ImageInfo, "Album Art", {"content_type": AlbumArtCache.CONTENT_TYPE}),
+    "snsr-networktype": (Sensor, SensorInfo, "Network Type", {"device_class": "enum"}),
+    "snsr-networkstrength": (Sensor, SensorInfo, "Network Signal Strength", {"device_class": "signal_strength"}),
+    "swt-mutedevice": (Switch, SwitchInfo, "Mute Device", {}),
+    "num-volume": (Number, NumberInfo, "Volume", {"min": 0, "max": 100, "unit_of_measurement": "%"}),
+    "snsr-notifications": (Sensor, SensorInfo, "Notifications", {"state_class": "measurement", "icon": "mdi:bell"}),
+    "btn-dismissnotifications": (Button, ButtonInfo, "Dismiss Notifications", {}),
+    "txt-shareurl": (Text, TextInfo, "Share URL", {"icon": "mdi:share-variant"}),
+}
+
+def device_identifier(host_device_id: str, device_id: str) -> str:
+    """Returns the identifier of a device in HA, it is unique per host and device.
+    """
+    return f"kdeconnect_{host_device_id}_{device_id}"
+
 class MqttDaemon():
-    def __init__(self, mqtt_settings: Settings.MQTT) -> None:
-        self._mqtt_settings = mqtt_settings
+    def __init__(self, mqtt_settings: Settings.MQTT, publish_intervals: Optional[dict[str, float]] = None, force_refresh_interval: Optional[float] = None,
+                 discovery_cache_path: Optional[str] = None, metrics_port: Optional[int] = None, diagnostics_interval: Optional[float] = None,
+                 state_snapshot_path: Optional[str] = None, plugins: Optional[list[str]] = None, device_plugins: Optional[dict[str, list[str]]] = None,
+                 share_spool_path: Optional[str] = None, share_spool_max_bytes: int = ShareSpool.DEFAULT_MAX_BYTES,
+                 album_art_cache_path: Optional[str] = None, album_art_max_bytes: int = AlbumArtCache.DEFAULT_MAX_BYTES,
+                 album_art_max_size: Optional[int] = None, loop_lag_threshold: Optional[float] = None,
+                 signal_trace_rate: Optional[float] = None, debug_commands: bool = False, profile_path: Optional[str] = None) -> None:
+        """
+        Args:
+            mqtt_settings (Settings.MQTT): connection settings of the broker
+            publish_intervals (dict[str, float], optional): overrides `DEFAULT_PUBLISH_INTERVALS`, 
+                e.g. {"num-volume": 1.0}, 0 disables rate limiting
+            force_refresh_interval (float, optional): seconds after which an unchanged state is published 
+                again, by default unchanged states are never repeated
+            discovery_cache_path (str, optional): file to remember published discovery configs in, 
+                unchanged configs are not published again after a restart
+            metrics_port (int, optional): serve metrics in the Prometheus text format on 
+                http://127.0.0.1:<port>/metrics
+            diagnostics_interval (float, optional): publish metrics as diagnostic sensors of a bridge device 
+                in HA every that many seconds
+            state_snapshot_path (str, optional): file to remember the last states in, they are published 
+                right after a restart while the devices are still probed
+            plugins (list[str], optional): allowlist of plugin names, e.g. ["kdeconnect_battery"], 
+                other plugins get no entities and are not even queried, by default all plugins are used
+            device_plugins (dict[str, list[str]], optional): allowlists per device id, they replace 
+                `plugins` for these devices
+            share_spool_path (str, optional): directory files sent to devices over MQTT are kept in until 
+                KDE Connect transferred them, by default no files are accepted, only links
+            share_spool_max_bytes (int, optional): size of the share spool, the least recently shared 
+                files are deleted beyond it
+            album_art_cache_path (str, optional): directory to cache album art in, it is published as image 
+                of the MPRIS remote if set
+            album_art_max_bytes (int, optional): size of the album art cache, the least recently used art is 
+                deleted beyond it
+            album_art_max_size (int, optional): downscale album art to fit this many pixels, needs Pillow
+            loop_lag_threshold (float, optional): measure how late the timers of the event loop fire and log 
+                the running handler once the loop is stuck for that many seconds
+            signal_trace_rate (float, optional): trace this share of the signals until the publishes they 
+                caused, e.g. 0.1, see signaltrace.py
+            debug_commands (bool, optional): accept commands to profile the event loop and to export the 
+                signal traces over MQTT, see `MqttBridgeDebug`
+            profile_path (str, optional): directory to keep the profiles taken over MQTT in as .pstats files
+        """
+        self._loop_lag_monitor = None
+        if loop_lag_threshold is not None:
+            self._loop_lag_monitor = LoopLagMonitor(stall_threshold=loop_lag_threshold)
+            self._loop_lag_monitor.start()
+        if signal_trace_rate is not None:
+            signaltrace.enable(signal_trace_rate)
+        share_spool = None
+        if share_spool_path is not None:
+            share_spool = ShareSpool(share_spool_path, share_spool_max_bytes)
+        album_art_cache = None
+        if album_art_cache_path is not None:
+            album_art_cache = AlbumArtCache(album_art_cache_path, album_art_max_bytes, album_art_max_size)
+        self._mqtt_session = MqttSession(mqtt_settings, DEFAULT_PUBLISH_INTERVALS | (publish_intervals or {}), force_refresh_interval,
+                                         discovery_cache_path, state_snapshot_path, share_spool, album_art_cache)
         self._daemon = KDEConnectDaemon()
+        self._host_device_id = self._daemon.self_id()
+        self._host_device_name = self._daemon.announced_name()
+        self._metrics_server = None
+        if metrics_port is not None:
+            self._metrics_server = MetricsServer(registry, metrics_port)
+            self._metrics_server.start()
+        self._diagnostics = None
+        if diagnostics_interval is not None:
+            self._diagnostics = MqttBridgeDiagnostics(self._mqtt_session, self._host_device_id, self._host_device_name, diagnostics_interval)
+        self._debug = None
+        if debug_commands:
+            self._debug = MqttBridgeDebug(self._mqtt_session, self._host_device_id, profile_path)
+        self._plugins = plugins
+        self._device_plugins = device_plugins or {}
         self._mqtt_devices = {}
+        # devices that are still loading, they must be referenced until they are done
+        self._onboarding = {}
+        # devices the daemon knows that aren't paired, watched until they get paired
+        self._unpaired = {}
         self.update_devices()
-        self._daemon.notify_device_list_changed(self.update_devices)
+        # changes are applied one device at a time, only a restarted daemon needs a full reconcile
+        self._daemon.notify_device_added(self._device_added)
+        self._daemon.notify_device_removed(self._remove_device)
+        self._daemon.notify_restarted(self.update_devices)
     
     def update_devices(self):
-        for device_id in self._daemon.devices(only_paired = True):
-            if device_id not in self._mqtt_devices:
-                device = KDEConnectDevice(self._daemon.self_id(), device_id)
-                logging.debug(f"Device: {device.name} ({device.device_id})")
-                mqtt_device = MqttDevice(self._mqtt_settings, self._daemon.announced_name(), device)
-                self._mqtt_devices[device_id] = mqtt_device
+        """Reconcile the devices in HA with all paired devices of the daemon. Devices the daemon 
+        knows that aren't paired are watched, they are onboarded once they get paired. 
+        """
+        self._daemon.devices_async(self._reconcile_devices, only_paired = True)
+
+    def _reconcile_devices(self, device_ids: Optional[list[str]]):
+        if device_ids is None:
+            return
+        for device_id in list(self._mqtt_devices) + list(self._onboarding):
+            if device_id not in device_ids:
+                self._remove_device(device_id)
+        self._remove_unknown_devices(device_ids)
+        new_devices = []
+        for device_id in device_ids:
+            if device_id not in self._mqtt_devices and device_id not in self._onboarding:
+                device = self._unpaired.pop(device_id, None) or self._watch_device(device_id)
+                new_devices.append(device)
+        self._onboard_devices(new_devices)
+        self._daemon.devices_async(lambda known_ids: self._watch_unpaired(known_ids, device_ids), only_paired = False)
+
+    def _watch_unpaired(self, known_ids: Optional[list[str]], paired_ids: list[str]):
+        if known_ids is None:
+            return
+        for device_id in list(self._unpaired):
+            if device_id not in known_ids:
+                self._unpaired.pop(device_id).close()
+        for device_id in known_ids:
+            if device_id not in paired_ids:
+                # checks the pair state itself, the device may have been paired in between
+                self._device_added(device_id)
+
+    def _watch_device(self, device_id: str) -> KDEConnectDevice:
+        device = KDEConnectDevice(self._host_device_id, device_id, load_plugins=False, plugins=self._allowed_plugins(device_id))
+        device.notify_paired_changed(lambda paired: self._device_paired_changed(device_id, paired))
+        return device
+
+    def _allowed_plugins(self, device_id: str) -> list[str]:
+        # plugins without entities are never needed
+        allowed = self._device_plugins.get(device_id, self._plugins)
+        if allowed is None:
+            return list(MqttDevice.PLUGIN_MAP)
+        return [name for name in allowed if name in MqttDevice.PLUGIN_MAP]
+
+    def _device_added(self, device_id: str):
+        if device_id in self._mqtt_devices or device_id in self._onboarding or device_id in self._unpaired:
+            return
+        device = self._watch_device(device_id)
+        self._unpaired[device_id] = device
+
+        def paired(is_paired: Optional[bool]):
+            if is_paired and self._unpaired.pop(device_id, None) is device:
+                self._onboard_devices([device])
+        device.is_paired_async(paired)
+
+    def _device_paired_changed(self, device_id: str, paired: bool):
+        if paired:
+            device = self._unpaired.pop(device_id, None)
+            if device is not None:
+                logging.info(f"Device {device_id} was paired")
+                self._onboard_devices([device])
+            return
+        if device_id in self._mqtt_devices or device_id in self._onboarding:
+            logging.info(f"Device {device_id} was unpaired")
+            self._remove_device(device_id)
+            # it can be paired again as long as the daemon knows it, the handlers of 
+            # the removed entities must not stay connected to it
+            self._unpaired[device_id] = self._watch_device(device_id)
+
+    def _remove_device(self, device_id: str):
+        unpaired = self._unpaired.pop(device_id, None)
+        if unpaired is not None:
+            unpaired.close()
+        # a device that is still loading is dropped once it's loaded
+        self._onboarding.pop(device_id, None)
+        mqtt_device = self._mqtt_devices.pop(device_id, None)
+        if mqtt_device is not None:
+            logging.info(f"Removing device {device_id}")
+            mqtt_device.remove()
+
+    def _onboard_devices(self, devices: list[KDEConnectDevice]):
+        if not devices:
+            return
+        # all devices are loaded concurrently, the time until the last one published its entities is logged
+        batch = {"started": time.monotonic(), "remaining": len(devices)}
+        for device in devices:
+            self._onboarding[device.device_id] = device
+            device.load_async(lambda device: self._device_loaded(device, batch))
+
+    def _device_loaded(self, device: KDEConnectDevice, batch: dict):
+        batch["remaining"] -= 1
+        if self._onboarding.get(device.device_id) is not device:
+            logging.debug(f"Device {device.device_id} was removed while loading")
+            device.close()
+            return
+        del self._onboarding[device.device_id]
+        logging.debug(f"Device: {device.name} ({device.device_id})")
+        mqtt_device = MqttDevice(self._mqtt_session, self._host_device_name, device)
+        self._mqtt_devices[device.device_id] = mqtt_device
+        # entities of earlier runs that the device doesn't have anymore
+        self._mqtt_session.prune_discovery(device_identifier(self._host_device_id, device.device_id))
+
+        if batch["remaining"] == 0:
+            duration = (time.monotonic() - batch["started"]) * 1000
+            logging.info(f"Published entities of {len(self._mqtt_devices)} devices, onboarding took {duration:.1f} ms")
+
+    def _remove_unknown_devices(self, device_ids: list[str]):
+        """Delete the discovery configs of devices from earlier runs that are not paired anymore.
+        """
+        known = {device_identifier(self._host_device_id, device_id) for device_id in device_ids}
+        for device_key in self._mqtt_session.known_devices():
+            if device_key not in known and device_key.startswith(device_identifier(self._host_device_id, "")):
+                logging.info(f"Deleting entities of unpaired device {device_key}")
+                self._mqtt_session.prune_discovery(device_key, remove_device=True)
+
+class MqttBridgeDiagnostics():
+    """Metrics of the bridge as diagnostic sensors of a device of its own. 
+    """
+    # entity id, name, unit, metric, histogram (mean of the interval in ms) or counter (total)
+    SENSORS = [
+        ("snsr-dbus-calls", "D-Bus Calls", None, "kdeconnect_dbus_calls_total"),
+        ("snsr-dbus-errors", "D-Bus Call Errors", None, "kdeconnect_dbus_call_errors_total"),
+        ("snsr-dbus-latency", "D-Bus Call Latency", "ms", "kdeconnect_dbus_call_seconds"),
+        ("snsr-signals", "Signals Dispatched", None, "kdeconnect_signal_dispatches_total"),
+        ("snsr-signal-time", "Signal Handling Time", "ms", "kdeconnect_signal_dispatch_seconds"),
+        ("snsr-mqtt-publishes", "MQTT Publishes", None, "kdeconnect_mqtt_publishes_total"),
+        ("snsr-mqtt-bytes", "MQTT Bytes Published", "B", "kdeconnect_mqtt_publish_bytes_total"),
+        ("snsr-mqtt-skipped", "MQTT Publishes Skipped", None, "kdeconnect_mqtt_publishes_skipped_total"),
+    ]
+
+    def __init__(self, mqtt_session: MqttSession, host_device_id: str, host_device_name: str, interval: float) -> None:
+        self._mqtt_session = mqtt_session
+        self._host_device_id = host_device_id
+        # not prefixed like the devices of the host, so it's never taken for an unpaired device
+        device_key = f"kdeconnect_bridge_{host_device_id}"
+        self._device_info = DeviceInfo(name=f"KDE Connect Bridge {host_device_name}", identifiers=device_key, manufacturer="maker_pt", model="KDE Connect Bridge")
+        # histogram -> (count, sum) at the last update
+        self._last_totals = {}
+        self._sensors = {}
+        self._create_entities()
+        self._mqtt_session.prune_discovery(device_key)
+        self._interval = interval
+        engine.call_later(interval, self._update_periodically)
+
+    def _create_entities(self):
+        for entity_id, name, unit, metric in self.SENSORS:
+            state_class = "measurement" if unit == "ms" else "total_increasing"
+            sensor_info = SensorInfo(name=name, device=self._device_info, unique_id=f"kdeconnect_bridge_{self._host_device_id}_{entity_id}", 
+                                     entity_category="diagnostic", unit_of_measurement=unit, state_class=state_class)
+            sensor = self._mqtt_session.create(Sensor, sensor_info)
+            sensor.write_config()
+            self._sensors[metric] = sensor
+        self._update()
+
+    def _update_periodically(self):
+        self._update()
+        engine.call_later(self._interval, self._update_periodically)
+
+    def _update(self):
+        for _, _, unit, metric in self.SENSORS:
+            if unit == "ms":
+                count, total = registry.histogram_total(metric)
+                last_count, last_total = self._last_totals.get(metric, (0, 0.0))
+                self._last_totals[metric] = (count, total)
+                if count == last_count:
+                    continue
+                value = round((total - last_total) / (count - last_count) * 1000, 2)
+            else:
+                value = int(registry.total(metric))
+            self._sensors[metric].set_state(value)
+
+class MqttBridgeDebug():
+    """Command topics to look into a running bridge. 
+
+    * `<state prefix>/kdeconnect_bridge_<host id>/profile`: profile the event loop for the number of 
+      seconds in the payload (default 10), the summary is published to `.../profile/result`
+    * `<state prefix>/kdeconnect_bridge_<host id>/traces`: publish the latest signal traces as json 
+      to `.../traces/result`, if tracing is enabled (see signaltrace.py)
+
+    Retained commands are ignored, they would run again on every start. 
+    """
+    DEFAULT_PROFILE_SECONDS = 10.0
+
+    def __init__(self, mqtt_session: MqttSession, host_device_id: str, profile_path: Optional[str] = None) -> None:
+        self._mqtt_session = mqtt_session
+        device_key = f"kdeconnect_bridge_{host_device_id}"
+        self._profile_topic = mqtt_session.device_topic(device_key, "profile")
+        self._traces_topic = mqtt_session.device_topic(device_key, "traces")
+        self._profiler = Profiler(profile_path)
+        mqtt_session.subscribe(self._profile_topic, self._profile_requested)
+        mqtt_session.subscribe(self._traces_topic, self._traces_requested)
+
+    def _profile_requested(self, client: Client, user_data, message: MQTTMessage):
+        # runs in the network thread, the profile must be taken on the event loop
+        if message.retain:
+            return
+        try:
+            seconds = float(message.payload.decode() or self.DEFAULT_PROFILE_SECONDS)
+            if not math.isfinite(seconds):
+                raise ValueError(seconds)
+        except ValueError:
+            logging.warning(f"Invalid profile length {message.payload!r}, profiling for {self.DEFAULT_PROFILE_SECONDS} s")
+            seconds = self.DEFAULT_PROFILE_SECONDS
+        engine.call_soon_threadsafe(lambda: self._start_profile(seconds))
+
+    def _start_profile(self, seconds: float):
+        if not self._profiler.start(seconds, self._profile_done):
+            logging.warning("Not profiling, a profile is being taken already")
+
+    def _profile_done(self, summary: str):
+        self._mqtt_session.publish(f"{self._profile_topic}/result", summary)
+
+    def _traces_requested(self, client: Client, user_data, message: MQTTMessage):
+        if message.retain:
+            return
+        engine.call_soon_threadsafe(self._publish_traces)
+
+    def _publish_traces(self):
+        tracer = signaltrace.tracer
+        if tracer is None:
+            logging.warning("Signal tracing is not enabled, no traces to publish")
+            return
+        payload = {"time": round(time.time(), 3), "samples": tracer.samples()}
+        self._mqtt_session.publish(f"{self._traces_topic}/result", json.dumps(payload))
 
 class AbstractMqttPlugin():
-    def __init__(self, mqtt_settings: Settings.MQTT, device_info: DeviceInfo, konnect_device: KDEConnectDevice) -> None:
-        self._mqtt_settings = mqtt_settings
+    __slots__ = ("_mqtt_session", "_device_info", "_konnect_device", "_entities", "_plugin", "_coalesced_keys")
+
+    def __init__(self, mqtt_session: MqttSession, device_info: DeviceInfo, konnect_device: KDEConnectDevice) -> None:
+        self._mqtt_session = mqtt_session
         self._device_info = device_info
         self._konnect_device = konnect_device
+        self._entities = []
+        # keys of the rate limited handlers, their pending updates are dropped on close
+        self._coalesced_keys = ()
+
+    def _create(self, entity_cls, entity_info, command_callback: Optional[Callable[[MQTTMessage, Callable[[], None]], None]] = None,
+                snapshot: bool = False):
+        """Create an entity of the plugin through the session, see `MqttSession.create`. 
+
+        Commands of the entity are passed through the command queue of the session, the callback 
+        runs on the event loop with the message and a function to call once it's done. 
+        """
+        if command_callback is not None:
+            command_callback = self._queued(entity_info.unique_id, command_callback)
+        entity = self._mqtt_session.create(entity_cls, entity_info, command_callback, snapshot)
+        self._entities.append(entity)
+        return entity
+
+    def _create_entity(self, entity_id: str, command_callback: Optional[Callable[[MQTTMessage, Callable[[], None]], None]] = None, **fields):
+        """Create an entity of the plugin from its definition in `ENTITIES`, `fields` are added to the 
+        fields of the definition. 
+        """
+        entity_cls, info_cls, name, definition_fields = ENTITIES[entity_id]
+        entity_info = info_cls(name=name, device=self._device_info, unique_id=self._generate_unique_id(entity_id), **(definition_fields | fields))
+        return self._create(entity_cls, entity_info, command_callback, entity_id in SNAPSHOT_ENTITIES)
+
+    def _queued(self, key: str, command_callback: Callable[[MQTTMessage, Callable[[], None]], None]) -> Callable[[Client, object, MQTTMessage], None]:
+        def submit(client: Client, user_data, message: MQTTMessage):
+            self._mqtt_session.commands.submit(key, lambda done: command_callback(message, done))
+        return submit
+
+    def close(self) -> None:
+        """Stop publishing: the handlers are disconnected from the KDE Connect plugin and pending 
+        rate limited updates are dropped. The entities are kept. 
+        """
+        if self._plugin is not None:
+            self._plugin.close()
+        for key in self._coalesced_keys:
+            self._mqtt_session.coalescer.cancel(key)
+
+    def remove(self) -> None:
+        """Stop publishing and delete the entities of the plugin from HA. 
+        """
+        self.close()
+        self._mqtt_session.remove_entities(self._entities)
+        self._entities = []
 
     def _generate_unique_id(self, entity_id: str) -> str:
         return f"kdeconnect_{self._konnect_device.host_device_id}_{self._konnect_device.device_id}_{entity_id}"
 
+    def _coalesced(self, entity_id: str, handler: Callable) -> Callable:
+        """Rate limit a handler that publishes values of an entity according to the publish interval of the entity id. 
+        """
+        key = self._generate_unique_id(entity_id)
+        self._coalesced_keys += (key,)
+        return self._mqtt_session.coalescer.wrap(key, handler, entity_id)
+
 class MqttPluginFindDevice(AbstractMqttPlugin):
+    __slots__ = ()
 
-    def __init__(self, mqtt_settings: Settings.MQTT, device_info: DeviceInfo, konnect_device: KDEConnectDevice) -> None:
-        super().__init__(mqtt_settings, device_info, konnect_device)
+    def __init__(self, mqtt_session: MqttSession, device_info: DeviceInfo, konnect_device: KDEConnectDevice) -> None:
+        super().__init__(mqtt_session, device_info, konnect_device)
         self._plugin = self._konnect_device.get_plugin_find_my_phone()
         self._create_entities()
 
     def _create_entities(self):
-        find_button_info = ButtonInfo(name="Find Device", device=self._device_info, unique_id=self._generate_unique_id("btn-finddevice"))
-        find_button_settings = Settings(mqtt=self._mqtt_settings, entity=find_button_info)
-        find_button = Button(find_button_settings, self._ring_button_callback)
+        find_button = self._create_entity("btn-finddevice", self._ring_button_callback)
         find_button.write_config()
     
-    def _ring_button_callback(self, client: Client, user_data, message: MQTTMessage):
-        self._plugin.ring()
+    def _ring_button_callback(self, message: MQTTMessage, done: Callable[[], None]):
+        self._plugin.ring(callback=lambda result: done())
 
 class MqttPluginLockDevice(AbstractMqttPlugin):
+    __slots__ = ("_lock_switch",)
 
-    def __init__(self, mqtt_settings: Settings.MQTT, device_info: DeviceInfo, konnect_device: KDEConnectDevice) -> None:
-        super().__init__(mqtt_settings, device_info, konnect_device)
+    def __init__(self, mqtt_session: MqttSession, device_info: DeviceInfo, konnect_device: KDEConnectDevice) -> None:
+        super().__init__(mqtt_session, device_info, konnect_device)
         self._plugin = self._konnect_device.get_plugin_lock_device()
         self._create_entities()
         self._plugin.notify_locked_changed(self._update_lock)
 
     def _create_entities(self):
-        lock_switch_info = SwitchInfo(name="Lock Device", device=self._device_info, unique_id=self._generate_unique_id("swt-lockdevice"))
-
-        lock_switch_settings = Settings(mqtt=self._mqtt_settings, entity=lock_switch_info)
         # Instantiate the button
-        self._lock_switch = Switch(lock_switch_settings, self._lock_switch_callback)
+        self._lock_switch = self._create_entity("swt-lockdevice", self._lock_switch_callback)
 
         # Publish the button's discoverability message to let HA automatically notice it
         self._lock_switch.write_config()
@@ -72,24 +472,27 @@ class MqttPluginLockDevice(AbstractMqttPlugin):
         else:
             self._lock_switch.off()
 
-    def _lock_switch_callback(self, client: Client, user_data, message: MQTTMessage):
+    def _lock_switch_callback(self, message: MQTTMessage, done: Callable[[], None]):
         payload = message.payload.decode()
         if payload == "ON":
-            self._plugin.set_locked(True)
+            self._plugin.set_locked(True, callback=lambda result: done())
             # Let HA know that the switch was successfully activated
             self._update_lock(True)
         elif payload == "OFF":
-            self._plugin.set_locked(False)
+            self._plugin.set_locked(False, callback=lambda result: done())
             # Let HA know that the switch was successfully deactivated
             self._update_lock(False)
+        else:
+            done()
 
 
 class MqttPluginBattery(AbstractMqttPlugin):
     """Plugin that shows Battery State and Charging State
     """
+    __slots__ = ("_charging_sensor", "_battery_sensor")
 
-    def __init__(self, mqtt_settings: Settings.MQTT, device_info: DeviceInfo, konnect_device: KDEConnectDevice) -> None:
-        super().__init__(mqtt_settings, device_info, konnect_device)
+    def __init__(self, mqtt_session: MqttSession, device_info: DeviceInfo, konnect_device: KDEConnectDevice) -> None:
+        super().__init__(mqtt_session, device_info, konnect_device)
         self._plugin = self._konnect_device.get_plugin_battery()
         
         # we don't add the entities if we don't have a battery (soc = -1)
@@ -98,14 +501,10 @@ class MqttPluginBattery(AbstractMqttPlugin):
             self._plugin.notify_refreshed(self._update_battery)
 
     def _create_entities(self):
-        charging_sensor_info = BinarySensorInfo(name="Charging", device=self._device_info, unique_id=self._generate_unique_id("snsr-charging"), device_class="battery_charging")
-        charging_sensor_settings = Settings(mqtt=self._mqtt_settings, entity=charging_sensor_info)
-        self._charging_sensor = BinarySensor(charging_sensor_settings)
+        self._charging_sensor = self._create_entity("snsr-charging")
         self._charging_sensor.write_config()
 
-        battery_sensor_info = SensorInfo(name="Battery", device=self._device_info, unique_id=self._generate_unique_id("snsr-battery"), device_class="battery", unit_of_measurement="%")
-        battery_sensor_settings = Settings(mqtt=self._mqtt_settings, entity=battery_sensor_info)
-        self._battery_sensor = Sensor(battery_sensor_settings)
+        self._battery_sensor = self._create_entity("snsr-battery")
         self._battery_sensor.write_config()
 
         # write initial state
@@ -120,96 +519,154 @@ class MqttPluginBattery(AbstractMqttPlugin):
 
 class MqttPluginMprisRemote(AbstractMqttPlugin):
     """Plugin that shows Mpris Remote
+
+    If the session has an album art cache, the art of the playing track is published as image. 
+    It's published only when its hash changed, the next track of the same album costs nothing. 
+    The art is loaded in the worker thread, art of a track that is not playing anymore once it 
+    was loaded is dropped. 
     """
+    __slots__ = ("_snapshot", "_is_playing_sensor", "_player_sensor", "_artist_sensor", "_album_sensor", "_album_art_image", "_album_art_topic",
+                 "_album_art_content_type", "_album_art_url", "_album_art_key")
 
-    def __init__(self, mqtt_settings: Settings.MQTT, device_info: DeviceInfo, konnect_device: KDEConnectDevice) -> None:
-        super().__init__(mqtt_settings, device_info, konnect_device)
+    def __init__(self, mqtt_session: MqttSession, device_info: DeviceInfo, konnect_device: KDEConnectDevice) -> None:
+        super().__init__(mqtt_session, device_info, konnect_device)
         self._plugin = self._konnect_device.get_plugin_mpris_remote()
         
-        # we don't add the entities if we don't have a battery (soc = -1)
-        
-        self._is_playing = None
-        self._player = None
-        self._album = None
-        self._artist = None
+        # last published state
+        self._snapshot = None
+        self._album_art_image = None
+        self._album_art_topic = None
+        self._album_art_content_type = AlbumArtCache.CONTENT_TYPE
+        # url of the art that is loaded or was published last
+        self._album_art_url = None
+        # key of the last published album art
+        self._album_art_key = None
         
         self._create_entities()
-        self._plugin.notify_properties_changed(self._properties_changed)
+        self._plugin.notify_properties_changed(self._coalesced("snsr-mprisremote", self._properties_changed))
 
     def _create_entities(self):
-        is_playing_sensor_info = BinarySensorInfo(name="Playing", device=self._device_info, unique_id=self._generate_unique_id("snsr-playing"))#, device_class="battery_charging")
-        is_playing_sensor_settings = Settings(mqtt=self._mqtt_settings, entity=is_playing_sensor_info)
-        self._is_playing_sensor = BinarySensor(is_playing_sensor_settings)
+        self._is_playing_sensor = self._create_entity("snsr-playing")
         self._is_playing_sensor.write_config()
         
-        player_sensor_info = TextInfo(name="Player", device=self._device_info, unique_id=self._generate_unique_id("snsr-player"))
-        player_sensor_settings = Settings(mqtt=self._mqtt_settings, entity=player_sensor_info)
-        self._player_sensor = Text(player_sensor_settings, self._player_text_callback)
+        self._player_sensor = self._create_entity("snsr-player", self._player_text_callback)
         self._player_sensor.write_config()
         
-        artist_sensor_info = TextInfo(name="Player Artist", device=self._device_info, unique_id=self._generate_unique_id("snsr-player-artist"))#, device_class="album")
-        artist_sensor_settings = Settings(mqtt=self._mqtt_settings, entity=artist_sensor_info)
-        self._artist_sensor = Text(artist_sensor_settings, self._artist_text_callback)
+        self._artist_sensor = self._create_entity("snsr-player-artist", self._artist_text_callback)
         
-        album_sensor_info = TextInfo(name="Player Album", device=self._device_info, unique_id=self._generate_unique_id("snsr-player-album"))#, device_class="album")
-        album_sensor_settings = Settings(mqtt=self._mqtt_settings, entity=album_sensor_info)
-        self._album_sensor = Text(album_sensor_settings, self._album_text_callback)
+        self._album_sensor = self._create_entity("snsr-player-album", self._album_text_callback)
+
+        if self._mqtt_session.album_art_cache is not None:
+            device_key = device_identifier(self._konnect_device.host_device_id, self._konnect_device.device_id)
+            self._album_art_topic = self._mqtt_session.device_topic(device_key, "album_art")
+            self._create_album_art_image()
 
         # write initial state
-        self._properties_changed()
+        self._properties_changed(self._plugin.snapshot())
     
-    def _player_text_callback(self, client: Client, user_data, message: MQTTMessage):
+    def _player_text_callback(self, message: MQTTMessage, done: Callable[[], None]):
         # TODO: do we need to do sth? 
-        pass
+        done()
     
-    def _album_text_callback(self, client: Client, user_data, message: MQTTMessage):
+    def _album_text_callback(self, message: MQTTMessage, done: Callable[[], None]):
         # TODO: do we need to do sth? 
-        pass
+        done()
     
-    def _artist_text_callback(self, client: Client, user_data, message: MQTTMessage):
+    def _artist_text_callback(self, message: MQTTMessage, done: Callable[[], None]):
         # TODO: do we need to do sth? 
-        pass
+        done()
 
-    def _properties_changed(self):
-        #player_list = self._plugin.request_player_list()
-        #logging.debug(f"Player list: {player_list}")
-        if self._is_playing != self._plugin.is_playing:
-            if self._plugin.is_playing:
+    def _properties_changed(self, snapshot: MprisSnapshot):
+        last = self._snapshot
+        if last is None or last.is_playing != snapshot.is_playing:
+            if snapshot.is_playing:
                 self._is_playing_sensor.on()
             else:
                 self._is_playing_sensor.off()
-            self._is_playing = self._plugin.is_playing
-        if self._player != self._plugin.player:
-            self._player_sensor.set_text(self._plugin.player)
-            self._player = self._plugin.player
+        if last is None or last.player != snapshot.player:
+            self._player_sensor.set_text(snapshot.player)
         
-        if self._album != self._plugin.album:
-            self._album_sensor.set_text(self._plugin.album)
-            self._album = self._plugin.album
+        if last is None or last.album != snapshot.album:
+            self._album_sensor.set_text(snapshot.album)
         
-        if self._artist != self._plugin.artist:
-            self._artist_sensor.set_text(self._plugin.artist)
-            self._artist = self._plugin.artist
+        if last is None or last.artist != snapshot.artist:
+            self._artist_sensor.set_text(snapshot.artist)
+
+        if self._album_art_image is not None and (last is None or last.album_art_url != snapshot.album_art_url):
+            self._update_album_art(snapshot.album_art_url)
+        self._snapshot = snapshot
+
+    def _create_album_art_image(self):
+        if self._album_art_image is not None:
+            # replaced by the entity with the new content type, they share the unique id and the config topic
+            self._entities.remove(self._album_art_image)
+            self._mqtt_session.remove_entities([self._album_art_image])
+        self._album_art_image = self._create_entity("img-albumart", image_topic=self._album_art_topic, content_type=self._album_art_content_type)
+        self._album_art_image.write_config()
+
+    def close(self) -> None:
+        super().close()
+        # art that is still loaded is dropped
+        self._album_art_url = None
+
+    def _update_album_art(self, url: str):
+        if not url:
+            # the last art stays until a track with art plays
+            return
+        self._album_art_url = url
+        album_art_cache = self._mqtt_session.album_art_cache
+        published_key = self._album_art_key
+
+        def load():
+            art = album_art_cache.load(url)
+            if art is None:
+                return None
+            key, path = art
+            if key == published_key:
+                return key, None, None
+            try:
+                with open(path, "rb") as art_file:
+                    return key, art_file.read(), album_art_cache.content_type(path)
+            except OSError as e:
+                logging.warning(f"Failed to read cached album art {path}: {e}")
+                return None
+        engine.run_in_worker(load, lambda art: self._album_art_loaded(url, art))
+
+    def _album_art_loaded(self, url: str, art: Optional[tuple[str, Optional[bytes], Optional[str]]]):
+        if url != self._album_art_url or art is None:
+            # another track plays already or the art could not be read
+            return
+        key, payload, content_type = art
+        if key == self._album_art_key:
+            registry.inc("kdeconnect_album_art_unchanged_total")
+            return
+        if payload is None:
+            # unchanged when it was loaded, but art of another url was published in between
+            self._update_album_art(url)
+            return
+        if content_type != self._album_art_content_type:
+            self._album_art_content_type = content_type
+            self._create_album_art_image()
+        self._album_art_key = key
+        # published through the session instead of set_payload, which formats the payload into its log message
+        self._mqtt_session.publish(self._album_art_topic, payload, retain=True)
 
 class MqttPluginConnectivity(AbstractMqttPlugin):
     """Plugin that shows Connectivity of the cellular network
     """
+    __slots__ = ("_network_type_sensor", "_network_strength_sensor")
 
-    def __init__(self, mqtt_settings: Settings.MQTT, device_info: DeviceInfo, konnect_device: KDEConnectDevice) -> None:
-        super().__init__(mqtt_settings, device_info, konnect_device)
+    def __init__(self, mqtt_session: MqttSession, device_info: DeviceInfo, konnect_device: KDEConnectDevice) -> None:
+        super().__init__(mqtt_session, device_info, konnect_device)
         self._plugin = self._konnect_device.get_plugin_connectivity_report()
         self._create_entities()
-        self._plugin.notify_refreshed(self._update_connectivity)
+        self._plugin.notify_refreshed(self._coalesced("snsr-connectivity", self._update_connectivity))
 
     def _create_entities(self):
-        network_type_sensor_info = SensorInfo(name="Network Type", device=self._device_info, unique_id=self._generate_unique_id("snsr-networktype"), device_class="enum")
-        network_type_sensor_settings = Settings(mqtt=self._mqtt_settings, entity=network_type_sensor_info)
-        self._network_type_sensor = Sensor(network_type_sensor_settings)
+        self._network_type_sensor = self._create_entity("snsr-networktype")
         self._network_type_sensor.write_config()
 
-        network_strength_sensor_info = SensorInfo(name="Network Signal Strength", device=self._device_info, unique_id=self._generate_unique_id("snsr-networkstrength"), device_class="signal_strength")
-        network_strength_sensor_settings = Settings(mqtt=self._mqtt_settings, entity=network_strength_sensor_info)
-        self._network_strength_sensor = Sensor(network_strength_sensor_settings)
+        self._network_strength_sensor = self._create_entity("snsr-networkstrength")
         self._network_strength_sensor.write_config()
 
         # write initial state
@@ -224,35 +681,27 @@ class MqttPluginRemoteSystemVolume(AbstractMqttPlugin):
     """
     MAX_UINT16 = 0xFFFF
 
-    def __init__(self, mqtt_settings: Settings.MQTT, device_info: DeviceInfo, konnect_device: KDEConnectDevice) -> None:
-        super().__init__(mqtt_settings, device_info, konnect_device)
+    __slots__ = ("_active_sink", "_mute_switch", "_volume", "_publish_volume")
+
+    def __init__(self, mqtt_session: MqttSession, device_info: DeviceInfo, konnect_device: KDEConnectDevice) -> None:
+        super().__init__(mqtt_session, device_info, konnect_device)
         self._active_sink = ""
         self._plugin = self._konnect_device.get_plugin_remote_system_volume()
         self._create_entities()
         self._plugin.notify_muted_changed(self._update_muted)
-        self._plugin.notify_volume_changed(self._update_volume)
+        self._publish_volume = self._coalesced("num-volume", self._update_volume)
+        self._plugin.notify_volume_changed(self._volume_changed)
         self._plugin.notify_sinks_changed(self._update_sinks)
 
     def _create_entities(self):
-        mute_switch_info = SwitchInfo(name="Mute Device", device=self._device_info, unique_id=self._generate_unique_id("swt-mutedevice"))
-        mute_switch_settings = Settings(mqtt=self._mqtt_settings, entity=mute_switch_info)
-        self._mute_switch = Switch(mute_switch_settings, self._mute_switch_callback)
+        self._mute_switch = self._create_entity("swt-mutedevice", self._mute_switch_callback)
         self._mute_switch.write_config()
 
-        volume_info = NumberInfo(name="Volume", device=self._device_info, unique_id=self._generate_unique_id("num-volume"), min=0, max=100, unit_of_measurement="%")
-        volume_settings = Settings(mqtt=self._mqtt_settings, entity=volume_info)
-        self._volume = Number(volume_settings, self._volume_callback)
+        self._volume = self._create_entity("num-volume", self._volume_callback)
         self._volume.write_config()
 
         self._update_active_sink()
     
-    def _get_active_sink(self):
-        for sink in self._plugin.sinks:
-            sink_enabled = sink.get("enabled")
-            if sink_enabled:
-                return sink
-        return None
-
     def _update_muted(self, sink: str, muted: bool):
         logging.debug(f"Active Sink: {self._active_sink}")
         logging.debug(f"Sink: {sink}, muted: {muted}")
@@ -264,6 +713,13 @@ class MqttPluginRemoteSystemVolume(AbstractMqttPlugin):
         else:
             self._mute_switch.off()
     
+    def _volume_changed(self, sink: str, volume: int):
+        # only updates of the active sink are rate limited, so they can't be replaced by other sinks
+        if sink != self._active_sink:
+            logging.debug(f"Received volume update for {sink}, but not active device")
+            return
+        self._publish_volume(sink, volume)
+
     def _update_volume(self, sink: str, volume: int):
         logging.debug(f"Active Sink: {self._active_sink}")
         logging.debug(f"Sink: {sink}, volume: {volume}")
@@ -278,7 +734,7 @@ class MqttPluginRemoteSystemVolume(AbstractMqttPlugin):
         self._update_active_sink()
 
     def _update_active_sink(self):
-        sink = self._get_active_sink()
+        sink = self._plugin.active_sink
         if sink is None:
             logging.error("Could not find active sink")
             return
@@ -292,66 +748,247 @@ class MqttPluginRemoteSystemVolume(AbstractMqttPlugin):
         
 
 
-    def _mute_switch_callback(self, client: Client, user_data, message: MQTTMessage):
+    def _mute_switch_callback(self, message: MQTTMessage, done: Callable[[], None]):
         payload = message.payload.decode()        
         if payload == "ON":
-            self._plugin.send_muted(self._active_sink, True)
+            self._plugin.send_muted(self._active_sink, True, callback=lambda result: done())
             self._update_muted(self._active_sink, True)
         elif payload == "OFF":
-            self._plugin.send_muted(self._active_sink, False)
+            self._plugin.send_muted(self._active_sink, False, callback=lambda result: done())
             self._update_muted(self._active_sink, False)
+        else:
+            done()
     
-    def _volume_callback(self, client: Client, user_data, message: MQTTMessage):
+    def _volume_callback(self, message: MQTTMessage, done: Callable[[], None]):
+        # the command queue only keeps the latest value while a sendVolume is in flight
         volume_percent = int(message.payload.decode())
         volume = int(volume_percent/100.*self.MAX_UINT16)
-        self._plugin.send_volume(self._active_sink, volume)
+        self._plugin.send_volume(self._active_sink, volume, callback=lambda result: done())
         self._update_volume(self._active_sink, volume)
 
 
+class MqttPluginNotifications(AbstractMqttPlugin):
+    """Plugin that shows the number of active notifications, with the latest ones as attributes, 
+    and dismisses them. Changes arrive in batches, each batch is published once. 
+    """
+    # notifications listed in the attributes, the latest ones
+    MAX_LISTED = 10
+
+    __slots__ = ("_count_sensor", "_dismiss_button")
+
+    def __init__(self, mqtt_session: MqttSession, device_info: DeviceInfo, konnect_device: KDEConnectDevice) -> None:
+        super().__init__(mqtt_session, device_info, konnect_device)
+        self._plugin = self._konnect_device.get_plugin_notifications()
+        self._plugin.set_batch_interval(self._mqtt_session.coalescer.interval("snsr-notifications"))
+        self._create_entities()
+        self._plugin.notify_notifications_changed(self._notifications_changed)
+
+    def _create_entities(self):
+        self._count_sensor = self._create_entity("snsr-notifications")
+        self._count_sensor.write_config()
+
+        self._dismiss_button = self._create_entity("btn-dismissnotifications", self._dismiss_button_callback)
+        self._dismiss_button.write_config()
+
+        # write initial state
+        self._update_notifications()
+
+    def _notifications_changed(self, posted: list[Notification], removed: list[str]):
+        self._update_notifications()
+
+    def _update_notifications(self):
+        notifications = self._plugin.notifications
+        self._count_sensor.set_state(len(notifications))
+        listed = [{"id": notification.public_id, "app": notification.app_name, "title": notification.title, "text": notification.text}
+                  for notification in notifications[-self.MAX_LISTED:]]
+        self._count_sensor.set_attributes({"notifications": listed})
+
+    def _dismiss_button_callback(self, message: MQTTMessage, done: Callable[[], None]):
+        # dismisses all notifications that can be dismissed, the removals arrive as signals
+        dismissable = [notification.public_id for notification in self._plugin.notifications if notification.dismissable]
+        remaining = len(dismissable)
+        if not remaining:
+            done()
+            return
+
+        def dismissed(result):
+            nonlocal remaining
+            remaining -= 1
+            if remaining == 0:
+                done()
+        for public_id in dismissable:
+            self._plugin.dismiss(public_id, callback=dismissed)
+
+class MqttPluginShare(AbstractMqttPlugin):
+    """Plugin that sends links and files to the device. 
+
+    Links are set through the "Share URL" text. Files are published as raw payload to the topic 
+    `<state prefix>/<device key>/share/file`, if the session has a share spool. They are hashed 
+    and written to the spool in the worker thread as they arrive, neither the MQTT client nor the 
+    event loop waits for it, and only their path waits in the command queue. The same content sent 
+    again while it waits to be shared or within `DEDUPE_SECONDS` after it was shared is dropped. 
+
+    The file stays pinned in the spool while it waits and while it's sent. KDE Connect accepts the 
+    url at once and reads the file in the background, the end of the transfer can't be observed. 
+    The pin is held for `TRANSFER_HOLD_SECONDS` after the url was accepted plus the time the file 
+    takes at `TRANSFER_MIN_RATE`, e.g. 9 min for a file of 64 MB. A refused file is unpinned at once. 
+    """
+    DEDUPE_SECONDS = 60.0
+    # content hashes remembered for deduplication at most
+    MAX_RECENT = 32
+    # time a transfer is assumed to take at most, on top of the time for its size
+    TRANSFER_HOLD_SECONDS = 300.0
+    # slowest rate a transfer is assumed to make in bytes per second
+    TRANSFER_MIN_RATE = 256 * 1024
+    # longest text HA accepts for the "Share URL" text, longer urls are shared in full but shown shortened
+    URL_TEXT_MAX_LENGTH = 255
+
+    __slots__ = ("_url_text", "_device_key", "_file_topic", "_recent", "_sharing")
+
+    def __init__(self, mqtt_session: MqttSession, device_info: DeviceInfo, konnect_device: KDEConnectDevice) -> None:
+        super().__init__(mqtt_session, device_info, konnect_device)
+        self._plugin = self._konnect_device.get_plugin_share()
+        self._device_key = device_identifier(self._konnect_device.host_device_id, self._konnect_device.device_id)
+        self._file_topic = None
+        # content hash -> time it was last shared, oldest first
+        self._recent = OrderedDict()
+        # content hashes of the files that are queued or being shared
+        self._sharing = set()
+        self._create_entities()
+
+    def _create_entities(self):
+        self._url_text = self._create_entity("txt-shareurl", self._share_url_callback)
+        self._url_text.write_config()
+
+        if self._mqtt_session.share_spool is not None:
+            self._file_topic = self._mqtt_session.device_topic(self._device_key, "share/file")
+            self._mqtt_session.subscribe(self._file_topic, self._file_received, self._device_key)
+
+    def remove(self) -> None:
+        super().remove()
+        if self._file_topic is not None:
+            self._mqtt_session.unsubscribe(self._file_topic)
+            self._file_topic = None
+
+    def _share_url_callback(self, message: MQTTMessage, done: Callable[[], None]):
+        url = message.payload.decode()
+        self._plugin.share_url(url, callback=lambda result: done())
+        if len(url) > self.URL_TEXT_MAX_LENGTH:
+            url = url[:self.URL_TEXT_MAX_LENGTH - 1] + "…"
+        self._url_text.set_text(url)
+
+    def _file_received(self, client: Client, user_data, message: MQTTMessage):
+        if message.retain:
+            # would be shared again after every reconnect
+            logging.warning(f"Ignoring retained file on {message.topic}")
+            return
+        payload = message.payload
+        share_spool = self._mqtt_session.share_spool
+
+        def spool():
+            content_digest = ShareSpool.digest(payload)
+            return content_digest, share_spool.store(payload, content_digest), len(payload)
+        engine.run_in_worker(spool, self._file_spooled)
+
+    def _file_spooled(self, spooled: Optional[tuple[str, Optional[str], int]]):
+        if spooled is None or spooled[1] is None:
+            return
+        digest, path, size = spooled
+        labels = {"device": self._device_key}
+        now = time.monotonic()
+        shared = self._recent.get(digest)
+        if digest in self._sharing or (shared is not None and now - shared < self.DEDUPE_SECONDS):
+            self._mqtt_session.share_spool.release(digest)
+            if shared is None:
+                logging.info(f"Not sharing file {digest[:16]} again, it is being shared")
+            else:
+                logging.info(f"Not sharing file {digest[:16]} again, it was shared {now - shared:.0f} s ago")
+            registry.inc("kdeconnect_share_deduplicated_total", labels)
+            return
+        registry.inc("kdeconnect_share_files_total", labels)
+        self._sharing.add(digest)
+        url = pathlib.Path(path).as_uri()
+
+        def share(done: Callable[[], None]):
+            def result_received(success: bool):
+                self._share_finished(digest, success, size)
+                done()
+            self._plugin.share_url(url, callback=result_received)
+        # one key per content, files of a device don't replace each other in the queue
+        self._mqtt_session.commands.submit(f"{self._generate_unique_id('share')}_{digest[:16]}", share,
+                                           dropped=lambda: engine.call_soon_threadsafe(lambda: self._share_finished(digest, False, size)))
+
+    def _share_finished(self, digest: str, success: bool, size: int):
+        self._sharing.discard(digest)
+        share_spool = self._mqtt_session.share_spool
+        if not success:
+            share_spool.release(digest)
+            return
+        # KDE Connect still reads the file, it's kept for as long as the transfer may take
+        engine.call_later(self.TRANSFER_HOLD_SECONDS + size / self.TRANSFER_MIN_RATE, lambda: share_spool.release(digest))
+        self._recent[digest] = time.monotonic()
+        self._recent.move_to_end(digest)
+        while len(self._recent) > self.MAX_RECENT:
+            self._recent.popitem(last=False)
+
 class MqttDevice:
-    def __init__(self, mqtt_settings: Settings.MQTT, host_device_name: str, konnect_device: KDEConnectDevice) -> None:
-        self._mqtt_settings = mqtt_settings
+    # KDE Connect plugin -> MQTT plugin that exposes it
+    PLUGIN_MAP = {
+        "kdeconnect_findmyphone": MqttPluginFindDevice,
+        "kdeconnect_battery": MqttPluginBattery,
+        "kdeconnect_lockdevice": MqttPluginLockDevice,
+        "kdeconnect_connectivity_report": MqttPluginConnectivity,
+        "kdeconnect_remotesystemvolume": MqttPluginRemoteSystemVolume,
+        "kdeconnect_mprisremote": MqttPluginMprisRemote,
+        "kdeconnect_notifications": MqttPluginNotifications,
+        "kdeconnect_share": MqttPluginShare,
+    }
+
+    __slots__ = ("_mqtt_session", "_konnect_device", "_device_key", "_device_info", "_plugins")
+
+    def __init__(self, mqtt_session: MqttSession, host_device_name: str, konnect_device: KDEConnectDevice) -> None:
+        self._mqtt_session = mqtt_session
         self._konnect_device = konnect_device
 
-        self._device_info = DeviceInfo(name=f"KDE Connect {self._konnect_device.name}", identifiers=f"kdeconnect_{self._konnect_device.host_device_id}_{self._konnect_device.device_id}", manufacturer="maker_pt", model=f"KDE Connect {host_device_name}")
+        self._device_key = device_identifier(self._konnect_device.host_device_id, self._konnect_device.device_id)
+        self._device_info = DeviceInfo(name=f"KDE Connect {self._konnect_device.name}", identifiers=self._device_key, manufacturer="maker_pt", model=f"KDE Connect {host_device_name}")
+        # all entities of the device go unavailable when it is out of reach or stops answering
+        self._mqtt_session.enable_availability(self._device_key)
         self._update_plugins()
-        
+        self._konnect_device.notify_plugins_changed(self._plugins_changed)
+        self._konnect_device.notify_available_changed(self.set_available)
+        self.set_available(self._konnect_device.is_available)
+
+    def set_available(self, available: bool) -> None:
+        self._mqtt_session.set_availability(self._device_key, available)
+
+    def remove(self) -> None:
+        """Stop handling the signals of the device and delete all its entities from HA. 
+        """
+        for plugin in self._plugins.values():
+            plugin.close()
+        self._konnect_device.close()
+        self._mqtt_session.remove_device(self._device_key)
+        self._plugins = {}
+
     def _update_plugins(self):
-        self._plugins = []
-        find_my_phone = self._konnect_device.get_plugin_find_my_phone()
-        if find_my_phone is not None:
-            print("adding findmyphone")
-            plugin = MqttPluginFindDevice(self._mqtt_settings, self._device_info, self._konnect_device)
-            self._plugins.append(plugin)
-
-        battery = self._konnect_device.get_plugin_battery()
-        if battery is not None:
-            print("adding battery")
-            plugin = MqttPluginBattery(self._mqtt_settings, self._device_info, self._konnect_device)
-            self._plugins.append(plugin)
-
-        lock_device = self._konnect_device.get_plugin_lock_device()
-        if lock_device is not None:
-            print("adding lock device")
-            plugin = MqttPluginLockDevice(self._mqtt_settings, self._device_info, self._konnect_device)
-            self._plugins.append(plugin)
-        
-        connectivity = self._konnect_device.get_plugin_connectivity_report()
-        if connectivity is not None:
-            print("adding lock device")
-            plugin = MqttPluginConnectivity(self._mqtt_settings, self._device_info, self._konnect_device)
-            self._plugins.append(plugin)
-        
-        systemvolume = self._konnect_device.get_plugin_remote_system_volume()
-        if systemvolume is not None:
-            print("adding system volume")
-            plugin = MqttPluginRemoteSystemVolume(self._mqtt_settings, self._device_info, self._konnect_device)
-            self._plugins.append(plugin)
-        
-        mpris_remote = self._konnect_device.get_plugin_mpris_remote()
-        if mpris_remote is not None:
-            print("adding mpris remote")
-            plugin = MqttPluginMprisRemote(self._mqtt_settings, self._device_info, self._konnect_device)
-            self._plugins.append(plugin)
-        
-        
\ No newline at end of file
+        self._plugins = {}
+        for plugin_name in self.PLUGIN_MAP:
+            self._add_plugin(plugin_name)
+
+    def _add_plugin(self, plugin_name: str):
+        plugin_cls = self.PLUGIN_MAP.get(plugin_name)
+        if plugin_cls is None or plugin_name in self._plugins or self._konnect_device.get_plugin(plugin_name) is None:
+            return
+        print(f"adding {plugin_name}")
+        self._plugins[plugin_name] = plugin_cls(self._mqtt_session, self._device_info, self._konnect_device)
+
+    def _plugins_changed(self, added: list[str], removed: list[str]):
+        for plugin_name in removed:
+            plugin = self._plugins.pop(plugin_name, None)
+            if plugin is not None:
+                logging.info(f"Removing entities of plugin {plugin_name} of {self._device_key}")
+                plugin.remove()
+        for plugin_name in added:
+            self._add_plugin(plugin_name)
+        self._mqtt_session.save_discovery()
@@ -0,0 +1,468 @@
+from ha_mqtt_discoverable import Settings, Discoverable
+from paho.mqtt.client import Client, MQTTMessage, MQTTMessageInfo, MQTT_ERR_NO_CONN, MQTT_ERR_SUCCESS
+from paho.mqtt.enums import CallbackAPIVersion
+from coalesce import Coalescer
+from commandqueue import CommandQueue
+from discoverycache import DiscoveryCache
+from metrics import registry
+from albumart import AlbumArtCache
+from sharespool import ShareSpool
+from statesnapshot import StateSnapshot
+from statestore import StateStore
+from typing import Callable, Optional
+import asyncio
+import engine
+import logging
+import signaltrace
+import ssl
+import threading
+
+class _SessionClient(Client):
+    """paho client that is handed to every entity. Publishes, subscriptions and command callbacks
+    of ha-mqtt-discoverable are routed through the owning session.
+    """
+
+    def __init__(self, session: "MqttSession", *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._session = session
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None) -> MQTTMessageInfo:
+        return self._session.publish(topic, payload, qos, retain)
+
+    def _publish(self, topic, payload=None, qos=0, retain=False) -> MQTTMessageInfo:
+        return super().publish(topic, payload, qos, retain)
+
+    def message_callback_add(self, sub: str, callback: Callable) -> None:
+        self._session.subscribe(sub, callback)
+
+    def message_callback_remove(self, sub: str) -> None:
+        self._session.unsubscribe(sub)
+
+    def subscribe(self, topic, qos=0, options=None, properties=None):
+        # topics of the table are subscribed by the session, also after reconnects
+        if isinstance(topic, str) and self._session.has_subscription(topic):
+            return MQTT_ERR_SUCCESS, None
+        return super().subscribe(topic, qos, options, properties)
+
+class _AsyncioLoopDriver():
+    """Runs the network loop of a paho client on an asyncio event loop instead of its own thread. 
+    """
+    # seconds between keep alive checks
+    MISC_INTERVAL = 1.0
+    # seconds between attempts to reconnect
+    RECONNECT_INTERVAL = 5.0
+
+    def __init__(self, client: Client, loop: asyncio.AbstractEventLoop) -> None:
+        self._client = client
+        self._loop = loop
+        self._last_reconnect = 0.0
+        client.on_socket_open = self._socket_open
+        client.on_socket_close = self._socket_close
+        client.on_socket_register_write = self._socket_register_write
+        client.on_socket_unregister_write = self._socket_unregister_write
+        loop.call_later(self.MISC_INTERVAL, self._loop_misc)
+
+    def _socket_open(self, client: Client, user_data, sock):
+        self._loop.add_reader(sock, client.loop_read)
+
+    def _socket_close(self, client: Client, user_data, sock):
+        self._loop.remove_reader(sock)
+
+    def _socket_register_write(self, client: Client, user_data, sock):
+        self._loop.add_writer(sock, client.loop_write)
+
+    def _socket_unregister_write(self, client: Client, user_data, sock):
+        self._loop.remove_writer(sock)
+
+    def _loop_misc(self):
+        if self._client.loop_misc() == MQTT_ERR_NO_CONN and self._loop.time() - self._last_reconnect >= self.RECONNECT_INTERVAL:
+            self._last_reconnect = self._loop.time()
+            try:
+                self._client.reconnect()
+            except OSError as e:
+                logging.warning(f"Reconnecting to MQTT broker failed: {e}")
+        self._loop.call_later(self.MISC_INTERVAL, self._loop_misc)
+
+class MqttSession():
+    """A single MQTT connection shared by the entities of all devices.
+
+    Entities are created through `create` which hands them the shared client. Command topics
+    are kept in one subscription table that is dispatched from `on_message` and re-subscribed
+    when the connection is re-established.
+
+    High frequency updates can be rate limited per entity with `coalescer` before they are published.
+    Commands should be passed to `commands`, which runs them on the event loop instead of the network thread.
+    Publishes that repeat the last payload of a topic are dropped by the state store, discovery
+    configs that are unchanged since the last run are dropped by the discovery cache.
+
+    The last states of the entities can be kept in a snapshot that is published on start, before
+    any device was loaded.
+
+    Files shared to devices over MQTT are spooled in `share_spool` and album art is cached in
+    `album_art_cache`, if they are set.
+
+    The network loop runs in a thread of paho, or on the event loop if the bridge runs on the
+    asyncio engine (see engine.py).
+
+    While the broker is not connected, publishes are buffered with the latest payload per topic and
+    sent at once when the connection is back. A retained marker topic tells after every connect if
+    the broker kept its retained messages, if not all retained messages are published again.
+    """
+    # seconds to wait for the retained marker after connecting
+    RETAINED_CHECK_TIMEOUT = 3.0
+
+    def __init__(self, mqtt_settings: Settings.MQTT, publish_intervals: Optional[dict[str, float]] = None, force_refresh_interval: Optional[float] = None,
+                 discovery_cache_path: Optional[str] = None, state_snapshot_path: Optional[str] = None,
+                 share_spool: Optional[ShareSpool] = None, album_art_cache: Optional[AlbumArtCache] = None) -> None:
+        """
+        Args:
+            mqtt_settings (Settings.MQTT): connection settings of the broker
+            publish_intervals (dict[str, float], optional): minimum seconds between two publishes per entity id
+            force_refresh_interval (float, optional): seconds after which an unchanged payload is published again,
+                None to never repeat unchanged payloads
+            discovery_cache_path (str, optional): file to persist digests of the published discovery configs in,
+                None publishes all configs on every start
+            state_snapshot_path (str, optional): file to persist the last states of the entities in, they are
+                published on the next start until live values replace them. None starts without states.
+            share_spool (ShareSpool, optional): spool for files sent to devices, None doesn't accept files
+            album_art_cache (AlbumArtCache, optional): cache for the album art of the MPRIS remotes, None 
+                doesn't publish album art
+        """
+        self._mqtt_settings = mqtt_settings
+        self.coalescer = Coalescer(publish_intervals)
+        self.commands = CommandQueue()
+        self.share_spool = share_spool
+        self.album_art_cache = album_art_cache
+        self._state_store = StateStore(force_refresh_interval)
+        self._discovery_cache = DiscoveryCache(discovery_cache_path)
+        self._state_snapshot = StateSnapshot(state_snapshot_path)
+        # topic -> unique id of the entity that publishes to it, the label of publish metrics
+        self._topic_entities = {}
+        # device key -> entities of the device
+        self._device_entities = {}
+        # device key -> availability topic shared by all entities of the device
+        self._availability_topics = {}
+        self._subscriptions = {}
+        # device key -> topics subscribed for the device that aren't command topics of entities
+        self._device_subscriptions = {}
+        self._subscriptions_lock = threading.Lock()
+        # topic -> (payload, qos, retain) of the latest publish while disconnected
+        self._offline_buffer = {}
+        self._connected = False
+        self._connection_lock = threading.Lock()
+        # retained by the broker as long as it keeps retained messages
+        self._retained_marker_topic = f"{mqtt_settings.state_prefix}/{mqtt_settings.client_name or 'kdeconnect'}/retained"
+        self._retained_marker_seen = False
+        self._subscriptions[self._retained_marker_topic] = self._retained_marker_received
+
+        self._client = _SessionClient(self, callback_api_version=CallbackAPIVersion.VERSION2, client_id=mqtt_settings.client_name)
+        self._setup_client()
+        # settings handed to the entities, they don't connect on their own if a client is set
+        self._entity_mqtt_settings = mqtt_settings.model_copy(update={"client": self._client})
+        self._connect()
+        self._restore_snapshot()
+
+    @property
+    def client(self) -> Client:
+        return self._client
+
+    def _setup_client(self):
+        mqtt_settings = self._mqtt_settings
+        if mqtt_settings.tls_key:
+            self._client.tls_set(ca_certs=mqtt_settings.tls_ca_cert, certfile=mqtt_settings.tls_certfile, keyfile=mqtt_settings.tls_key,
+                                 cert_reqs=ssl.CERT_REQUIRED, tls_version=ssl.PROTOCOL_TLS_CLIENT)
+        elif mqtt_settings.use_tls:
+            self._client.tls_set(ca_certs=mqtt_settings.tls_ca_cert, cert_reqs=ssl.CERT_REQUIRED, tls_version=ssl.PROTOCOL_TLS_CLIENT)
+        self._client.username_pw_set(mqtt_settings.username, password=mqtt_settings.password)
+        self._client.on_connect = self._on_connect
+        self._client.on_disconnect = self._on_disconnect
+        self._client.on_message = self._on_message
+
+    def _connect(self):
+        logging.info(f"Connecting to MQTT broker {self._mqtt_settings.host}:{self._mqtt_settings.port}")
+        loop = engine.asyncio_loop()
+        if loop is not None:
+            # the socket callbacks have to be set before the socket is opened
+            self._loop_driver = _AsyncioLoopDriver(self._client, loop)
+        result = self._client.connect(self._mqtt_settings.host, self._mqtt_settings.port)
+        if result != MQTT_ERR_SUCCESS:
+            raise RuntimeError("Error while connecting to MQTT broker")
+        if loop is None:
+            self._client.loop_start()
+
+    def _restore_snapshot(self):
+        states = self._state_snapshot.states()
+        if states:
+            logging.info(f"Publishing {len(states)} states of the last run")
+        for topic, payload, retain in states:
+            # goes through the state store, live values are only published if they differ
+            self.publish(topic, payload, retain=retain)
+
+    def create(self, entity_cls: type[Discoverable], entity_info, command_callback: Optional[Callable[[Client, object, MQTTMessage], None]] = None,
+               snapshot: bool = False) -> Discoverable:
+        """Create an entity that publishes through the shared connection.
+
+        Args:
+            entity_cls (type[Discoverable]): entity class, e.g. `Sensor` or `Switch`
+            entity_info: matching info model, e.g. `SensorInfo` or `SwitchInfo`
+            command_callback (Callable[[Client, object, MQTTMessage], None], optional): callback for
+                entities that receive commands.
+            snapshot (bool, optional): keep the last state of the entity in the state snapshot, its 
+                attributes are never kept
+
+        Returns:
+            Discoverable: the entity
+        """
+        settings = Settings(mqtt=self._entity_mqtt_settings, entity=entity_info)
+        if command_callback is None:
+            entity = entity_cls(settings)
+        else:
+            entity = entity_cls(settings, command_callback)
+        for topic in self._entity_topics(entity):
+            self._topic_entities[topic] = entity_info.unique_id or topic
+        if entity_info.device is not None:
+            device_key = self._device_key(entity_info.device)
+            availability_topic = self._availability_topics.get(device_key)
+            if availability_topic is not None:
+                # picked up by generate_config, one message sets the availability of all entities
+                entity.availability_topic = availability_topic
+            self._device_entities.setdefault(device_key, []).append(entity)
+            self._discovery_cache.register(entity.config_topic, device_key)
+            if snapshot:
+                self._state_snapshot.register(entity.state_topic, device_key)
+            else:
+                # states an older version recorded for the entity
+                self._state_snapshot.forget(device_key, [entity.state_topic, entity.attributes_topic])
+        return entity
+
+    def remove_entities(self, entities: list[Discoverable]) -> None:
+        """Delete entities from HA and drop their subscriptions and states, other entities 
+        of their device are not touched. 
+        """
+        for device_entities in self._device_entities.values():
+            device_entities[:] = [entity for entity in device_entities if entity not in entities]
+        self._remove_entities(entities)
+
+    def _remove_entities(self, entities: list[Discoverable]) -> None:
+        for entity in entities:
+            command_topic = getattr(entity, "_command_topic", None)
+            if command_topic is not None:
+                self.unsubscribe(command_topic)
+            # the empty config also drops the entity from the discovery cache
+            entity.delete()
+            for topic in self._entity_topics(entity):
+                self._state_store.forget(topic)
+                self._topic_entities.pop(topic, None)
+            if entity._entity.device is not None:
+                self._state_snapshot.forget(self._device_key(entity._entity.device), [entity.state_topic, entity.attributes_topic])
+
+    @staticmethod
+    def _entity_topics(entity: Discoverable) -> list[str]:
+        topics = [entity.config_topic, entity.state_topic, entity.attributes_topic]
+        # images are published to a topic of their own
+        image_topic = getattr(entity._entity, "image_topic", None)
+        if image_topic is not None:
+            topics.append(image_topic)
+        return topics
+
+    def save_discovery(self) -> None:
+        """Persist the discovery cache after entities were added or removed. 
+        """
+        self._discovery_cache.save()
+
+    def enable_availability(self, device_key: str) -> str:
+        """Let entities of a device that are created from now on share one availability topic. 
+
+        Args:
+            device_key (str): first identifier of the device info
+
+        Returns:
+            str: the availability topic
+        """
+        availability_topic = self.device_topic(device_key, "availability")
+        self._availability_topics[device_key] = availability_topic
+        return availability_topic
+
+    def device_topic(self, device_key: str, name: str) -> str:
+        """Returns a topic of a device that isn't bound to an entity, e.g. its availability.
+        """
+        return f"{self._mqtt_settings.state_prefix}/{device_key}/{name}"
+
+    def set_availability(self, device_key: str, available: bool) -> None:
+        """Publish if the entities of a device are available, see `enable_availability`. 
+        """
+        self.publish(self._availability_topics[device_key], "online" if available else "offline", qos=1, retain=True)
+
+    def remove_device(self, device_key: str) -> None:
+        """Delete all entities of a device from HA and drop their subscriptions and states. 
+        """
+        self._remove_entities(self._device_entities.pop(device_key, []))
+        for topic in self._device_subscriptions.pop(device_key, []):
+            self.unsubscribe(topic)
+        availability_topic = self._availability_topics.pop(device_key, None)
+        if availability_topic is not None:
+            self.publish(availability_topic, "", qos=1, retain=True)
+        self._discovery_cache.forget(device_key)
+        self._discovery_cache.save()
+        self._state_snapshot.forget(device_key)
+
+    @staticmethod
+    def _device_key(device_info) -> str:
+        identifiers = device_info.identifiers
+        return identifiers if isinstance(identifiers, str) else identifiers[0]
+
+    def prune_discovery(self, device_key: str, remove_device: bool = False) -> None:
+        """Delete the discovery configs of a device that were published by an earlier run but
+        not by this one and persist the discovery cache.
+
+        Must be called once all entities of the device were created.
+
+        Args:
+            device_key (str): first identifier of the device info
+            remove_device (bool, optional): delete all known configs of the device, e.g. if it is gone
+        """
+        stale_topics = self._discovery_cache.stale_topics(device_key)
+        for topic in stale_topics:
+            logging.info(f"Deleting discovery config {topic} of removed entity")
+            self.publish(topic, "", qos=1, retain=True)
+        if remove_device:
+            self._discovery_cache.forget(device_key)
+            self._state_snapshot.forget(device_key)
+        else:
+            self._discovery_cache.forget(device_key, stale_topics)
+        self._discovery_cache.save()
+
+    def known_devices(self) -> list[str]:
+        """Returns the keys of all devices with discovery configs in the cache.
+        """
+        return self._discovery_cache.devices()
+
+    @property
+    def state_store(self) -> StateStore:
+        return self._state_store
+
+    def publish(self, topic: str, payload=None, qos: int = 0, retain: bool = False) -> MQTTMessageInfo:
+        """Publish a message unless it repeats the payload last published to the topic.
+        """
+        labels = {"entity": self._topic_entities.get(topic, topic)}
+        if retain and self._discovery_cache.is_current(topic, payload):
+            logging.debug(f"Skipping discovery config of {topic}, unchanged since last run")
+            self._state_store.update(topic, payload, retain)
+            registry.inc("kdeconnect_mqtt_publishes_skipped_total", labels | {"reason": "discovery_cached"})
+            return self._published()
+        if not self._state_store.update(topic, payload, retain):
+            logging.debug(f"Skipping unchanged state of {topic}")
+            registry.inc("kdeconnect_mqtt_publishes_skipped_total", labels | {"reason": "unchanged"})
+            return self._published()
+        self._state_snapshot.record(topic, payload, retain)
+        with self._connection_lock:
+            if not self._connected:
+                # only the latest payload per topic is kept, the buffer is bounded by the number of topics
+                self._offline_buffer[topic] = (payload, qos, retain)
+                registry.inc("kdeconnect_mqtt_publishes_buffered_total", labels)
+                return self._published()
+        signaltrace.published(topic, labels["entity"])
+        return self._send(topic, payload, qos, retain)
+
+    def _send(self, topic: str, payload, qos: int, retain: bool) -> MQTTMessageInfo:
+        labels = {"entity": self._topic_entities.get(topic, topic)}
+        registry.inc("kdeconnect_mqtt_publishes_total", labels)
+        registry.inc("kdeconnect_mqtt_publish_bytes_total", labels, self._payload_size(payload))
+        return self._client._publish(topic, payload, qos, retain)
+
+    @staticmethod
+    def _payload_size(payload) -> int:
+        if payload is None:
+            return 0
+        if isinstance(payload, (bytes, bytearray)):
+            return len(payload)
+        return len(str(payload).encode())
+
+    @staticmethod
+    def _published() -> MQTTMessageInfo:
+        # stands in for publishes that were skipped
+        info = MQTTMessageInfo(0)
+        info.rc = MQTT_ERR_SUCCESS
+        info._set_as_published()
+        return info
+
+    def subscribe(self, topic: str, callback: Callable[[Client, object, MQTTMessage], None], device_key: Optional[str] = None) -> None:
+        """Add a topic to the subscription table.
+
+        Args:
+            topic (str): topic without wildcards
+            callback (Callable[[Client, object, MQTTMessage], None]): called from the network thread
+            device_key (str, optional): device the topic belongs to, it is unsubscribed when the device is removed
+        """
+        with self._subscriptions_lock:
+            new = topic not in self._subscriptions
+            self._subscriptions[topic] = callback
+            if device_key is not None:
+                self._device_subscriptions.setdefault(device_key, []).append(topic)
+        if new and self._client.is_connected():
+            Client.subscribe(self._client, topic, qos=1)
+
+    def has_subscription(self, topic: str) -> bool:
+        return topic in self._subscriptions
+
+    def unsubscribe(self, topic: str) -> None:
+        with self._subscriptions_lock:
+            callback = self._subscriptions.pop(topic, None)
+        if callback is not None and self._client.is_connected():
+            self._client.unsubscribe(topic)
+
+    def _on_connect(self, client: Client, user_data, flags, reason_code, properties):
+        if reason_code.is_failure:
+            logging.error(f"Connecting to MQTT broker failed: {reason_code}")
+            return
+        logging.info("Connected to MQTT broker")
+        self._retained_marker_seen = False
+        with self._subscriptions_lock:
+            topics = [(topic, 1) for topic in self._subscriptions]
+        if topics:
+            client.subscribe(topics)
+        with self._connection_lock:
+            # sent before the connection counts as back, a live publish of the same topic waits for
+            # the lock and goes out after the buffered payload it replaces
+            buffered = self._offline_buffer
+            self._offline_buffer = {}
+            if buffered:
+                logging.info(f"Publishing {len(buffered)} messages held back while disconnected")
+            for topic, (payload, qos, retain) in buffered.items():
+                self._send(topic, payload, qos, retain)
+            self._connected = True
+        timer = threading.Timer(self.RETAINED_CHECK_TIMEOUT, lambda: engine.call_soon_threadsafe(self._check_retained))
+        timer.daemon = True
+        timer.start()
+
+    def _on_disconnect(self, client: Client, user_data, flags, reason_code, properties):
+        with self._connection_lock:
+            self._connected = False
+        logging.warning(f"Disconnected from MQTT broker: {reason_code}")
+
+    def _retained_marker_received(self, client: Client, user_data, message: MQTTMessage):
+        if message.retain:
+            self._retained_marker_seen = True
+
+    def _check_retained(self):
+        if self._retained_marker_seen or not self._client.is_connected():
+            return
+        retained = self._state_store.retained()
+        logging.warning(f"Broker has no retained messages of the bridge, publishing {len(retained)} of them again")
+        registry.inc("kdeconnect_mqtt_retained_lost_total")
+        # configs known from an earlier run must not be skipped when their entities are created
+        self._discovery_cache.invalidate()
+        for topic, payload in retained:
+            self._send(topic, payload, 1, True)
+        self._client._publish(self._retained_marker_topic, "1", 1, True)
+
+    def _on_message(self, client: Client, user_data, message: MQTTMessage):
+        callback = self._subscriptions.get(message.topic)
+        if callback is None:
+            logging.debug(f"No subscriber for message on {message.topic}")
+            return
+        try:
+            callback(client, user_data, message)
+        except Exception:
+            # an exception would end the network thread
+            logging.exception(f"Handling message on {message.topic} failed")
@@ -0,0 +1,74 @@
+from typing import Callable, Optional
+import cProfile
+import engine
+import io
+import logging
+import math
+import os
+import pstats
+import time
+
+class Profiler():
+    """Takes a cProfile capture of the event loop for a while, on demand.
+
+    Only the thread of the event loop is profiled, that's where signals, commands and publishes
+    are handled. The paho network thread of the Qt engine is not part of the capture.
+    """
+    MAX_SECONDS = 300.0
+    # functions listed in the summary
+    SUMMARY_LINES = 30
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        """
+        Args:
+            path (str, optional): directory to keep the captures in as .pstats files, e.g. for snakeviz,
+                None only keeps the summary
+        """
+        self._path = path
+        self._profile = None
+
+    @property
+    def running(self) -> bool:
+        return self._profile is not None
+
+    def start(self, seconds: float, callback: Callable[[str], None]) -> bool:
+        """Start a capture. Must be called from the thread of the event loop.
+
+        Args:
+            seconds (float): length of the capture, at most `MAX_SECONDS`
+            callback (Callable[[str], None]): called with the summary once the capture is done
+
+        Returns:
+            bool: False if a capture is running already
+
+        Raises:
+            ValueError: if seconds is not a finite number
+        """
+        if not math.isfinite(seconds):
+            raise ValueError(f"Invalid profile length {seconds}")
+        if self._profile is not None:
+            return False
+        seconds = min(max(seconds, 0.0), self.MAX_SECONDS)
+        logging.info(f"Profiling the event loop for {seconds:.1f} s")
+        # scheduled first, the profile must never be left enabled
+        engine.call_later(seconds, lambda: self._stop(callback))
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        return True
+
+    def _stop(self, callback: Callable[[str], None]) -> None:
+        profile = self._profile
+        profile.disable()
+        self._profile = None
+        summary = io.StringIO()
+        stats = pstats.Stats(profile, stream=summary)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.SUMMARY_LINES)
+        if self._path is not None:
+            file_path = os.path.join(self._path, f"profile-{time.strftime('%Y%m%d-%H%M%S')}.pstats")
+            try:
+                os.makedirs(self._path, exist_ok=True)
+                stats.dump_stats(file_path)
+                logging.info(f"Saved profile to {file_path}")
+            except OSError as e:
+                logging.error(f"Failed to save profile to {file_path}: {e}")
+        callback(summary.getvalue())
@@ -0,0 +1,157 @@
+from PyQt5.QtDBus import QDBus, QDBusConnection, QDBusMessage, QDBusPendingCallWatcher, QDBusPendingReply, QDBusServiceWatcher
+from PyQt5.QtCore import QCoreApplication, QObject, Qt, pyqtSlot, pyqtSignal
+from typing import Callable, Optional
+from engine import weak_handler
+import engine
+import weakref
+
+class QtInvoker(QObject):
+    """Runs callbacks in the thread of the Qt event loop, whichever thread they are passed from.
+    Like with asyncio they never run before `call_soon_threadsafe` returned, also in the thread of the loop.
+    """
+    # queued to the thread of the event loop if emitted from another thread
+    _requested = pyqtSignal(object)
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.moveToThread(QCoreApplication.instance().thread())
+        self._requested.connect(self._invoke, Qt.QueuedConnection)
+
+    def call_soon_threadsafe(self, callback: Callable[[], None]) -> None:
+        self._requested.emit(callback)
+
+    @pyqtSlot(object)
+    def _invoke(self, callback: Callable[[], None]):
+        callback()
+
+class _SignalRouter(QObject):
+    """Receives one signal of all objects of a service and passes it on to the transports of the
+    objects that sent it. One router per signal instead of one receiver per object keeps the
+    number of QObjects and match rules independent of the number of devices.
+    """
+    def __init__(self, session: QDBusConnection, service: str, interface_name: str, signal_name: str) -> None:
+        super().__init__()
+        # object path -> transport of the object, there is one per path (see engine.create_transport)
+        self._transports = weakref.WeakValueDictionary()
+        # an empty path matches the signal of every object
+        session.connect(service, "", interface_name, signal_name, self.receive)
+
+    def add(self, path: str, transport: "QtDBusTransport") -> None:
+        self._transports[path] = transport
+
+    @pyqtSlot(QDBusMessage)
+    def receive(self, msg: QDBusMessage):
+        transport = self._transports.get(msg.path())
+        if transport is not None:
+            transport._signal_received(msg.interface(), msg.member(), msg.arguments())
+
+# (service, interface, signal) -> router
+_routers = {}
+# watchers of calls in flight of all transports, kept alive until they finished
+_pending_calls = set()
+
+def _router(session: QDBusConnection, service: str, interface_name: str, signal_name: str) -> _SignalRouter:
+    router = _routers.get((service, interface_name, signal_name))
+    if router is None:
+        router = _routers[(service, interface_name, signal_name)] = _SignalRouter(session, service, interface_name, signal_name)
+    return router
+
+class QtDBusTransport():
+    """Calls and signals of one D-Bus object on the session bus through QtDBus, used by `DBusWrapper`
+    if the bridge runs on the Qt event loop.
+
+    Calls are sent as plain messages, creating a transport does not introspect the object.
+    """
+    __slots__ = ("_service", "_path", "_session", "_signal_handlers", "_service_watcher", "_registration_handlers", "__weakref__")
+    # one connection object shared by all transports
+    _shared_session = None
+
+    def __init__(self, service: str, path: str) -> None:
+        self._service = service
+        self._path = path
+        if QtDBusTransport._shared_session is None:
+            QtDBusTransport._shared_session = QDBusConnection.sessionBus()
+        self._session = QtDBusTransport._shared_session
+        # (interface, signal) -> handlers
+        self._signal_handlers = {}
+        self._service_watcher = None
+        self._registration_handlers = []
+
+    def _create_call(self, interface_name: str, method_name: str, args) -> QDBusMessage:
+        msg = QDBusMessage.createMethodCall(self._service, self._path, interface_name, method_name)
+        msg.setArguments(list(args))
+        return msg
+
+    def call(self, interface_name: str, method_name: str, args, timeout: int) -> tuple[object, Optional[str]]:
+        """Call a method and wait for the reply.
+
+        Returns:
+            tuple[object, Optional[str]]: the return value and None or None and the error message
+        """
+        reply = self._session.call(self._create_call(interface_name, method_name, args), QDBus.Block, timeout)
+        if reply.type() == QDBusMessage.ErrorMessage:
+            return None, reply.errorMessage()
+        arguments = reply.arguments()
+        return (arguments[0] if arguments else None), None
+
+    def call_async(self, interface_name: str, method_name: str, args, timeout: int, callback: Callable[[object, Optional[str]], None]) -> None:
+        """Call a method without waiting for the reply. Can be called from any thread, the callback
+        is run in the thread of the event loop with the return value and the error message like `call`.
+        """
+        msg = self._create_call(interface_name, method_name, args)
+        engine.call_soon_threadsafe(lambda: self._send_async(msg, callback, timeout))
+
+    def _send_async(self, msg: QDBusMessage, callback: Callable[[object, Optional[str]], None], timeout: int):
+        pending_call = self._session.asyncCall(msg, timeout)
+        watcher = QDBusPendingCallWatcher(pending_call)
+        _pending_calls.add(watcher)
+        watcher.finished.connect(lambda watcher: self._async_call_finished(watcher, callback))
+
+    def _async_call_finished(self, watcher: QDBusPendingCallWatcher, callback: Callable[[object, Optional[str]], None]):
+        _pending_calls.discard(watcher)
+        watcher.deleteLater()
+        reply = QDBusPendingReply(watcher)
+        if reply.isError():
+            callback(None, reply.error().message())
+            return
+        arguments = reply.reply().arguments()
+        callback(arguments[0] if arguments else None, None)
+
+    def connect_signal(self, interface_name: str, signal_name: str, handler: Callable[..., None]) -> Callable[..., None]:
+        """Call the handler with the arguments of a signal of the object.
+
+        Returns:
+            Callable[..., None]: the connection, pass it to `disconnect_signal` to stop calling the handler
+        """
+        key = (interface_name, signal_name)
+        if key not in self._signal_handlers:
+            self._signal_handlers[key] = []
+            _router(self._session, self._service, interface_name, signal_name).add(self._path, self)
+        connection = weak_handler(handler)
+        self._signal_handlers[key].append(connection)
+        return connection
+
+    def disconnect_signal(self, interface_name: str, signal_name: str, connection: Callable[..., None]) -> None:
+        """Stop calling a handler that was connected with `connect_signal`.
+        """
+        key = (interface_name, signal_name)
+        handlers = self._signal_handlers.get(key)
+        if handlers is not None:
+            # replaced instead of changed, a signal that is being delivered keeps its handlers
+            self._signal_handlers[key] = [handler for handler in handlers if handler is not connection]
+
+    def _signal_received(self, interface_name: str, signal_name: str, arguments: list) -> None:
+        for handler in self._signal_handlers.get((interface_name, signal_name), ()):
+            handler(*arguments)
+
+    def watch_registration(self, handler: Callable[[], None]) -> None:
+        """Call the handler whenever the service registers its name on the bus, e.g. after a restart.
+        """
+        if self._service_watcher is None:
+            self._service_watcher = QDBusServiceWatcher(self._service, self._session, QDBusServiceWatcher.WatchForRegistration)
+            self._service_watcher.serviceRegistered.connect(self._service_registered)
+        self._registration_handlers.append(weak_handler(handler))
+
+    def _service_registered(self, service: str):
+        for handler in self._registration_handlers:
+            handler()
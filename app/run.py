@@ -5,6 +5,7 @@ from mqttkonnect import MqttDevice, MqttDaemon
 from ha_mqtt_discoverable import Settings
 from PyQt5.QtWidgets import QApplication
 import sys
+import os
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -17,7 +18,11 @@ def main():
     app = QApplication(sys.argv)
     # Configure the required parameters for the MQTT broker
     mqtt_settings = Settings.MQTT(host="homeassistant.home")
-    mqtt_daemon = MqttDaemon(mqtt_settings)
+    # remembers published discovery configs, so restarts don't publish all of them again
+    discovery_cache_path = os.path.expanduser("~/.cache/ha-kdeconnect/discovery.json")
+    # last known states, HA shows them right after a restart instead of unknown
+    state_snapshot_path = os.path.expanduser("~/.cache/ha-kdeconnect/states.json")
+    mqtt_daemon = MqttDaemon(mqtt_settings, discovery_cache_path=discovery_cache_path, state_snapshot_path=state_snapshot_path)
     mqtt_daemon.update_devices()
     sys.exit(app.exec_())
 
@@ -0,0 +1,32 @@
+"""Runs the bridge on the asyncio engine, without Qt. Needs dbus-next.
+"""
+from dbus_next.aio import MessageBus
+from ha_mqtt_discoverable import Settings
+import asyncio
+import logging
+import os
+import engine
+from mqttkonnect import MqttDaemon
+
+logging.basicConfig(level=logging.DEBUG)
+
+def main():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    bus = loop.run_until_complete(MessageBus().connect())
+    engine.use_asyncio(loop, bus)
+
+    # Configure the required parameters for the MQTT broker
+    mqtt_settings = Settings.MQTT(host="homeassistant.home")
+    # remembers published discovery configs, so restarts don't publish all of them again
+    discovery_cache_path = os.path.expanduser("~/.cache/ha-kdeconnect/discovery.json")
+    # last known states, HA shows them right after a restart instead of unknown
+    state_snapshot_path = os.path.expanduser("~/.cache/ha-kdeconnect/states.json")
+    # the setup may block on D-Bus calls, the loop starts running afterwards
+    mqtt_daemon = MqttDaemon(mqtt_settings, discovery_cache_path=discovery_cache_path, state_snapshot_path=state_snapshot_path)
+    try:
+        loop.run_forever()
+    finally:
+        loop.close()
+
+main()
@@ -0,0 +1,62 @@
+from filecache import FileCache, digest, guess_extension
+from metrics import registry
+from typing import Optional
+import logging
+
+class ShareSpool(FileCache):
+    """Directory that holds files received over MQTT until KDE Connect sent them to a device.
+
+    Files are named by the hash of their content, the same content sent again reuses its file.
+    Payloads larger than `max_file_bytes` are rejected, the least recently used files are deleted
+    once the spool would grow beyond `max_bytes` (see `FileCache`). A stored file is pinned until
+    it was released, files that wait to be shared or are being sent are never deleted.
+
+    Thread safe, files are stored from the worker thread (see `engine.run_in_worker`).
+    """
+    DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+    DEFAULT_MAX_FILE_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES, max_file_bytes: int = DEFAULT_MAX_FILE_BYTES) -> None:
+        """
+        Args:
+            path (str): directory of the spool, created if it doesn't exist
+            max_bytes (int, optional): maximum size of all files in the spool
+            max_file_bytes (int, optional): maximum size of a single file
+        """
+        super().__init__(path, max_bytes, "share spool")
+        self._max_file_bytes = min(max_file_bytes, max_bytes)
+
+    @staticmethod
+    def digest(payload) -> str:
+        """Returns the content hash the file of a payload is named by.
+        """
+        return digest(payload)
+
+    def store(self, payload, content_digest: Optional[str] = None) -> Optional[str]:
+        """Write a payload to the spool unless a file with the same content is there already.
+        The file is pinned, `release` must be called once it was shared.
+
+        Args:
+            payload (bytes): content of the file, the phone opens it by the extension guessed from it
+            content_digest (str, optional): `digest` of the payload if it's known already
+
+        Returns:
+            Optional[str]: path of the file or None if the payload was rejected
+        """
+        size = len(payload)
+        if size == 0 or size > self._max_file_bytes:
+            reason = "empty" if size == 0 else "too_large"
+            logging.warning(f"Not sharing file of {size} bytes ({reason}), at most {self._max_file_bytes} bytes are allowed")
+            registry.inc("kdeconnect_share_rejected_total", {"reason": reason})
+            return None
+        if content_digest is None:
+            content_digest = digest(payload)
+        path = self.put(content_digest[:16], payload, guess_extension(payload), pin=True)
+        if path is None:
+            registry.inc("kdeconnect_share_rejected_total", {"reason": "write_failed"})
+        return path
+
+    def release(self, content_digest: str) -> None:
+        """Unpin the file of a payload `store` returned, it may be deleted from now on.
+        """
+        self.unpin(content_digest[:16])
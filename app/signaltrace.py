@@ -0,0 +1,147 @@
+"""Traces the time from a D-Bus signal to the MQTT publishes it caused.
+
+Tracing is off until `enable` was called. A sampled signal is stamped when `DBusWrapper.dispatch`
+passes it to the slots of a plugin, the stamp travels with everything the slots start on the event
+loop: publishes right away, publishes held back by the coalescer and publishes in the callbacks of
+async D-Bus calls. Every publish with a stamp is observed in the histogram
+`kdeconnect_signal_to_publish_seconds` and kept as sample, the latest samples are returned by `samples`.
+"""
+from collections import deque
+from contextlib import nullcontext
+from metrics import registry
+from typing import Callable, Optional
+import random
+import threading
+import time
+
+class _Trace():
+    """Stamp of one sampled signal.
+    """
+    __slots__ = ("interface", "signal", "started", "wall_time")
+
+    def __init__(self, interface: str, signal: str) -> None:
+        self.interface = interface
+        self.signal = signal
+        self.started = time.perf_counter()
+        self.wall_time = time.time()
+
+class SignalTracer():
+    """Samples signals and records the latency of the publishes they caused.
+
+    Thread safe, the stamp of the signal that is handled is kept per thread.
+    """
+    DEFAULT_MAX_SAMPLES = 1000
+
+    def __init__(self, sample_rate: float = 1.0, max_samples: int = DEFAULT_MAX_SAMPLES) -> None:
+        """
+        Args:
+            sample_rate (float, optional): share of the signals that are traced, 1.0 traces all of them
+            max_samples (int, optional): number of the latest samples that are kept
+        """
+        self._sample_rate = sample_rate
+        self._samples = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def current(self) -> Optional[_Trace]:
+        """Returns the stamp of the signal that is handled by this thread right now.
+        """
+        return getattr(self._local, "trace", None)
+
+    def resumed(self, trace: Optional[_Trace]):
+        """Returns a context manager that makes a stamp the current one while it's entered.
+        """
+        if trace is None:
+            return _NO_TRACE
+        return _Resumed(self, trace)
+
+    def sample(self, interface: str, signal: str) -> Optional[_Trace]:
+        """Returns a new stamp for a signal if it is sampled, else None.
+        """
+        if self._sample_rate < 1.0 and random.random() >= self._sample_rate:
+            return None
+        registry.inc("kdeconnect_signals_traced_total", {"interface": interface, "signal": signal})
+        return _Trace(interface, signal)
+
+    def published(self, topic: str, entity: str) -> None:
+        """Record a publish, it is attributed to the current stamp if there is one.
+        """
+        trace = self.current()
+        if trace is None:
+            return
+        latency = time.perf_counter() - trace.started
+        registry.observe("kdeconnect_signal_to_publish_seconds", latency, {"interface": trace.interface, "signal": trace.signal})
+        with self._lock:
+            self._samples.append((trace.wall_time, trace.interface, trace.signal, entity, topic, latency))
+
+    def samples(self) -> list[dict]:
+        """Returns the latest samples, oldest first.
+        """
+        with self._lock:
+            samples = list(self._samples)
+        return [{"time": round(wall_time, 3), "interface": interface, "signal": signal, "entity": entity, "topic": topic,
+                 "latency_ms": round(latency * 1000, 3)}
+                for wall_time, interface, signal, entity, topic, latency in samples]
+
+class _Resumed():
+    __slots__ = ("_tracer", "_trace", "_previous")
+
+    def __init__(self, tracer: SignalTracer, trace: _Trace) -> None:
+        self._tracer = tracer
+        self._trace = trace
+
+    def __enter__(self) -> None:
+        self._previous = self._tracer.current()
+        self._tracer._local.trace = self._trace
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self._tracer._local.trace = self._previous
+
+_NO_TRACE = nullcontext()
+
+# tracer of the process, None while tracing is off
+tracer: Optional[SignalTracer] = None
+
+def enable(sample_rate: float = 1.0, max_samples: int = SignalTracer.DEFAULT_MAX_SAMPLES) -> SignalTracer:
+    """Start tracing signals, see `SignalTracer`.
+    """
+    global tracer
+    tracer = SignalTracer(sample_rate, max_samples)
+    return tracer
+
+def traced(interface: str, signal: str):
+    """Returns a context manager to dispatch a signal in, its publishes are traced if it is sampled.
+    """
+    if tracer is None:
+        return _NO_TRACE
+    return tracer.resumed(tracer.sample(interface, signal))
+
+def current() -> Optional[_Trace]:
+    """Returns the stamp of the signal that is handled right now, None if there is none or tracing is off.
+    """
+    return None if tracer is None else tracer.current()
+
+def resumed(trace: Optional[_Trace]):
+    """Returns a context manager that continues the trace of a signal in a later callback.
+    """
+    if tracer is None or trace is None:
+        return _NO_TRACE
+    return tracer.resumed(trace)
+
+def carried(callback: Callable[..., None]) -> Callable[..., None]:
+    """Returns a callback that runs with the stamp that is current now, e.g. for the reply of a call.
+    """
+    trace = current()
+    if trace is None:
+        return callback
+
+    def resume(*args):
+        with tracer.resumed(trace):
+            callback(*args)
+    return resume
+
+def published(topic: str, entity: str) -> None:
+    """Record a publish of the bridge, see `SignalTracer.published`.
+    """
+    if tracer is not None:
+        tracer.published(topic, entity)
@@ -0,0 +1,133 @@
+from typing import Optional
+import json
+import logging
+import os
+import threading
+
+class StateSnapshot():
+    """Last published state per entity topic, persisted between runs.
+
+    On start the snapshot is published right away, so HA shows the last known states instead of
+    unknown until every device was probed over D-Bus. Live values that differ replace them as the
+    devices are loaded.
+
+    Writes are delayed by `save_delay` seconds and batched, a burst of states causes one write.
+    The file is only readable by the user, attributes topics that older versions recorded are
+    dropped when it's loaded.
+    """
+    # suffix of the attributes topics of ha-mqtt-discoverable entities
+    ATTRIBUTES_SUFFIX = "/attributes"
+
+    def __init__(self, path: Optional[str] = None, save_delay: float = 5.0) -> None:
+        """
+        Args:
+            path (str, optional): json file the states are stored in, None keeps them in memory only
+            save_delay (float, optional): seconds between a change and writing the file
+        """
+        self._path = path
+        self._save_delay = save_delay
+        # device key -> topic -> [payload, retain]
+        self._states = {}
+        # topic -> device key, for state topics of entities created in this run
+        self._devices = {}
+        self._save_timer = None
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if self._path is None or not os.path.exists(self._path):
+            return
+        try:
+            with open(self._path, "r", encoding="utf-8") as snapshot_file:
+                self._states = json.load(snapshot_file)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring state snapshot {self._path}: {e}")
+            self._states = {}
+        for device_states in self._states.values():
+            attributes_topics = [topic for topic in device_states if topic.endswith(self.ATTRIBUTES_SUFFIX)]
+            for topic in attributes_topics:
+                del device_states[topic]
+            if attributes_topics:
+                with self._lock:
+                    self._schedule_save()
+
+    def save(self) -> None:
+        if self._path is None:
+            return
+        with self._lock:
+            self._save_timer = None
+            content = json.dumps(self._states, separators=(",", ":"), sort_keys=True)
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # replace the file at once, a crash while writing must not corrupt the snapshot
+        tmp_path = f"{self._path}.tmp"
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as snapshot_file:
+                snapshot_file.write(content)
+            os.replace(tmp_path, self._path)
+        except OSError as e:
+            logging.error(f"Failed to write state snapshot {self._path}: {e}")
+
+    def _schedule_save(self) -> None:
+        # must hold the lock
+        if self._path is None or self._save_timer is not None:
+            return
+        self._save_timer = threading.Timer(self._save_delay, self.save)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def register(self, topic: str, device_key: str) -> None:
+        """Assign a state topic of an entity to the device it belongs to, only registered topics are recorded.
+        """
+        with self._lock:
+            self._devices[topic] = device_key
+
+    def record(self, topic: str, payload, retain: bool) -> None:
+        """Record a payload that was published.
+        """
+        device_key = self._devices.get(topic)
+        if device_key is None:
+            return
+        if isinstance(payload, (bytes, bytearray)):
+            try:
+                payload = payload.decode()
+            except UnicodeDecodeError:
+                # only text is stored
+                return
+        with self._lock:
+            device_states = self._states.setdefault(device_key, {})
+            if payload is None or payload == "":
+                if device_states.pop(topic, None) is not None:
+                    self._schedule_save()
+                return
+            state = [str(payload), retain]
+            if device_states.get(topic) != state:
+                device_states[topic] = state
+                self._schedule_save()
+
+    def states(self) -> list[tuple[str, str, bool]]:
+        """Returns all recorded states as (topic, payload, retain).
+        """
+        with self._lock:
+            return [(topic, payload, retain) for device_states in self._states.values() for topic, (payload, retain) in device_states.items()]
+
+    def forget(self, device_key: str, topics: Optional[list[str]] = None) -> None:
+        """Drop states of a device, all of them if no topics are given. The topics are unregistered,
+        late publishes of a removed device are not recorded again.
+        """
+        with self._lock:
+            if topics is None:
+                self._devices = {topic: key for topic, key in self._devices.items() if key != device_key}
+                removed = self._states.pop(device_key, None) is not None
+            else:
+                for topic in topics:
+                    if self._devices.get(topic) == device_key:
+                        del self._devices[topic]
+                device_states = self._states.get(device_key, {})
+                removed = any([device_states.pop(topic, None) is not None for topic in topics])
+                if not device_states:
+                    self._states.pop(device_key, None)
+            if removed:
+                self._schedule_save()
@@ -0,0 +1,64 @@
+from typing import Optional
+import threading
+import time
+
+class StateStore():
+    """Remembers the payload last published per topic, so identical publishes can be dropped.
+
+    Thread safe, entities publish from the Qt thread as well as from MQTT callbacks.
+    """
+
+    def __init__(self, force_refresh_interval: Optional[float] = None) -> None:
+        """
+        Args:
+            force_refresh_interval (float, optional): publish an identical payload again if this
+                many seconds passed since it was last published, e.g. to keep retained topics and
+                the HA recorder fresh. None never repeats identical payloads.
+        """
+        self._force_refresh_interval = force_refresh_interval
+        # topic -> (payload, retain, monotonic time of the publish)
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def update(self, topic: str, payload, retain: bool) -> bool:
+        """Record a payload that is about to be published.
+
+        Args:
+            topic (str): topic of the message
+            payload: payload of the message
+            retain (bool): retain flag of the message
+
+        Returns:
+            bool: True if it has to be published, False if it repeats the last published payload
+        """
+        now = time.monotonic()
+        with self._lock:
+            last = self._states.get(topic)
+            if last is not None and last[0] == payload and last[1] == retain:
+                if self._force_refresh_interval is None or now - last[2] < self._force_refresh_interval:
+                    return False
+            if payload is None or payload == "" or payload == b"":
+                # empty payloads delete retained messages, there is nothing to remember
+                self._states.pop(topic, None)
+            else:
+                self._states[topic] = (payload, retain, now)
+            return True
+
+    def get(self, topic: str):
+        """Returns the payload last published to the topic or None.
+        """
+        with self._lock:
+            last = self._states.get(topic)
+        return None if last is None else last[0]
+
+    def retained(self) -> list[tuple[str, object]]:
+        """Returns topic and payload of all states that were published with the retain flag.
+        """
+        with self._lock:
+            return [(topic, payload) for topic, (payload, retain, _) in self._states.items() if retain]
+
+    def forget(self, topic: str) -> None:
+        """Drop the state of a topic, the next payload is published whatever it is.
+        """
+        with self._lock:
+            self._states.pop(topic, None)
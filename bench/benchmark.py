@@ -0,0 +1,301 @@
+"""Offline benchmark of the bridge, no phones or KDE Connect needed.
+
+For every device count a private dbus-daemon is started with a fake KDE Connect daemon
+(fakekdeconnect.py) on it, and the bridge (bridge.py) is run against a local broker. The
+result is printed as json:
+
+* cold start: time from creating `MqttDaemon` until the last message of the initial publish
+  arrived at a subscriber, and D-Bus calls per device it took
+* memory: resident set size of the bridge after the cold start and per device
+* events: per kind of signal D-Bus calls per event and signal-to-publish latency percentiles
+
+Usage: python bench/benchmark.py [--devices 1 10 50] [--engine qt asyncio] [--broker host:port] [--output result.json]
+
+Requires dbus-daemon and dbus-monitor in PATH and Linux for memory readings, and dbus-next for
+the asyncio engine.
+"""
+from PyQt5.QtCore import QCoreApplication
+from PyQt5.QtDBus import QDBusConnection, QDBusMessage
+from paho.mqtt.client import Client
+from paho.mqtt.enums import CallbackAPIVersion
+from typing import Callable, Optional
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+from broker import LocalBroker
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# kind of event -> (topic of the state that is published for the first device, payload of an emitted value)
+EVENTS = {
+    "battery": ("hmd/sensor/KDE-Connect-Phone-0/Battery/state", str),
+    "lock": ("hmd/switch/KDE-Connect-Phone-0/Lock-Device/state", lambda locked: "ON" if locked else "OFF"),
+    "connectivity": ("hmd/sensor/KDE-Connect-Phone-0/Network-Signal-Strength/state", str),
+    "volume": ("hmd/number/KDE-Connect-Phone-0/Volume/state", lambda volume: str(min(100, int(volume / 0xFFFF * 100)))),
+    "mpris": ("hmd/text/KDE-Connect-Phone-0/Player-Album/state", lambda index: f"Album {index}"),
+    # each signal posts another notification
+    "notifications": ("hmd/sensor/KDE-Connect-Phone-0/Notifications/state", str),
+}
+
+class MessageRecorder():
+    """Subscribes to all topics and records when each message arrived.
+    """
+
+    def __init__(self, host: str, port: int) -> None:
+        self._messages = []
+        self._lock = threading.Lock()
+        self._client = Client(CallbackAPIVersion.VERSION2, client_id="kdeconnect-bench-recorder")
+        self._client.on_connect = lambda client, user_data, flags, reason_code, properties: client.subscribe("#")
+        self._client.on_message = self._on_message
+        self._client.connect(host, port)
+        self._client.loop_start()
+
+    def _on_message(self, client, user_data, message):
+        if message.retain:
+            # left over from earlier runs
+            return
+        with self._lock:
+            self._messages.append((time.monotonic(), message.topic, message.payload.decode(errors="replace"), message.retain))
+
+    def stop(self) -> None:
+        self._client.disconnect()
+        self._client.loop_stop()
+
+    def take(self) -> list[tuple[float, str, str, bool]]:
+        with self._lock:
+            messages = self._messages
+            self._messages = []
+        return messages
+
+    def last_time(self) -> float:
+        with self._lock:
+            return self._messages[-1][0] if self._messages else 0.0
+
+class CallCounter():
+    """Counts method calls to the KDE Connect daemon with dbus-monitor.
+    """
+
+    def __init__(self, bus_address: str) -> None:
+        self._count = 0
+        self._last_time = 0.0
+        self._lock = threading.Lock()
+        match_rule = "type='method_call',destination='org.kde.kdeconnect.daemon'"
+        self._process = subprocess.Popen(["dbus-monitor", "--address", bus_address, "--monitor", match_rule],
+                                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        for line in self._process.stdout:
+            # calls of the benchmark itself go to /bench
+            if line.startswith("method call") and "path=/bench;" not in line:
+                with self._lock:
+                    self._count += 1
+                    self._last_time = time.monotonic()
+
+    def take(self) -> int:
+        with self._lock:
+            count = self._count
+            self._count = 0
+        return count
+
+    def last_time(self) -> float:
+        with self._lock:
+            return self._last_time
+
+    def stop(self) -> None:
+        self._process.terminate()
+        self._process.wait()
+
+def wait_quiet(last_times: list[Callable[[], float]], quiet: float, timeout: float) -> None:
+    """Wait until nothing happened for `quiet` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        last = max(last_time() for last_time in last_times)
+        if time.monotonic() - last >= quiet:
+            return
+        time.sleep(0.05)
+
+def percentiles(values: list[float]) -> Optional[dict[str, float]]:
+    if not values:
+        return None
+    values = sorted(values)
+
+    def percentile(p: float) -> float:
+        return round(values[min(len(values) - 1, int(p / 100 * len(values)))], 3)
+    return {"p50": percentile(50), "p90": percentile(90), "p99": percentile(99), "max": round(values[-1], 3)}
+
+def rss_kb(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+class BenchRun():
+    """One run of the bridge with a number of devices on a private bus.
+    """
+
+    def __init__(self, num_devices: int, broker_host: str, broker_port: int, quiet: float, engine: str = "qt") -> None:
+        self._num_devices = num_devices
+        self._engine = engine
+        self._broker_host = broker_host
+        self._broker_port = broker_port
+        self._quiet = quiet
+        self._processes = []
+
+    def _start_bus(self) -> str:
+        bus = subprocess.Popen(["dbus-daemon", "--session", "--nofork", "--print-address=1"],
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        self._processes.append(bus)
+        return bus.stdout.readline().strip()
+
+    def _start(self, script: str, *args) -> subprocess.Popen:
+        process = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, script), *map(str, args)],
+                                   env=self._env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        self._processes.append(process)
+        return process
+
+    def _bench_call(self, method_name: str, *args):
+        msg = QDBusMessage.createMethodCall("org.kde.kdeconnect.daemon", "/bench", "org.kde.kdeconnect.bench", method_name)
+        msg.setArguments(list(args))
+        reply = self._bus.call(msg)
+        if reply.type() == QDBusMessage.ErrorMessage:
+            raise RuntimeError(f"Calling {method_name} on the fake daemon failed: {reply.errorMessage()}")
+        return reply.arguments()[0] if reply.arguments() else None
+
+    def run(self, num_events: int, interval_ms: int) -> dict:
+        try:
+            return self._run(num_events, interval_ms)
+        finally:
+            for process in reversed(self._processes):
+                process.terminate()
+                process.wait()
+            QDBusConnection.disconnectFromBus(f"bench-{self._num_devices}")
+
+    def _run(self, num_events: int, interval_ms: int) -> dict:
+        bus_address = self._start_bus()
+        self._env = dict(os.environ, DBUS_SESSION_BUS_ADDRESS=bus_address)
+        fake = self._start("fakekdeconnect.py", self._num_devices)
+        fake.stdout.readline()
+        self._bus = QDBusConnection.connectToBus(bus_address, f"bench-{self._num_devices}")
+
+        calls = CallCounter(bus_address)
+        recorder = MessageRecorder(self._broker_host, self._broker_port)
+        try:
+            # give the monitor time to become active
+            time.sleep(0.2)
+            result = {"devices": self._num_devices, "engine": self._engine}
+            bridge = self._start("bridge.py", self._broker_host, self._broker_port, self._engine)
+            result["cold_start"] = self._measure_cold_start(bridge, recorder, calls)
+            result["rss_kb"] = rss_kb(bridge.pid)
+            result["events"] = {kind: self._measure_event(kind, num_events, interval_ms, recorder, calls) for kind in EVENTS}
+            return result
+        finally:
+            recorder.stop()
+            calls.stop()
+
+    def _measure_cold_start(self, bridge: subprocess.Popen, recorder: MessageRecorder, calls: CallCounter) -> dict:
+        spawned = time.monotonic()
+        for line in bridge.stdout:
+            if line.startswith("BENCH "):
+                started = json.loads(line[len("BENCH "):])["started"]
+                break
+        else:
+            raise RuntimeError("The bridge exited before it started")
+        deadline = time.monotonic() + 60
+        while recorder.last_time() == 0.0:
+            if time.monotonic() > deadline or bridge.poll() is not None:
+                raise RuntimeError("The bridge published nothing")
+            time.sleep(0.05)
+        wait_quiet([recorder.last_time, calls.last_time], self._quiet, timeout=120)
+        messages = recorder.take()
+        return {
+            "seconds": round(messages[-1][0] - started, 3),
+            "seconds_incl_process_start": round(messages[-1][0] - spawned, 3),
+            "messages": len(messages),
+            "dbus_calls_per_device": round(calls.take() / self._num_devices, 2),
+        }
+
+    def _measure_event(self, kind: str, num_events: int, interval_ms: int, recorder: MessageRecorder, calls: CallCounter) -> dict:
+        topic, payload_of = EVENTS[kind]
+        self._bench_call("emit", kind, "bench0", num_events, interval_ms)
+        time.sleep(num_events * interval_ms / 1000)
+        # batched events are published a while after their last signal, the quiet period starts no earlier
+        last_signal = time.monotonic()
+        wait_quiet([recorder.last_time, calls.last_time, lambda: last_signal], self._quiet, timeout=30)
+
+        emitted = json.loads(self._bench_call("takeLog"))
+        published = [(received, payload) for received, message_topic, payload, retain in recorder.take() if message_topic == topic]
+        latencies = []
+        for received, payload in published:
+            # the latest signal that carried the published value
+            emit_times = [emit_time for emit_time, _, _, value in emitted if payload_of(value) == payload and emit_time <= received]
+            if emit_times:
+                latencies.append((received - emit_times[-1]) * 1000)
+        return {
+            "signals": len(emitted),
+            "publishes": len(published),
+            "dbus_calls_per_signal": round(calls.take() / max(1, len(emitted)), 2),
+            "latency_ms": percentiles(latencies),
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bridge against a fake KDE Connect daemon")
+    parser.add_argument("--devices", type=int, nargs="+", default=[1, 10, 50], help="device counts to run with")
+    parser.add_argument("--engine", nargs="+", choices=["qt", "asyncio"], default=["qt"], help="engines the bridge runs on")
+    parser.add_argument("--events", type=int, default=20, help="signals per kind of event")
+    parser.add_argument("--interval", type=int, default=100, help="milliseconds between two signals")
+    parser.add_argument("--quiet", type=float, default=1.0, help="seconds without messages after which a phase is done")
+    parser.add_argument("--broker", help="host:port of an MQTT broker to use instead of the built-in one")
+    parser.add_argument("--output", help="file to write the result to instead of stdout")
+    args = parser.parse_args()
+
+    for tool in ["dbus-daemon", "dbus-monitor"]:
+        if shutil.which(tool) is None:
+            parser.error(f"{tool} not found")
+
+    app = QCoreApplication(sys.argv)
+    broker = None
+    if args.broker:
+        broker_host, broker_port = args.broker.rsplit(":", 1)
+        broker_port = int(broker_port)
+    else:
+        broker = LocalBroker()
+        broker.start()
+        broker_host, broker_port = broker.host, broker.port
+
+    runs = []
+    try:
+        for engine in args.engine:
+            for num_devices in args.devices:
+                runs.append(BenchRun(num_devices, broker_host, broker_port, args.quiet, engine).run(args.events, args.interval))
+    finally:
+        if broker is not None:
+            broker.stop()
+
+    result = {"python": sys.version.split()[0], "runs": runs}
+    for engine in args.engine:
+        engine_runs = [run for run in runs if run["engine"] == engine]
+        if len(engine_runs) > 1 and all(run["rss_kb"] is not None for run in engine_runs):
+            first, last = engine_runs[0], engine_runs[-1]
+            result.setdefault("rss_kb_per_device", {})[engine] = round((last["rss_kb"] - first["rss_kb"]) / (last["devices"] - first["devices"]), 1)
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
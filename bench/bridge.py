@@ -0,0 +1,45 @@
+"""Runs the bridge against the session bus and a broker for the benchmark.
+
+Prints a line `BENCH {"started": <monotonic time>}` right before `MqttDaemon` is created.
+
+Usage: python bridge.py <broker host> <broker port> [qt|asyncio]
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from ha_mqtt_discoverable import Settings
+from mqttkonnect import MqttDaemon
+import engine
+
+def run_qt(mqtt_settings: Settings.MQTT):
+    from PyQt5.QtCore import QCoreApplication
+    app = QCoreApplication(sys.argv)
+    print("BENCH " + json.dumps({"started": time.monotonic()}), flush=True)
+    mqtt_daemon = MqttDaemon(mqtt_settings)
+    sys.exit(app.exec_())
+
+def run_asyncio(mqtt_settings: Settings.MQTT):
+    from dbus_next.aio import MessageBus
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    print("BENCH " + json.dumps({"started": time.monotonic()}), flush=True)
+    engine.use_asyncio(loop, loop.run_until_complete(MessageBus().connect()))
+    mqtt_daemon = MqttDaemon(mqtt_settings)
+    loop.run_forever()
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    mqtt_settings = Settings.MQTT(host=sys.argv[1], port=int(sys.argv[2]), client_name="kdeconnect-bench")
+    if len(sys.argv) > 3 and sys.argv[3] == "asyncio":
+        run_asyncio(mqtt_settings)
+    else:
+        run_qt(mqtt_settings)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Minimal MQTT 3.1.1 broker for local benchmarks.
+
+Supports what the bridge and the benchmark need: QoS 0/1 publishes, retained messages,
+subscriptions with wildcards and keep alive. It runs in a background thread.
+"""
+import asyncio
+import struct
+import threading
+
+class LocalBroker():
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        """
+        Args:
+            host (str, optional): address to listen on
+            port (int, optional): port to listen on, 0 picks a free port
+        """
+        self.host = host
+        self.port = port
+        self._retained = {}
+        self._clients = {}
+        # writer -> topic filters of the client
+        self._subscribers = {}
+        self._loop = asyncio.new_event_loop()
+        self._server = None
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+    def start(self) -> None:
+        self._server = self._loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._thread.start()
+
+    def stop(self) -> None:
+        async def close():
+            self._server.close()
+            for writer in list(self._clients.values()):
+                writer.close()
+        asyncio.run_coroutine_threadsafe(close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    @staticmethod
+    def _matches(topic_filter: str, topic: str) -> bool:
+        filter_levels = topic_filter.split("/")
+        topic_levels = topic.split("/")
+        for i, level in enumerate(filter_levels):
+            if level == "#":
+                return True
+            if i >= len(topic_levels) or (level != "+" and level != topic_levels[i]):
+                return False
+        return len(filter_levels) == len(topic_levels)
+
+    @staticmethod
+    def _packet(header: int, body: bytes) -> bytes:
+        length = len(body)
+        encoded = b""
+        while True:
+            digit = length % 128
+            length //= 128
+            encoded += bytes([digit | (0x80 if length else 0)])
+            if not length:
+                return bytes([header]) + encoded + body
+
+    def _send(self, writer: asyncio.StreamWriter, topic: str, payload: bytes, retain: bool) -> None:
+        topic_bytes = topic.encode()
+        writer.write(self._packet(0x30 | int(retain), struct.pack("!H", len(topic_bytes)) + topic_bytes + payload))
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        subscriptions = set()
+        self._clients[id(writer)] = writer
+        try:
+            while True:
+                header = (await reader.readexactly(1))[0]
+                multiplier, length = 1, 0
+                while True:
+                    digit = (await reader.readexactly(1))[0]
+                    length += (digit & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not digit & 0x80:
+                        break
+                body = await reader.readexactly(length)
+                packet_type = header >> 4
+                if packet_type == 1:  # CONNECT
+                    writer.write(bytes([0x20, 2, 0, 0]))
+                elif packet_type == 3:  # PUBLISH
+                    self._publish(writer, header, body)
+                elif packet_type == 8:  # SUBSCRIBE
+                    self._subscribe(writer, subscriptions, body)
+                elif packet_type == 10:  # UNSUBSCRIBE
+                    writer.write(bytes([0xB0, 2]) + body[:2])
+                elif packet_type == 12:  # PINGREQ
+                    writer.write(bytes([0xD0, 0]))
+                elif packet_type == 14:  # DISCONNECT
+                    break
+                if writer.transport.get_write_buffer_size() > 0x10000:
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._clients.pop(id(writer), None)
+            self._subscribers.pop(writer, None)
+            writer.close()
+
+    def _publish(self, writer: asyncio.StreamWriter, header: int, body: bytes) -> None:
+        qos = (header >> 1) & 3
+        retain = bool(header & 1)
+        topic_length = struct.unpack("!H", body[:2])[0]
+        topic = body[2:2 + topic_length].decode()
+        position = 2 + topic_length
+        if qos:
+            writer.write(bytes([0x40, 2]) + body[position:position + 2])
+            position += 2
+        payload = body[position:]
+        if retain:
+            if payload:
+                self._retained[topic] = payload
+            else:
+                self._retained.pop(topic, None)
+        for client_writer, client_subscriptions in list(self._subscribers.items()):
+            if any(self._matches(topic_filter, topic) for topic_filter in client_subscriptions):
+                self._send(client_writer, topic, payload, False)
+
+    def _subscribe(self, writer: asyncio.StreamWriter, subscriptions: set, body: bytes) -> None:
+        position = 2
+        new_filters = []
+        while position < len(body):
+            filter_length = struct.unpack("!H", body[position:position + 2])[0]
+            new_filters.append(body[position + 2:position + 2 + filter_length].decode())
+            # skip the requested qos, everything is delivered with qos 0
+            position += 3 + filter_length
+        subscriptions.update(new_filters)
+        self._subscribers[writer] = subscriptions
+        writer.write(self._packet(0x90, body[:2] + bytes(len(new_filters))))
+        for topic, payload in self._retained.items():
+            if any(self._matches(topic_filter, topic) for topic_filter in new_filters):
+                self._send(writer, topic, payload, True)
@@ -0,0 +1,415 @@
+"""Stand-in for the KDE Connect daemon on the session bus.
+
+Registers `org.kde.kdeconnect.daemon` with N paired devices that have all plugins
+used by konnect.py. Signals are emitted on request through the `org.kde.kdeconnect.bench`
+interface at /bench, which also reports when each signal was emitted.
+
+Usage: python fakekdeconnect.py <number of devices>
+"""
+from PyQt5.QtCore import QCoreApplication, QObject, QByteArray, QTimer, pyqtSlot, pyqtProperty, pyqtSignal, Q_CLASSINFO
+from PyQt5.QtDBus import QDBusConnection, QDBusAbstractAdaptor
+import json
+import os
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+SERVICE = "org.kde.kdeconnect.daemon"
+PLUGINS = ["kdeconnect_ping", "kdeconnect_battery", "kdeconnect_connectivity_report", "kdeconnect_findmyphone",
+           "kdeconnect_mprisremote", "kdeconnect_lockdevice", "kdeconnect_remotesystemvolume", "kdeconnect_notifications",
+           "kdeconnect_share"]
+
+class DaemonAdaptor(QDBusAbstractAdaptor):
+    Q_CLASSINFO("D-Bus Interface", "org.kde.kdeconnect.daemon")
+    deviceListChanged = pyqtSignal()
+
+    def __init__(self, parent: QObject, device_ids: list[str]) -> None:
+        super().__init__(parent)
+        self._device_ids = device_ids
+
+    @pyqtSlot(result=str)
+    def announcedName(self):
+        return "Bench Host"
+
+    @pyqtSlot(result=str)
+    def selfId(self):
+        return "benchhost"
+
+    @pyqtSlot(bool, bool, result="QStringList")
+    def devices(self, only_reachable, only_paired):
+        return self._device_ids
+
+class DeviceAdaptor(QDBusAbstractAdaptor):
+    Q_CLASSINFO("D-Bus Interface", "org.kde.kdeconnect.device")
+    nameChanged = pyqtSignal(str)
+    pluginsChanged = pyqtSignal()
+    reachableChanged = pyqtSignal(bool)
+    pairStateChanged = pyqtSignal(int)
+
+    def __init__(self, parent: QObject, index: int) -> None:
+        super().__init__(parent)
+        self._index = index
+
+    @pyqtProperty(str)
+    def name(self):
+        return f"Phone {self._index}"
+
+    @pyqtProperty(bool)
+    def isReachable(self):
+        return True
+
+    @pyqtSlot(result=bool)
+    def isPaired(self):
+        return True
+
+    @pyqtSlot(result="QStringList")
+    def loadedPlugins(self):
+        return PLUGINS
+
+    @pyqtSlot(str, result=bool)
+    def hasPlugin(self, name):
+        return name in PLUGINS
+
+    @pyqtSlot(str, result=bool)
+    def isPluginEnabled(self, name):
+        return name in PLUGINS
+
+class BatteryAdaptor(QDBusAbstractAdaptor):
+    Q_CLASSINFO("D-Bus Interface", "org.kde.kdeconnect.device.battery")
+    refreshed = pyqtSignal(bool, int)
+    value = 50
+
+    @pyqtProperty(int)
+    def charge(self):
+        return self.value
+
+    @pyqtProperty(bool)
+    def isCharging(self):
+        return True
+
+    def emit(self, value: int) -> None:
+        self.value = value
+        self.refreshed.emit(True, value)
+
+class LockDeviceAdaptor(QDBusAbstractAdaptor):
+    Q_CLASSINFO("D-Bus Interface", "org.kde.kdeconnect.device.lockdevice")
+    lockedChanged = pyqtSignal(bool)
+    value = False
+
+    @pyqtProperty(bool)
+    def isLocked(self):
+        return self.value
+
+    @pyqtSlot(bool)
+    def setLocked(self, locked):
+        self.emit(locked)
+
+    def emit(self, value: bool) -> None:
+        self.value = value
+        self.lockedChanged.emit(value)
+
+class ConnectivityReportAdaptor(QDBusAbstractAdaptor):
+    Q_CLASSINFO("D-Bus Interface", "org.kde.kdeconnect.device.connectivity_report")
+    refreshed = pyqtSignal(str, int)
+    value = 3
+
+    @pyqtProperty(str)
+    def cellularNetworkType(self):
+        return "LTE"
+
+    @pyqtProperty(int)
+    def cellularNetworkStrength(self):
+        return self.value
+
+    def emit(self, value: int) -> None:
+        self.value = value
+        self.refreshed.emit("LTE", value)
+
+class FindMyPhoneAdaptor(QDBusAbstractAdaptor):
+    Q_CLASSINFO("D-Bus Interface", "org.kde.kdeconnect.device.findmyphone")
+
+    @pyqtSlot()
+    def ring(self):
+        pass
+
+class PingAdaptor(QDBusAbstractAdaptor):
+    Q_CLASSINFO("D-Bus Interface", "org.kde.kdeconnect.device.ping")
+
+    @pyqtSlot()
+    def sendPing(self):
+        pass
+
+class RemoteSystemVolumeAdaptor(QDBusAbstractAdaptor):
+    Q_CLASSINFO("D-Bus Interface", "org.kde.kdeconnect.device.remotesystemvolume")
+    sinksChanged = pyqtSignal()
+    volumeChanged = pyqtSignal(str, int)
+    mutedChanged = pyqtSignal(str, bool)
+    value = 30000
+
+    @pyqtProperty(QByteArray)
+    def sinks(self):
+        sinks = [{"name": "speaker", "description": "Speaker", "enabled": False, "muted": False, "volume": 100, "maxVolume": 65536},
+                 {"name": "headset", "description": "Headset", "enabled": True, "muted": False, "volume": self.value, "maxVolume": 65536}]
+        return QByteArray(json.dumps(sinks).encode())
+
+    @pyqtSlot(str, int)
+    def sendVolume(self, sink, volume):
+        self.emit(volume)
+
+    @pyqtSlot(str, bool)
+    def sendMuted(self, sink, muted):
+        self.mutedChanged.emit(sink, muted)
+
+    def emit(self, value: int) -> None:
+        self.value = value
+        self.volumeChanged.emit("headset", value)
+
+# every track has its own album art file like in KDE Connect, tracks of the same album have the same art
+TRACKS_PER_ALBUM = 3
+NUM_ALBUMS = 3
+COVER_DIR = os.path.join(tempfile.gettempdir(), "fakekdeconnect-covers")
+
+def cover_path(track: int) -> str:
+    """Returns the path of the art of a track, a plain colored 300x300 PNG, and writes it if it doesn't exist.
+    """
+    path = os.path.join(COVER_DIR, f"track{track}.png")
+    if os.path.exists(path):
+        return path
+    album = track // TRACKS_PER_ALBUM % NUM_ALBUMS
+    width = height = 300
+    row = b"\x00" + bytes((album * 80 % 256, 120, 200)) * width
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    png = (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+           + chunk(b"IDAT", zlib.compress(row * height)) + chunk(b"IEND", b""))
+    os.makedirs(COVER_DIR, exist_ok=True)
+    with open(path, "wb") as cover_file:
+        cover_file.write(png)
+    return path
+
+class MprisRemoteAdaptor(QDBusAbstractAdaptor):
+    Q_CLASSINFO("D-Bus Interface", "org.kde.kdeconnect.device.mprisremote")
+    propertiesChanged = pyqtSignal()
+    value = 0
+
+    @pyqtProperty(bool)
+    def isPlaying(self):
+        return True
+
+    @pyqtProperty(str)
+    def player(self):
+        return "vlc"
+
+    @pyqtProperty(str)
+    def album(self):
+        return f"Album {self.value}"
+
+    @pyqtProperty(str)
+    def artist(self):
+        return "Artist"
+
+    @pyqtProperty(str)
+    def albumArtUrl(self):
+        return "file://" + cover_path(self.value)
+
+    @pyqtProperty(bool)
+    def canSeek(self):
+        return True
+
+    @pyqtProperty("QStringList")
+    def playerList(self):
+        return ["vlc"]
+
+    @pyqtSlot()
+    def requestPlayerList(self):
+        pass
+
+    def emit(self, value: int) -> None:
+        self.value = value
+        self.propertiesChanged.emit()
+
+class NotificationAdaptor(QDBusAbstractAdaptor):
+    Q_CLASSINFO("D-Bus Interface", "org.kde.kdeconnect.device.notifications.notification")
+
+    def __init__(self, parent: QObject, notifications: "NotificationsAdaptor", public_id: str, value: int) -> None:
+        super().__init__(parent)
+        self._notifications = notifications
+        self._public_id = public_id
+        self._value = value
+
+    @pyqtProperty(str)
+    def appName(self):
+        return "Chat"
+
+    @pyqtProperty(str)
+    def title(self):
+        return "Chat"
+
+    @pyqtProperty(str)
+    def text(self):
+        return f"Message {self._value}"
+
+    @pyqtProperty(str)
+    def ticker(self):
+        return f"Chat: Message {self._value}"
+
+    @pyqtProperty(bool)
+    def dismissable(self):
+        return True
+
+    @pyqtProperty(bool)
+    def silent(self):
+        return False
+
+    @pyqtSlot()
+    def dismiss(self):
+        self._notifications.remove(self._public_id)
+
+class NotificationsAdaptor(QDBusAbstractAdaptor):
+    Q_CLASSINFO("D-Bus Interface", "org.kde.kdeconnect.device.notifications")
+    notificationPosted = pyqtSignal(str)
+    notificationUpdated = pyqtSignal(str)
+    notificationRemoved = pyqtSignal(str)
+    allNotificationsRemoved = pyqtSignal()
+    value = 0
+    # path of the plugin object, the notifications are registered below it
+    path = ""
+
+    def __init__(self, parent: QObject) -> None:
+        super().__init__(parent)
+        # public id -> (object, adaptor)
+        self._notifications = {}
+
+    @pyqtSlot(result="QStringList")
+    def activeNotifications(self):
+        return list(self._notifications)
+
+    def remove(self, public_id: str) -> None:
+        if self._notifications.pop(public_id, None) is not None:
+            QDBusConnection.sessionBus().unregisterObject(f"{self.path}/{public_id}")
+            self.notificationRemoved.emit(public_id)
+
+    def emit(self, value: int) -> None:
+        # every value is a new notification, the number of active notifications equals the value
+        self.value = value
+        public_id = str(value)
+        obj = QObject()
+        self._notifications[public_id] = (obj, NotificationAdaptor(obj, self, public_id, value))
+        QDBusConnection.sessionBus().registerObject(f"{self.path}/{public_id}", obj)
+        self.notificationPosted.emit(public_id)
+
+class ShareAdaptor(QDBusAbstractAdaptor):
+    Q_CLASSINFO("D-Bus Interface", "org.kde.kdeconnect.device.share")
+
+    @pyqtSlot(str)
+    def shareUrl(self, url):
+        pass
+
+PLUGIN_ADAPTORS = {
+    "battery": BatteryAdaptor,
+    "lockdevice": LockDeviceAdaptor,
+    "connectivity_report": ConnectivityReportAdaptor,
+    "findmyphone": FindMyPhoneAdaptor,
+    "ping": PingAdaptor,
+    "remotesystemvolume": RemoteSystemVolumeAdaptor,
+    "mprisremote": MprisRemoteAdaptor,
+    "notifications": NotificationsAdaptor,
+    "share": ShareAdaptor,
+}
+
+# kinds of events that can be emitted -> plugin that emits them
+EVENT_PLUGINS = {
+    "battery": "battery",
+    "lock": "lockdevice",
+    "connectivity": "connectivity_report",
+    "volume": "remotesystemvolume",
+    "mpris": "mprisremote",
+    "notifications": "notifications",
+}
+
+class BenchAdaptor(QDBusAbstractAdaptor):
+    """Lets the benchmark emit signals of the plugins.
+    """
+    Q_CLASSINFO("D-Bus Interface", "org.kde.kdeconnect.bench")
+
+    def __init__(self, parent: QObject, fake: "FakeKDEConnect") -> None:
+        super().__init__(parent)
+        self._fake = fake
+
+    @pyqtSlot(str, str, int, int)
+    def emit(self, kind, device_id, count, interval_ms):
+        """Emit `count` signals of a kind, e.g. "battery", every `interval_ms`. Each signal carries a new value.
+        """
+        self._fake.emit(kind, device_id, count, interval_ms)
+
+    @pyqtSlot(result=str)
+    def takeLog(self):
+        """Returns the emitted signals as json list of [monotonic time, kind, device id, value] and clears it.
+        """
+        return self._fake.take_log()
+
+class FakeKDEConnect():
+    def __init__(self, num_devices: int) -> None:
+        self._bus = QDBusConnection.sessionBus()
+        self._device_ids = [f"bench{i}" for i in range(num_devices)]
+        # the objects must be kept alive as long as they are registered
+        self._objects = []
+        self._adaptors = {}
+        self._log = []
+        self._register(num_devices)
+
+    def _register_object(self, path: str, adaptor_cls, *args):
+        obj = QObject()
+        adaptor = adaptor_cls(obj, *args)
+        self._objects.append((obj, adaptor))
+        self._bus.registerObject(path, obj)
+        return adaptor
+
+    def _register(self, num_devices: int):
+        self._register_object("/modules/kdeconnect", DaemonAdaptor, self._device_ids)
+        for index, device_id in enumerate(self._device_ids):
+            base_path = f"/modules/kdeconnect/devices/{device_id}"
+            self._register_object(base_path, DeviceAdaptor, index)
+            for plugin_name, adaptor_cls in PLUGIN_ADAPTORS.items():
+                adaptor = self._register_object(f"{base_path}/{plugin_name}", adaptor_cls)
+                if isinstance(adaptor, NotificationsAdaptor):
+                    adaptor.path = f"{base_path}/{plugin_name}"
+                self._adaptors[(device_id, plugin_name)] = adaptor
+        self._register_object("/bench", BenchAdaptor, self)
+        if not self._bus.registerService(SERVICE):
+            raise RuntimeError(f"Could not register {SERVICE}, is another daemon running on this bus?")
+
+    def emit(self, kind: str, device_id: str, count: int, interval_ms: int):
+        adaptor = self._adaptors[(device_id, EVENT_PLUGINS[kind])]
+        for i in range(count):
+            QTimer.singleShot(i * interval_ms, lambda: self._emit_next(kind, device_id, adaptor))
+
+    def _emit_next(self, kind: str, device_id: str, adaptor):
+        if kind == "lock":
+            value = not adaptor.value
+        elif kind == "battery":
+            # 1-100, never the same value twice in a row
+            value = adaptor.value % 100 + 1
+        elif kind == "volume":
+            value = (adaptor.value + 655) % 65536
+        else:
+            value = adaptor.value + 1
+        self._log.append((time.monotonic(), kind, device_id, value))
+        adaptor.emit(value)
+
+    def take_log(self) -> str:
+        log = json.dumps(self._log)
+        self._log = []
+        return log
+
+def main():
+    app = QCoreApplication(sys.argv)
+    num_devices = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    fake = FakeKDEConnect(num_devices)
+    print(f"Registered {SERVICE} with {num_devices} devices", flush=True)
+    sys.exit(app.exec_())
+
+if __name__ == "__main__":
+    main()
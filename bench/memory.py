@@ -0,0 +1,151 @@
+"""Memory benchmark of the bridge, no phones or KDE Connect needed.
+
+For every device count a private dbus-daemon is started with a fake KDE Connect daemon
+(fakekdeconnect.py) on it and the bridge is run in a child process against a built-in broker.
+Once all devices are onboarded, the child reports the memory allocated by Python since the
+bridge was created (tracemalloc) and its resident set size. The result is printed as json:
+
+* per run: devices, entities, allocated bytes and rss
+* bytes per device and per entity: growth between the smallest and the largest device count,
+  the memory the bridge needs regardless of the devices is not part of it
+
+Usage: python bench/memory.py [--devices 1 50] [--engine qt asyncio] [--output result.json]
+
+Requires dbus-daemon in PATH and Linux for rss readings, and dbus-next for the asyncio engine.
+"""
+import argparse
+import gc
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from benchmark import BENCH_DIR, rss_kb
+from broker import LocalBroker
+
+# seconds to wait for the bridge to onboard all devices
+ONBOARD_TIMEOUT = 120
+
+class MemoryRun():
+    """One run of the bridge with a number of devices on a private bus.
+    """
+
+    def __init__(self, num_devices: int, broker: LocalBroker, engine: str) -> None:
+        self._num_devices = num_devices
+        self._broker = broker
+        self._engine = engine
+        self._processes = []
+
+    def run(self) -> dict:
+        try:
+            return self._run()
+        finally:
+            for process in reversed(self._processes):
+                process.terminate()
+                process.wait()
+
+    def _start(self, args: list[str], env: dict[str, str]) -> subprocess.Popen:
+        process = subprocess.Popen(args, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        self._processes.append(process)
+        return process
+
+    def _run(self) -> dict:
+        bus = self._start(["dbus-daemon", "--session", "--nofork", "--print-address=1"], dict(os.environ))
+        env = dict(os.environ, DBUS_SESSION_BUS_ADDRESS=bus.stdout.readline().strip())
+        fake = self._start([sys.executable, os.path.join(BENCH_DIR, "fakekdeconnect.py"), str(self._num_devices)], env)
+        fake.stdout.readline()
+        child = self._start([sys.executable, os.path.abspath(__file__), "--measure", self._broker.host, str(self._broker.port),
+                             self._engine, str(self._num_devices)], env)
+        for line in child.stdout:
+            if line.startswith("MEMORY "):
+                return {"devices": self._num_devices, "engine": self._engine} | json.loads(line[len("MEMORY "):])
+        raise RuntimeError(f"The bridge did not onboard {self._num_devices} devices")
+
+def measure(host: str, port: int, engine_name: str, num_devices: int) -> None:
+    """Runs in the child: creates the bridge, waits until all devices are onboarded and prints the memory.
+    """
+    sys.path.insert(0, os.path.join(BENCH_DIR, "..", "app"))
+    from ha_mqtt_discoverable import Settings
+    from mqttkonnect import MqttDaemon
+    import engine
+
+    if engine_name == "asyncio":
+        import asyncio
+        from dbus_next.aio import MessageBus
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        engine.use_asyncio(loop, loop.run_until_complete(MessageBus().connect()))
+        run, stop = loop.run_forever, loop.stop
+    else:
+        from PyQt5.QtCore import QCoreApplication
+        app = QCoreApplication(sys.argv)
+        run, stop = app.exec_, app.quit
+
+    mqtt_settings = Settings.MQTT(host=host, port=port, client_name="kdeconnect-bench-memory")
+    # modules are imported, only what the bridge allocates from here on is traced
+    gc.collect()
+    tracemalloc.start()
+    mqtt_daemon = MqttDaemon(mqtt_settings)
+    deadline = time.monotonic() + ONBOARD_TIMEOUT
+
+    def check():
+        if len(mqtt_daemon._mqtt_devices) < num_devices and time.monotonic() < deadline:
+            engine.call_later(0.1, check)
+            return
+        gc.collect()
+        allocated, _ = tracemalloc.get_traced_memory()
+        entities = sum(len(entities) for entities in mqtt_daemon._mqtt_session._device_entities.values())
+        print("MEMORY " + json.dumps({"entities": entities, "allocated_bytes": allocated, "rss_kb": rss_kb(os.getpid())}), flush=True)
+        stop()
+
+    engine.call_later(0.1, check)
+    run()
+
+def main():
+    if len(sys.argv) == 6 and sys.argv[1] == "--measure":
+        measure(sys.argv[2], int(sys.argv[3]), sys.argv[4], int(sys.argv[5]))
+        return
+
+    parser = argparse.ArgumentParser(description="Measure the memory the bridge needs per device and per entity")
+    parser.add_argument("--devices", type=int, nargs="+", default=[1, 50], help="device counts to run with")
+    parser.add_argument("--engine", nargs="+", choices=["qt", "asyncio"], default=["qt"], help="engines the bridge runs on")
+    parser.add_argument("--output", help="file to write the result to instead of stdout")
+    args = parser.parse_args()
+
+    if shutil.which("dbus-daemon") is None:
+        parser.error("dbus-daemon not found")
+
+    broker = LocalBroker()
+    broker.start()
+    runs = []
+    try:
+        for engine_name in args.engine:
+            for num_devices in sorted(args.devices):
+                runs.append(MemoryRun(num_devices, broker, engine_name).run())
+    finally:
+        broker.stop()
+
+    result = {"python": sys.version.split()[0], "runs": runs}
+    for engine_name in args.engine:
+        engine_runs = [run for run in runs if run["engine"] == engine_name]
+        first, last = engine_runs[0], engine_runs[-1]
+        if last["devices"] == first["devices"]:
+            continue
+        per_device = (last["allocated_bytes"] - first["allocated_bytes"]) / (last["devices"] - first["devices"])
+        entities_per_device = (last["entities"] - first["entities"]) / (last["devices"] - first["devices"])
+        result.setdefault("bytes_per_device", {})[engine_name] = round(per_device)
+        if entities_per_device:
+            result.setdefault("bytes_per_entity", {})[engine_name] = round(per_device / entities_per_device)
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
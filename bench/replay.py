@@ -0,0 +1,176 @@
+"""Replays a D-Bus trace of the bridge as a load test, no phones, KDE Connect or D-Bus needed.
+
+A trace is recorded from a running bridge with `dbustrace.record` (see app/dbustrace.py). The
+replay runs the bridge in this process against a stand-in bus that answers its calls from the
+trace and against a built-in broker. Once the bridge started up, the signals of the trace are
+emitted in their recorded rhythm, sped up by `--speed`, or as fast as the bridge takes them
+with `--speed 0`. The result is printed as json:
+
+* signals emitted and delivered to a handler, the throughput in signals per second
+* calls answered from the trace and calls that were not in it
+* publishes in total and per topic for the topics published most
+* latency from a signal until the next publish, percentiles in ms
+
+Usage: python bench/replay.py trace.jsonl.gz [--speed 1] [--engine qt|asyncio] [--broker host:port] [--output result.json]
+"""
+import argparse
+import bisect
+import json
+import logging
+import os
+import sys
+import time
+
+from benchmark import BENCH_DIR, percentiles
+from broker import LocalBroker
+
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "app"))
+
+from ha_mqtt_discoverable import Settings
+from dbustrace import ReplayBus
+from mqttkonnect import MqttDaemon
+from mqttsession import MqttSession
+import engine
+
+# seconds without calls and publishes after which the bridge is considered started
+SETTLE_TIME = 0.5
+# seconds to give up after if the bridge doesn't settle or publish
+TIMEOUT = 120
+# topics listed with their publish count
+TOP_TOPICS = 10
+
+class Replay():
+    """One replay of a trace through the bridge.
+    """
+
+    def __init__(self, trace_path: str, speed: float, engine_name: str, host: str, port: int, quiet: float) -> None:
+        self._bus = ReplayBus(trace_path, speed)
+        self._speed = speed
+        self._engine_name = engine_name
+        self._host = host
+        self._port = port
+        self._quiet = quiet
+        self._signal_times = []
+        # (monotonic time, topic)
+        self._publishes = []
+        self._done_time = None
+        self._deadline = None
+        self._mqtt_daemon = None
+
+    def run(self) -> dict:
+        if self._engine_name == "asyncio":
+            import asyncio
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            # the stand-in bus replaces the bus connection
+            engine.use_asyncio(loop, None)
+            run, self._stop = loop.run_forever, loop.stop
+        else:
+            from PyQt5.QtCore import QCoreApplication
+            app = QCoreApplication.instance() or QCoreApplication(sys.argv)
+            run, self._stop = app.exec_, app.quit
+        engine.use_transport_factory(self._bus.create_transport)
+
+        mqtt_settings = Settings.MQTT(host=self._host, port=self._port, client_name="kdeconnect-bench-replay")
+        self._mqtt_daemon = MqttDaemon(mqtt_settings)
+        session_client = self._mqtt_daemon._mqtt_session.client
+        publish = session_client._publish
+
+        def tapped_publish(topic, payload=None, qos=0, retain=False):
+            self._publishes.append((time.monotonic(), topic))
+            return publish(topic, payload, qos, retain)
+        session_client._publish = tapped_publish
+
+        self._deadline = time.monotonic() + TIMEOUT
+        # the bridge publishes its discovery again if the broker didn't retain it, not before this check
+        engine.call_later(MqttSession.RETAINED_CHECK_TIMEOUT + SETTLE_TIME, self._wait_settled)
+        run()
+        engine.use_transport_factory(None)
+        return self._result()
+
+    def _wait_settled(self) -> None:
+        last = max([self._bus.last_call] + [publish_time for publish_time, _ in self._publishes[-1:]])
+        if time.monotonic() - last < SETTLE_TIME and time.monotonic() < self._deadline:
+            engine.call_later(0.1, self._wait_settled)
+            return
+        self._startup_publishes = len(self._publishes)
+        self._calls_before = (self._bus.calls_answered, self._bus.calls_missing)
+        self._bus.start(self._signal_times.append, self._emitted_all)
+
+    def _emitted_all(self) -> None:
+        self._done_time = time.monotonic()
+        self._deadline = self._done_time + TIMEOUT
+        engine.call_later(self._quiet, self._wait_quiet)
+
+    def _wait_quiet(self) -> None:
+        last = max([self._done_time] + [publish_time for publish_time, _ in self._publishes[-1:]])
+        if time.monotonic() - last < self._quiet and time.monotonic() < self._deadline:
+            engine.call_later(0.1, self._wait_quiet)
+            return
+        self._stop()
+
+    def _result(self) -> dict:
+        publishes = self._publishes[self._startup_publishes:]
+        publish_times = [publish_time for publish_time, _ in publishes]
+        latencies = []
+        for signal_time in self._signal_times:
+            index = bisect.bisect_left(publish_times, signal_time)
+            if index < len(publish_times):
+                latencies.append((publish_times[index] - signal_time) * 1000)
+        topics = {}
+        for _, topic in publishes:
+            topics[topic] = topics.get(topic, 0) + 1
+        first = self._signal_times[0] if self._signal_times else 0.0
+        last = max([self._done_time or first] + publish_times[-1:])
+        seconds = last - first
+        calls_answered, calls_missing = self._calls_before
+        return {
+            "engine": self._engine_name,
+            "speed": self._speed,
+            "trace_seconds": round(self._bus.duration, 3),
+            "replay_seconds": round(seconds, 3),
+            "signals": len(self._signal_times),
+            "signals_delivered": self._bus.signals_delivered,
+            "signals_per_second": round(len(self._signal_times) / seconds, 1) if seconds > 0 else None,
+            "dbus_calls": self._bus.calls_answered - calls_answered,
+            "dbus_calls_not_in_trace": self._bus.calls_missing - calls_missing,
+            "publishes": len(publishes),
+            "top_topics": dict(sorted(topics.items(), key=lambda item: -item[1])[:TOP_TOPICS]),
+            "latency_ms": percentiles(latencies),
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a D-Bus trace through the bridge")
+    parser.add_argument("trace", help="trace file recorded with dbustrace.record")
+    parser.add_argument("--speed", type=float, default=1.0, help="factor the trace is sped up by, 0 replays as fast as possible")
+    parser.add_argument("--engine", choices=["qt", "asyncio"], default="qt", help="engine the bridge runs on")
+    parser.add_argument("--quiet", type=float, default=2.5, help="seconds without publishes after the last signal after which the replay is done")
+    parser.add_argument("--broker", help="host:port of an MQTT broker to use instead of the built-in one")
+    parser.add_argument("--output", help="file to write the result to instead of stdout")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    broker = None
+    if args.broker:
+        broker_host, broker_port = args.broker.rsplit(":", 1)
+        broker_port = int(broker_port)
+    else:
+        broker = LocalBroker()
+        broker.start()
+        broker_host, broker_port = broker.host, broker.port
+    try:
+        result = Replay(args.trace, args.speed, args.engine, broker_host, broker_port, args.quiet).run()
+    finally:
+        if broker is not None:
+            broker.stop()
+
+    result = {"python": sys.version.split()[0], "trace": args.trace} | result
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()